@@ -0,0 +1,136 @@
+# Copyright (C) 2025 Colin Damon
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Serialized model artifacts for SpotR FastAPI backend
+
+Responsibilities:
+ - Save a ready-to-run (already quantized) model with a checksum manifest
+ - Verify an artifact's checksum and torch version before loading it
+ - Load an artifact with its weights memory-mapped from disk
+ - Checksum exported models (e.g. ONNX files) the same way
+
+An artifact is either a pickled nn.Module written by torch.save (loaded
+with its weights memory-mapped), or a TorchScript archive for models
+whose modules cannot be unpickled, such as statically quantized ones.
+Either way a JSON manifest sits next to it at "<artifact>.json".
+Loading one skips building the architecture, reading the fp32 state
+dict and quantizing it.
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import time
+import torch
+
+
+class ArtifactError(Exception):
+    """Raised when an artifact is missing, corrupt or stale"""
+
+
+def manifest_path(artifact_path):
+    return f"{artifact_path}.json"
+
+
+def file_sha256(path):
+    """Returns: hex SHA-256 of a file, hashed through a read-only mmap"""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return hashlib.sha256().hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return hashlib.sha256(mm).hexdigest()
+
+
+def write_manifest(artifact_path, artifact_format, **metadata):
+    """
+    Checksums artifact_path and writes its manifest next to it.
+    Returns: the manifest dictionary
+    """
+    manifest = {
+        "format": artifact_format,
+        "sha256": file_sha256(artifact_path),
+        "size_bytes": os.path.getsize(artifact_path),
+        "torch_version": torch.__version__,
+        "quantized_engine": torch.backends.quantized.engine,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        **metadata,
+    }
+    with open(manifest_path(artifact_path), "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def save_model_artifact(model, artifact_path, **metadata):
+    """
+    Writes model to artifact_path and its manifest next to it.
+    Extra keyword arguments are stored in the manifest as-is.
+    Returns: the manifest dictionary
+    """
+    start = time.perf_counter()
+    if isinstance(model, torch.jit.ScriptModule):
+        artifact_format = "torchscript"
+        torch.jit.save(model, artifact_path)
+    else:
+        artifact_format = "pickle"
+        torch.save(model, artifact_path)
+    return write_manifest(
+        artifact_path, artifact_format, save_seconds=round(time.perf_counter() - start, 3), **metadata
+    )
+
+
+def read_manifest(artifact_path):
+    """Returns: the artifact's manifest, or raises ArtifactError"""
+    if not os.path.exists(artifact_path):
+        raise ArtifactError(f"artifact not found: {artifact_path}")
+    try:
+        with open(manifest_path(artifact_path)) as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        raise ArtifactError(f"unreadable manifest for {artifact_path}: {e}") from e
+
+
+def verify_checksum(artifact_path):
+    """Returns: the artifact's manifest once its checksum matches, or raises ArtifactError"""
+    manifest = read_manifest(artifact_path)
+    if file_sha256(artifact_path) != manifest.get("sha256"):
+        raise ArtifactError(f"checksum mismatch for {artifact_path}")
+    return manifest
+
+
+def load_model_artifact(artifact_path):
+    """
+    Verifies and loads an artifact written by save_model_artifact.
+    Returns: (model, manifest), or raises ArtifactError
+    """
+    manifest = verify_checksum(artifact_path)
+    if manifest.get("torch_version") != torch.__version__:
+        raise ArtifactError(
+            f"artifact built with torch {manifest.get('torch_version')}, running {torch.__version__}"
+        )
+
+    engine = manifest.get("quantized_engine")
+    if engine and engine in torch.backends.quantized.supported_engines:
+        torch.backends.quantized.engine = engine
+    try:
+        if manifest.get("format") == "torchscript":
+            model = torch.jit.load(artifact_path, map_location="cpu")
+        else:
+            model = torch.load(artifact_path, map_location="cpu", mmap=True, weights_only=False)
+    except Exception as e:
+        raise ArtifactError(f"failed to load {artifact_path}: {e}") from e
+    model.eval()
+    return model, manifest
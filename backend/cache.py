@@ -0,0 +1,160 @@
+# Copyright (C) 2025 Colin Damon
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Prediction result cache for SpotR FastAPI backend
+
+Responsibilities:
+ - Cache prediction results keyed by a hash of the uploaded bytes
+ - Optionally key results by a perceptual hash to catch re-encoded copies
+ - Bound the cache by entry count, memory and age (LRU + TTL)
+ - Drop every entry when the serving model's version changes
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+from PIL import Image
+
+
+PREDICTION_CACHE_ENTRIES = int(os.getenv("SPOTR_PREDICTION_CACHE_ENTRIES", "2048"))
+PREDICTION_CACHE_MB = float(os.getenv("SPOTR_PREDICTION_CACHE_MB", "8"))
+PREDICTION_CACHE_TTL_SECONDS = float(os.getenv("SPOTR_PREDICTION_CACHE_TTL_SECONDS", "3600"))
+PREDICTION_CACHE_PHASH = os.getenv("SPOTR_PREDICTION_CACHE_PHASH", "0") == "1"
+
+# Rough per-entry overhead of the OrderedDict slot, tuple and key string
+_ENTRY_OVERHEAD_BYTES = 256
+
+
+def content_key(image_bytes):
+    """Returns: cache key for the exact uploaded bytes"""
+    return "sha256:" + hashlib.sha256(image_bytes).hexdigest()
+
+
+def perceptual_hash(image: Image.Image):
+    """
+    Accepts a decoded PIL image
+    Returns: 64-bit difference hash (dHash) as a cache key
+
+    Re-encoded or resized copies of the same photo usually share a dHash.
+    """
+    small = image.convert("L").resize((9, 8), Image.Resampling.BILINEAR)
+    pixels = small.tobytes()
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            bits = (bits << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return f"dhash:{bits:016x}"
+
+
+class PredictionCache:
+    """
+    LRU + TTL cache of prediction result dictionaries.
+
+    Keys are only valid for one model version: set_model_version() clears
+    the cache whenever the version of the serving model changes.
+    """
+    def __init__(self, max_entries=PREDICTION_CACHE_ENTRIES, max_mb=PREDICTION_CACHE_MB,
+                 ttl_seconds=PREDICTION_CACHE_TTL_SECONDS, use_phash=PREDICTION_CACHE_PHASH):
+        self.max_entries = max_entries
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.ttl_seconds = ttl_seconds
+        self.use_phash = use_phash
+        self.model_version = None
+        self._entries = OrderedDict()
+        self._size_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = Counter()
+        self.misses = Counter()
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def set_model_version(self, version):
+        """Clear every entry if the serving model's version has changed"""
+        with self._lock:
+            if version != self.model_version:
+                if self._entries:
+                    self.invalidations += 1
+                self._entries.clear()
+                self._size_bytes = 0
+                self.model_version = version
+
+    def get(self, key):
+        """Returns: cached result dictionary, or None"""
+        kind = key.split(":", 1)[0]
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses[kind] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits[kind] += 1
+            return entry[1]
+
+    def put(self, key, result):
+        nbytes = len(key) + len(json.dumps(result)) + _ENTRY_OVERHEAD_BYTES
+        if self.max_entries <= 0 or nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, result, nbytes)
+            self._size_bytes += nbytes
+            while len(self._entries) > self.max_entries or self._size_bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        _, _, nbytes = self._entries.pop(key)
+        self._size_bytes -= nbytes
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size_bytes = 0
+
+    def stats(self):
+        """Returns: cache size and hit/miss counters as a dictionary"""
+        return {
+            "model_version": self.model_version,
+            "entries": len(self._entries),
+            "size_kb": round(self._size_bytes / 1024, 1),
+            "max_entries": self.max_entries,
+            "max_mb": round(self.max_bytes / (1024 * 1024), 1),
+            "ttl_seconds": self.ttl_seconds,
+            "perceptual_hash": self.use_phash,
+            "hits": dict(self.hits),
+            "misses": dict(self.misses),
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+        }
+
+
+_prediction_cache = None
+
+def get_prediction_cache():
+    global _prediction_cache
+    if _prediction_cache is None:
+        _prediction_cache = PredictionCache()
+    return _prediction_cache
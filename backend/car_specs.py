@@ -17,17 +17,31 @@
 Car specs API client module for SpotR FastAPI backend
 
 Responsibilities:
- - Construct and send requests to API Ninja's CarAPI for specs
+ - Look up specs from API Ninja's CarAPI (see backend.specs_client)
  - Parse a class name string into make/model/year
  - Parse API responses into dictionaries
+ - Answer lookups from the offline snapshot, then the persistent specs cache
+ - Serve expired cache entries while refreshing them in the background
+ - Prefetch specs for a prediction's candidate classes, each within a deadline
 """
 
+import asyncio
 import os
-import requests
+import time
 from dotenv import load_dotenv
+from backend.metrics import SPECS_CACHE_LOOKUPS, SPECS_SNAPSHOT_LOOKUPS
+from backend.specs_cache import MISS, get_specs_cache
+from backend.specs_snapshot import SPECS_LIVE_FALLBACK, get_specs_snapshot
+from backend.specs_client import get_specs_client
 
 
 load_dotenv()
+# Candidate classes whose specs /identify looks up, best first
+IDENTIFY_SPECS_CANDIDATES = int(os.getenv("SPOTR_IDENTIFY_SPECS_CANDIDATES", "3"))
+# How long /identify waits on each specs lookup from when it starts
+IDENTIFY_SPECS_DEADLINE_SECONDS = float(os.getenv("SPOTR_IDENTIFY_SPECS_DEADLINE_SECONDS", "0.5"))
+
+
 def get_api_key():
     return os.getenv("API_NINJAS_KEY")
 
@@ -74,25 +88,106 @@ def _parse_api_output(raw_out):
     return specs
 
 
-def fetch_car_specs(pred_class):
+_refresh_tasks = set()
+
+
+async def _refresh(key, api_key, cache):
+    """Looks key up again and stores the answer if it is definite"""
+    data, definite = await get_specs_client().fetch(key, api_key)
+    if definite:
+        await asyncio.to_thread(cache.put, key, _parse_api_output(data) if data else None)
+
+
+async def fetch_car_specs(pred_class):
     """
-    Fetches car specs from the API Ninjas Cars API.
+    Fetches car specs from the offline snapshot, the specs cache, or else
+    the API Ninjas Cars API. Expired cache entries are returned as they
+    are and refreshed in the background (stale-while-revalidate).
     Returns: list of dicts, or None on error.
     """
-    year, make, model = _parse_class_name(pred_class)
-    api_key = get_api_key()
-    if not api_key:
+    specs = get_specs_snapshot().get(pred_class)
+    if specs is not MISS:
+        SPECS_SNAPSHOT_LOOKUPS["hit"].inc()
+        return specs
+    SPECS_SNAPSHOT_LOOKUPS["miss"].inc()
+    if not SPECS_LIVE_FALLBACK:
         return None
 
-    url = "https://api.api-ninjas.com/v1/cars"
-    params = {"year":year, "make":make, "model": model}
-    headers = {"X-Api-Key": api_key}
-    try:
-        response = requests.get(url, headers=headers, params=params, timeout=10)
-        if response.status_code == 200:
-            data = response.json()
-            if isinstance(data, list) and data:
-                return _parse_api_output(data)
-        return None
-    except Exception:
+    key = _parse_class_name(pred_class)
+    cache = get_specs_cache() if None not in key else None
+    api_key = get_api_key()
+    if cache is not None:
+        # SQLite may wait on another worker's write lock: keep it off the event loop
+        cached, fresh = await asyncio.to_thread(cache.lookup, key)
+        if cached is not MISS and fresh:
+            SPECS_CACHE_LOOKUPS["hit" if cached is not None else "negative_hit"].inc()
+            return cached
+        if cached is not MISS:
+            SPECS_CACHE_LOOKUPS["stale"].inc()
+            if api_key:
+                task = asyncio.ensure_future(_refresh(key, api_key, cache))
+                _refresh_tasks.add(task)
+                task.add_done_callback(_refresh_tasks.discard)
+            return cached
+        SPECS_CACHE_LOOKUPS["miss"].inc()
+
+    if not api_key or None in key:
         return None
+
+    data, definite = await get_specs_client().fetch(key, api_key)
+    specs = _parse_api_output(data) if data else None
+    if cache is not None and definite:
+        await asyncio.to_thread(cache.put, key, specs)
+    return specs
+
+
+class SpecsPrefetch:
+    """
+    Specs lookups for one request's candidate classes.
+
+    Lookups can be started before the final prediction is known (e.g. from
+    the cascade's provisional candidates) and from other threads. Each is
+    waited on until its own deadline, counted from when it started; ones
+    still running after that are left to finish in the background, so
+    they still fill the specs cache.
+    """
+    def __init__(self, deadline_seconds=IDENTIFY_SPECS_DEADLINE_SECONDS):
+        self.deadline_seconds = deadline_seconds
+        self._loop = asyncio.get_running_loop()
+        self._tasks = {}
+
+    def start(self, pred_classes):
+        """Starts lookups of pred_classes not already started; on the event loop only"""
+        for pred_class in pred_classes:
+            if pred_class not in self._tasks:
+                task = asyncio.ensure_future(fetch_car_specs(pred_class))
+                _refresh_tasks.add(task)
+                task.add_done_callback(_refresh_tasks.discard)
+                self._tasks[pred_class] = (task, time.monotonic() + self.deadline_seconds)
+
+    def start_threadsafe(self, pred_classes):
+        """Same as start(), callable from any thread"""
+        self._loop.call_soon_threadsafe(self.start, list(pred_classes))
+
+    async def results(self, pred_classes):
+        """
+        Starts any lookups not yet started and waits for them, each until its deadline
+        Returns: {class name: (specs dictionary or None, status)}, status
+            being "found", "unavailable" (no data, or the API failed),
+            "timeout" or "error"
+        """
+        self.start(pred_classes)
+        tasks = [self._tasks[pred_class] for pred_class in pred_classes]
+        if tasks:
+            timeout = max(0.0, max(deadline for _, deadline in tasks) - time.monotonic())
+            await asyncio.wait([task for task, _ in tasks], timeout=timeout)
+        results = {}
+        for pred_class, (task, _) in zip(pred_classes, tasks):
+            if not task.done():
+                results[pred_class] = (None, "timeout")
+            elif task.exception() is not None:
+                results[pred_class] = (None, "error")
+            else:
+                specs = task.result()
+                results[pred_class] = (specs, "found" if specs is not None else "unavailable")
+        return results
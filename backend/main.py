@@ -24,16 +24,51 @@ Responsibilities:
 This is the entry point for the SpotR backend service.
 """
 
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import FastAPI, File, UploadFile, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from PIL import Image
-import io
-import gc
+from fastapi.responses import FileResponse, Response
+from contextlib import asynccontextmanager
+import asyncio
+import json
+import logging
+import os
+import time
 import psutil
-from backend.car_specs import fetch_car_specs
-from backend.model import get_model_instance
+from PIL import Image
+from backend.car_specs import IDENTIFY_SPECS_CANDIDATES, SpecsPrefetch, fetch_car_specs
+from backend.dataset import CAR_DATASET_INFO
+from backend.model import (
+    BATCH_MAX_SIZE, BATCH_PREDICT_IN_FLIGHT, get_model_instance, get_batch_scheduler, get_inference_executor,
+    get_serving_version,
+)
+from backend.workers import close_inference_pool, get_inference_pool
+from backend.residency import get_residency_manager
+from backend.cache import content_key, get_prediction_cache, perceptual_hash
+from backend.specs_cache import get_specs_cache
+from backend.specs_client import BREAKER_STATES, get_specs_client
+from backend.specs_snapshot import get_specs_snapshot
+from backend.uploads import (
+    MAX_IMAGE_PIXELS, BodyStreamingResponse, SpooledBody, UploadRejected, UploadSizeLimitMiddleware,
+    iter_batch_items, max_batch_upload_bytes, max_upload_bytes, probe_image, read_upload, spool_body,
+)
+from backend.metrics import CONTENT_TYPE, PREDICT_STAGE_SECONDS, REGISTRY, RequestsInFlightMiddleware
+from backend.profiling import PROFILE_HEADER, get_profile_store, server_timing
+
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # inference worker processes (if configured) load the model at startup
+    get_inference_pool(BATCH_MAX_SIZE)
+    # and the offline specs snapshot is indexed before the first request
+    get_specs_snapshot()
+    yield
+    close_inference_pool()
+    await get_specs_client().close()
+
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -41,51 +76,348 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing", "X-SpotR-Profile-Id", "X-SpotR-Profile-Url"],
 )
 
 
-@app.middleware("http")
-async def memory_cleanup_middleware(request, call_next):
-    """Clean up memory after each request"""
-    response = await call_next(request)
-    gc.collect()
+# counts streamed responses (/predict/batch) until their last line is sent
+app.add_middleware(RequestsInFlightMiddleware)
 
-    memory_percent = psutil.virtual_memory().percent
-    if memory_percent > 85:
-        model_instance = get_model_instance()
-        model_instance.clear_model()
-        gc.collect()
 
-    return response
+def _upload_limit(path):
+    """Returns: the body size cap for POSTs to path"""
+    # batch uploads are spooled to disk, so they get a limit of their own
+    return max_batch_upload_bytes() if path == "/predict/batch" else max_upload_bytes()
+
+
+app.add_middleware(UploadSizeLimitMiddleware, max_bytes=_upload_limit)
+
+
+def _prepare_upload(model_instance, image_bytes, with_phash):
+    """
+    Decodes and preprocesses an upload on the inference executor
+    Returns: (input tensor, perceptual hash key or None, [(stage, seconds), ...])
+    """
+    start = time.perf_counter()
+    try:
+        image = model_instance.decode(image_bytes, max_pixels=MAX_IMAGE_PIXELS)
+    except Image.DecompressionBombError as e:
+        raise UploadRejected(413, str(e))
+    decoded = time.perf_counter()
+    PREDICT_STAGE_SECONDS["decode"].observe(decoded - start)
+
+    phash = perceptual_hash(image) if with_phash else None
+    input_tensor = model_instance.preprocess(image)
+    preprocessed = time.perf_counter()
+    PREDICT_STAGE_SECONDS["preprocess"].observe(preprocessed - decoded)
+    return input_tensor, phash, [("decode", decoded - start), ("preprocess", preprocessed - decoded)]
+
+
+def _predict_in_process(model_instance, image_bytes):
+    """
+    Runs one upload through the whole pipeline on the calling thread,
+    bypassing the cache and the batcher, so a profile covers only it
+    Returns: (result dictionary, [(stage, seconds), ...])
+    """
+    input_tensor, _, timings = _prepare_upload(model_instance, image_bytes, False)
+    start = time.perf_counter()
+    result = model_instance.predict_batch(input_tensor)[0]
+    return result, timings + [("inference", time.perf_counter() - start)]
+
+
+def _inference_timings(result, seconds):
+    """Returns: inference time, split into model-load and inference after a cold load"""
+    load_seconds = result.get("model_load_seconds")
+    if load_seconds:
+        return [("model-load", load_seconds), ("inference", max(0.0, seconds - load_seconds))]
+    return [("inference", seconds)]
 
 
 @app.post("/predict")
-async def predict_route(file: UploadFile):
+async def predict_route(file: UploadFile, request: Request, response: Response):
     try:
         if not file.content_type.startswith('image/'):
             raise HTTPException(status_code=400, detail="File must be an image")
 
-        image_bytes = await file.read()
-        image = Image.open(io.BytesIO(image_bytes))
+        start = time.perf_counter()
+        image_bytes = await read_upload(file)
+        upload_seconds = time.perf_counter() - start
+        PREDICT_STAGE_SECONDS["upload_read"].observe(upload_seconds)
+        timings = [("upload", upload_seconds)]
+        model_instance = get_model_instance()
+        loop = asyncio.get_running_loop()
 
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
+        if request.headers.get(PROFILE_HEADER) == "1":
+            if get_inference_pool(BATCH_MAX_SIZE) is not None:
+                raise HTTPException(status_code=400, detail="Profiling is unavailable with the inference pool")
+            probe_image(image_bytes)
+            (result, stage_timings), trace_id = await loop.run_in_executor(
+                get_inference_executor(), get_profile_store().profile,
+                _predict_in_process, model_instance, image_bytes,
+            )
+            response.headers["Server-Timing"] = server_timing(timings + stage_timings)
+            response.headers["X-SpotR-Profile-Id"] = trace_id
+            response.headers["X-SpotR-Profile-Url"] = f"/profiles/{trace_id}"
+            return {"pred_class": result["pred_class"], "stage": result["stage"]}
 
-        model_instance = get_model_instance()
-        pred_class = model_instance.predict(image)
+        # repeated uploads are answered from the cache without touching torch
+        cache = get_prediction_cache()
+        cache.set_model_version(get_serving_version())
+        key = content_key(image_bytes)
+        cached = cache.get(key)
+        if cached is not None:
+            response.headers["Server-Timing"] = server_timing(timings + [("cache", None)])
+            return cached
+
+        # format and pixel count come from the header, before any decode
+        probe_image(image_bytes)
 
-        del image, image_bytes
-        gc.collect()
+        # decode, preprocess and inference all run off the event loop
+        input_tensor, phash, stage_timings = await loop.run_in_executor(
+            get_inference_executor(), _prepare_upload, model_instance, image_bytes, cache.use_phash
+        )
+        timings += stage_timings
+        cached = cache.get(phash) if phash else None
+        if cached is not None:
+            cache.put(key, cached)
+            response.headers["Server-Timing"] = server_timing(timings + [("cache", None)])
+            return cached
+        start = time.perf_counter()
+        result = await asyncio.wrap_future(get_batch_scheduler().submit(input_tensor))
+        timings += _inference_timings(result, time.perf_counter() - start)
+        del image_bytes, input_tensor
 
-        return {"pred_class": pred_class}
+        start = time.perf_counter()
+        prediction = {"pred_class": result["pred_class"], "stage": result["stage"]}
+        cache.set_model_version(get_serving_version())
+        cache.put(key, prediction)
+        if phash:
+            cache.put(phash, prediction)
+        PREDICT_STAGE_SECONDS["postprocess"].observe(time.perf_counter() - start)
+        response.headers["Server-Timing"] = server_timing(timings)
+        return prediction
+    except HTTPException:
+        raise
+    except UploadRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Prediction failed: {str(e)}")
 
 
+async def _predict_batch_item(index, name, image_bytes, model_instance, cache):
+    """
+    Runs one image of a batch upload through the same pipeline as /predict
+    Returns: its NDJSON result line as a dictionary, with an error instead
+        of a prediction if it failed
+    """
+    line = {"index": index, "filename": name}
+    try:
+        if isinstance(image_bytes, UploadRejected):
+            raise image_bytes
+        key = content_key(image_bytes)
+        prediction = cache.get(key)
+        if prediction is None:
+            probe_image(image_bytes)
+            input_tensor, phash, _ = await asyncio.get_running_loop().run_in_executor(
+                get_inference_executor(), _prepare_upload, model_instance, image_bytes, cache.use_phash
+            )
+            del image_bytes
+            prediction = cache.get(phash) if phash else None
+            if prediction is None:
+                result = await asyncio.wrap_future(get_batch_scheduler().submit(input_tensor))
+                prediction = {"pred_class": result["pred_class"], "stage": result["stage"]}
+                if phash:
+                    cache.put(phash, prediction)
+            cache.put(key, prediction)
+        line.update(prediction)
+    except UploadRejected as e:
+        line.update(error=e.detail, status=e.status_code)
+    except Exception as e:
+        line.update(error=f"Prediction failed: {str(e)}", status=500)
+    return line
+
+
+async def _stream_batch(items, body, body_task):
+    """
+    Yields: one NDJSON line per image, in completion order, then a summary
+        line ("complete" is false if the body could not be read to the end).
+    Images are read while the body is still being spooled by body_task.
+    At most BATCH_PREDICT_IN_FLIGHT images are held in memory at once;
+    the rest wait in the spooled body.
+    """
+    model_instance = get_model_instance()
+    cache = get_prediction_cache()
+    cache.set_model_version(get_serving_version())
+    pending = set()
+    reading = None
+    count = errors = 0
+    exhausted = False
+    complete = True
+    try:
+        while True:
+            if reading is None and not exhausted and len(pending) < BATCH_PREDICT_IN_FLIGHT:
+                # the next image is read (waiting for the upload, decompressing) off the event loop,
+                # while the results of those already read are sent
+                reading = asyncio.ensure_future(asyncio.to_thread(next, items, None))
+            if reading is None and not pending:
+                break
+            done, _ = await asyncio.wait(pending | {reading} - {None}, return_when=asyncio.FIRST_COMPLETED)
+            if reading in done:
+                done.discard(reading)
+                try:
+                    item = reading.result()
+                except UploadRejected as e:
+                    # the rest of the body is unreadable: finish the images already read
+                    yield json.dumps({"error": e.detail, "status": e.status_code}) + "\n"
+                    item, complete = None, False
+                except Exception as e:
+                    # a reader bug must still end the stream with an error and a summary
+                    logger.exception("Reading a batch upload failed")
+                    yield json.dumps({"error": f"Batch could not be read: {str(e)}", "status": 500}) + "\n"
+                    item, complete = None, False
+                reading = None
+                if item is None:
+                    exhausted = True
+                else:
+                    pending.add(asyncio.ensure_future(_predict_batch_item(count, *item, model_instance, cache)))
+                    count += 1
+            for task in done:
+                pending.discard(task)
+                line = task.result()
+                errors += "error" in line
+                yield json.dumps(line) + "\n"
+        yield json.dumps({"summary": {"images": count, "errors": errors, "complete": complete}}) + "\n"
+    finally:
+        # if the client went away, the rest of the batch is dropped
+        for task in pending:
+            task.cancel()
+        if reading is not None:
+            reading.cancel()
+        body_task.cancel()
+        body.close()
+
+
+@app.post("/predict/batch")
+async def predict_batch_route(request: Request):
+    """
+    Predicts every image of a multipart upload or zip/tar archive, streaming
+    one NDJSON line per image as soon as it is ready, while the rest of the
+    upload is still arriving. Images are decoded in parallel and batched
+    with concurrent /predict requests; a bad image gets an error line and
+    does not fail the rest.
+    """
+    body = SpooledBody()
+    try:
+        items = iter_batch_items(body, request.headers.get("content-type", ""))
+    except UploadRejected as e:
+        body.close()
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    body_task = asyncio.ensure_future(spool_body(request, body))
+    return BodyStreamingResponse(_stream_batch(items, body, body_task), body_task,
+                                 media_type="application/x-ndjson")
+
+
+def _candidate_names(class_ids):
+    """Returns: class names of the first IDENTIFY_SPECS_CANDIDATES class ids"""
+    return [CAR_DATASET_INFO["class_names"][i] for i in class_ids[:IDENTIFY_SPECS_CANDIDATES]]
+
+
+@app.post("/identify")
+async def identify_route(file: UploadFile, response: Response):
+    """
+    Top-k predictions with scores, and specs for the first few, in one response.
+    Specs lookups start as soon as candidates are known (with the cascade,
+    from the small model's answer while the primary model runs), and each
+    is waited on for at most SPOTR_IDENTIFY_SPECS_DEADLINE_SECONDS.
+    """
+    try:
+        if not file.content_type.startswith('image/'):
+            raise HTTPException(status_code=400, detail="File must be an image")
+
+        start = time.perf_counter()
+        image_bytes = await read_upload(file)
+        upload_seconds = time.perf_counter() - start
+        PREDICT_STAGE_SECONDS["upload_read"].observe(upload_seconds)
+        timings = [("upload", upload_seconds)]
+        model_instance = get_model_instance()
+        loop = asyncio.get_running_loop()
+        prefetch = SpecsPrefetch()
+
+        # top-k results are cached apart from /predict's, which only keep the top class
+        cache = get_prediction_cache()
+        cache.set_model_version(get_serving_version())
+        key = "identify:" + content_key(image_bytes)
+        prediction = cache.get(key)
+        if prediction is not None:
+            timings.append(("cache", None))
+        else:
+            probe_image(image_bytes)
+            input_tensor, phash, stage_timings = await loop.run_in_executor(
+                get_inference_executor(), _prepare_upload, model_instance, image_bytes, cache.use_phash
+            )
+            timings += stage_timings
+            prediction = cache.get("identify:" + phash) if phash else None
+            if prediction is not None:
+                cache.put(key, prediction)
+                timings.append(("cache", None))
+            else:
+                start = time.perf_counter()
+                result = await asyncio.wrap_future(get_batch_scheduler().submit(
+                    input_tensor, on_candidates=lambda class_ids: prefetch.start_threadsafe(_candidate_names(class_ids))
+                ))
+                timings += _inference_timings(result, time.perf_counter() - start)
+                prediction = {
+                    "pred_class": result["pred_class"],
+                    "stage": result["stage"],
+                    "score": result["score"],
+                    "top_k": [(CAR_DATASET_INFO["class_names"][i], score) for i, score in result["top_k"]],
+                }
+                cache.set_model_version(get_serving_version())
+                cache.put(key, prediction)
+                if phash:
+                    cache.put("identify:" + phash, prediction)
+            del input_tensor
+        del image_bytes
+
+        start = time.perf_counter()
+        names = [pred_class for pred_class, _ in prediction["top_k"]]
+        specs = await prefetch.results(names[:IDENTIFY_SPECS_CANDIDATES])
+        timings.append(("specs", time.perf_counter() - start))
+        candidates = []
+        for pred_class, score in prediction["top_k"]:
+            candidate_specs, status = specs.get(pred_class, (None, "skipped"))
+            candidates.append({"pred_class": pred_class, "score": score,
+                               "specs": candidate_specs, "specs_status": status})
+        response.headers["Server-Timing"] = server_timing(timings)
+        return {
+            "pred_class": prediction["pred_class"],
+            "stage": prediction["stage"],
+            "score": prediction["score"],
+            "candidates": candidates,
+        }
+    except HTTPException:
+        raise
+    except UploadRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Identification failed: {str(e)}")
+
+
+@app.get("/profiles/{trace_id}")
+def profile_download(trace_id: str):
+    """Download a torch.profiler Chrome trace captured with X-SpotR-Profile: 1"""
+    path = get_profile_store().path(trace_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, media_type="application/json", filename=f"spotr-profile-{trace_id}.json")
+
+
 @app.get("/car-specs")
-def car_specs_route(pred_class: str):
+async def car_specs_route(pred_class: str, response: Response):
     try:
-        specs = fetch_car_specs(pred_class)
+        start = time.perf_counter()
+        specs = await fetch_car_specs(pred_class)
+        response.headers["Server-Timing"] = server_timing([("specs", time.perf_counter() - start)])
         if specs is None:
             return {"error": "Specs not found or API error."}
         return specs
@@ -93,21 +425,84 @@ def car_specs_route(pred_class: str):
         raise HTTPException(status_code=500, detail=f"Specs fetch failed: {str(e)}")
 
 
+def _process_memory():
+    """
+    Returns: this worker's memory as a dictionary
+        rss = resident, uss = private to this worker,
+        pss = proportional share (sums to the total across workers),
+        shared = pages shared with other processes (e.g. model weights)
+    """
+    memory = psutil.Process().memory_full_info()
+    return {
+        "pid": os.getpid(),
+        "rss_mb": memory.rss // (1024 * 1024),
+        "uss_mb": memory.uss // (1024 * 1024),
+        "pss_mb": getattr(memory, "pss", 0) // (1024 * 1024),
+        "shared_mb": getattr(memory, "shared", 0) // (1024 * 1024),
+    }
+
+
 @app.get("/health")
 def health_check():
     """Health check endpoint"""
     memory_info = psutil.virtual_memory()
+    pool = get_inference_pool(BATCH_MAX_SIZE)
+    specs_cache = get_specs_cache()
     return {
         "status": "healthy",
         "memory_usage_percent": memory_info.percent,
-        "memory_available_mb": memory_info.available // (1024 * 1024)
+        "memory_available_mb": memory_info.available // (1024 * 1024),
+        "process": _process_memory(),
+        "model": get_model_instance().info(),
+        "batching": get_batch_scheduler().stats(),
+        "residency": get_residency_manager().stats(),
+        "prediction_cache": get_prediction_cache().stats(),
+        "inference_pool": pool.stats() if pool is not None else None,
+        "specs_cache": specs_cache.stats() if specs_cache is not None else None,
+        "specs_client": get_specs_client().stats(),
+        "specs_snapshot": get_specs_snapshot().stats(),
     }
 
 
+def _collect_metrics():
+    """Returns: metrics kept by the residency manager, caches, batcher and specs client"""
+    residency = get_residency_manager()
+    cache = get_prediction_cache()
+    pool = get_inference_pool(BATCH_MAX_SIZE)
+    metrics = [
+        ("spotr_model_loads_total", "counter", "Model loads, initial or after eviction",
+         [({"kind": kind}, count) for kind, count in residency.load_counts.items()]),
+        ("spotr_model_evictions_total", "counter", "Model evictions by reason",
+         [({"reason": reason}, count) for reason, count in residency.eviction_counts.items()]),
+        ("spotr_model_resident_bytes", "gauge", "Bytes of model weights currently loaded",
+         [({}, residency.resident_bytes())]),
+        ("spotr_prediction_cache_hits_total", "counter", "Prediction cache hits by key kind",
+         [({"key": kind}, count) for kind, count in cache.hits.items()]),
+        ("spotr_prediction_cache_misses_total", "counter", "Prediction cache misses by key kind",
+         [({"key": kind}, count) for kind, count in cache.misses.items()]),
+        ("spotr_batch_queue_depth", "gauge", "Inputs waiting to be batched",
+         [({}, get_batch_scheduler().queue_depth())]),
+    ]
+    breaker_state = get_specs_client().breaker.state
+    metrics.append(("spotr_specs_breaker_state", "gauge", "Car specs API circuit breaker state (1 = current)",
+                    [({"state": state}, int(state == breaker_state)) for state in BREAKER_STATES]))
+    if pool is not None:
+        metrics.append(("spotr_inference_pool_queue_depth", "gauge", "Batches waiting for an inference worker",
+                        [({}, pool.queue_depth())]))
+    return metrics
+
+
+REGISTRY.register_collector(_collect_metrics)
+
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus metrics endpoint"""
+    return Response(REGISTRY.render(), media_type=CONTENT_TYPE)
+
+
 @app.post("/clear-cache")
 def clear_cache():
     """Endpoint to manually clear model cache"""
-    model_instance = get_model_instance()
-    model_instance.clear_model()
-    gc.collect()
-    return {"status": "cache cleared"}
+    evicted = get_residency_manager().evict_all(reason="manual")
+    return {"status": "cache cleared", "evicted": evicted}
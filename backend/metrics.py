@@ -0,0 +1,209 @@
+# Copyright (C) 2025 Colin Damon
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Metrics for SpotR FastAPI backend
+
+Responsibilities:
+ - Provide counters, gauges and fixed-bucket histograms cheap enough for
+   the request hot path
+ - Define the backend's metrics (per-stage latency, specs API calls, ...)
+ - Render every metric in the Prometheus text exposition format
+ - Count HTTP requests in flight, until their (streamed) response is sent
+
+Metrics are created once at import time with all their label values, so
+recording one is a bucket search and an increment: nothing is allocated
+per request. Values owned by other modules (model loads, cache hits,
+queue depth) are read by collectors only when /metrics is scraped.
+"""
+
+import threading
+from bisect import bisect_left
+
+
+# Upper bounds in seconds, from sub-millisecond decodes to cold model loads
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PREDICT_STAGES = ("upload_read", "decode", "preprocess", "forward", "postprocess")
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _format_labels(labels):
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels.items()) + "}" if labels else ""
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def samples(self, name, labels):
+        yield f"{name}{_format_labels(labels)} {self.value}"
+
+
+class Gauge:
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        with self._lock:
+            self.value -= amount
+
+    def samples(self, name, labels):
+        yield f"{name}{_format_labels(labels)} {self.value}"
+
+
+class Histogram:
+    """Histogram over fixed, preallocated buckets"""
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def samples(self, name, labels):
+        with self._lock:
+            counts, total = list(self.counts), self.sum
+        cumulative = 0
+        for bound, count in zip(self.buckets + ("+Inf",), counts):
+            cumulative += count
+            yield f"{name}_bucket{_format_labels({**labels, 'le': bound})} {cumulative}"
+        yield f"{name}_sum{_format_labels(labels)} {total}"
+        yield f"{name}_count{_format_labels(labels)} {cumulative}"
+
+
+class MetricsRegistry:
+    """
+    Named metric families, each with a fixed set of label values, plus
+    collectors that report values kept elsewhere at scrape time.
+    """
+    def __init__(self):
+        self._families = {}
+        self._collectors = []
+
+    def _family(self, name, kind, help_text, metric_class, label_name, label_values, **kwargs):
+        if label_name is None:
+            children = {(): metric_class(**kwargs)}
+        else:
+            children = {((label_name, v),): metric_class(**kwargs) for v in label_values}
+        self._families[name] = (kind, help_text, children)
+        if label_name is None:
+            return children[()]
+        return {key[0][1]: metric for key, metric in children.items()}
+
+    def counter(self, name, help_text, label_name=None, label_values=()):
+        """Returns: a Counter, or a {label value: Counter} dictionary"""
+        return self._family(name, "counter", help_text, Counter, label_name, label_values)
+
+    def gauge(self, name, help_text, label_name=None, label_values=()):
+        """Returns: a Gauge, or a {label value: Gauge} dictionary"""
+        return self._family(name, "gauge", help_text, Gauge, label_name, label_values)
+
+    def histogram(self, name, help_text, label_name=None, label_values=(), buckets=LATENCY_BUCKETS):
+        """Returns: a Histogram, or a {label value: Histogram} dictionary"""
+        return self._family(name, "histogram", help_text, Histogram, label_name, label_values, buckets=buckets)
+
+    def register_collector(self, collector):
+        """
+        Accepts a function returning a list of
+            (name, kind, help text, [(labels dictionary, value), ...])
+        called on every scrape
+        """
+        self._collectors.append(collector)
+
+    def render(self):
+        """Returns: every metric in the Prometheus text exposition format"""
+        lines = []
+        for name, (kind, help_text, children) in self._families.items():
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            for key, metric in children.items():
+                lines.extend(metric.samples(name, dict(key)))
+        for collector in self._collectors:
+            for name, kind, help_text, samples in collector():
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+                lines += [f"{name}{_format_labels(labels)} {value}" for labels, value in samples]
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+PREDICT_STAGE_SECONDS = REGISTRY.histogram(
+    "spotr_predict_stage_seconds", "Time spent in each stage of /predict",
+    "stage", PREDICT_STAGES,
+)
+REQUESTS_IN_FLIGHT = REGISTRY.gauge(
+    "spotr_requests_in_flight", "HTTP requests currently being handled",
+)
+SPECS_API_CALLS = REGISTRY.counter(
+    "spotr_specs_api_calls_total", "Requests sent to the car specs API",
+)
+SPECS_API_FAILURES = REGISTRY.counter(
+    "spotr_specs_api_failures_total", "Car specs API requests that failed",
+    "reason", ("http_error", "timeout", "exception"),
+)
+SPECS_API_RETRIES = REGISTRY.counter(
+    "spotr_specs_api_retries_total", "Car specs API requests retried after a failure",
+)
+SPECS_API_QUEUE_TIMEOUTS = REGISTRY.counter(
+    "spotr_specs_api_queue_timeouts_total",
+    "Car specs lookups out of time while waiting for a request slot (local, not API, timeouts)",
+)
+SPECS_BREAKER_REJECTIONS = REGISTRY.counter(
+    "spotr_specs_breaker_rejections_total", "Car specs API requests skipped because the circuit breaker was open",
+)
+SPECS_API_SECONDS = REGISTRY.histogram(
+    "spotr_specs_api_seconds", "Car specs API request latency",
+)
+SPECS_CACHE_LOOKUPS = REGISTRY.counter(
+    "spotr_specs_cache_lookups_total", "Car specs cache lookups by result",
+    "result", ("hit", "negative_hit", "stale", "miss"),
+)
+SPECS_SNAPSHOT_LOOKUPS = REGISTRY.counter(
+    "spotr_specs_snapshot_lookups_total", "Car specs lookups answered by the offline snapshot, or not",
+    "result", ("hit", "miss"),
+)
+
+
+class RequestsInFlightMiddleware:
+    """
+    ASGI middleware counting HTTP requests in REQUESTS_IN_FLIGHT from when
+    they arrive until the app returns, which for a streamed response is
+    after its last body message is sent
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        REQUESTS_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            REQUESTS_IN_FLIGHT.dec()
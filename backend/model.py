@@ -20,75 +20,862 @@ Responsibilities:
  - Load deep learning model and its weights
  - Preprocess uploaded images to match evaluation requirements
  - Run inference logic to make a prediction on car class
+ - Batch concurrent requests into a single forward pass
  - Map class ID to readable class name
 """
 
 import torch
+import csv
 import gc
 import psutil
-from torchvision import models, transforms
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from torchvision import models
 from PIL import Image
+import logging
 import os
 import torch.nn as nn
 from backend.dataset import CAR_DATASET_INFO
+from backend.residency import get_residency_manager
+from backend.artifact import ArtifactError, load_model_artifact, read_manifest, verify_checksum
+from backend.precision import Bfloat16, cpu_supports_bf16
+from backend.preprocess import Preprocessor, decode_image
+from backend.workers import get_inference_pool
+from backend.metrics import PREDICT_STAGE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+# Micro-batching settings (see BatchScheduler)
+BATCH_MAX_SIZE = int(os.getenv("SPOTR_BATCH_MAX_SIZE", "8"))
+BATCH_MAX_WAIT_MS = float(os.getenv("SPOTR_BATCH_MAX_WAIT_MS", "5"))
+QUEUE_DEPTH_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64)
+# Images of one /predict/batch request being decoded or waiting for inference at once
+BATCH_PREDICT_IN_FLIGHT = int(os.getenv("SPOTR_BATCH_PREDICT_IN_FLIGHT", str(2 * BATCH_MAX_SIZE)))
+
+# Model weights: the fp32 state dict, and the optional pre-quantized artifact
+# written by scripts/build_model_artifact.py (preferred when present and valid)
+MODELS_DIR = os.path.join(os.path.dirname(__file__), '..', 'models')
+MODEL_PATH = os.getenv("SPOTR_MODEL_PATH", os.path.join(MODELS_DIR, 'spotr_mobilenetv2.pth'))
+MODEL_ARTIFACT_PATH = os.getenv("SPOTR_MODEL_ARTIFACT", os.path.join(MODELS_DIR, 'spotr_resnet101.int8.pt'))
+# Whether the primary model is exempt from budget, idle and memory pressure eviction
+MODEL_PINNED = os.getenv("SPOTR_MODEL_PINNED", "1") == "1"
+
+# Confidence-gated cascade: a small model answers first and only inputs it is
+# unsure about are escalated to the primary model (see CascadeModel)
+CASCADE_ENABLED = os.getenv("SPOTR_CASCADE", "0") == "1"
+CASCADE_MODEL_PATH = os.getenv("SPOTR_CASCADE_MODEL_PATH", os.path.join(MODELS_DIR, '1_mobilenetv2.pth'))
+CASCADE_MODEL_ARTIFACT_PATH = os.getenv("SPOTR_CASCADE_MODEL_ARTIFACT", os.path.join(MODELS_DIR, 'spotr_mobilenetv2.int8.pt'))
+CASCADE_METRIC = os.getenv("SPOTR_CASCADE_METRIC", "margin")
+CASCADE_THRESHOLD = float(os.getenv("SPOTR_CASCADE_THRESHOLD", "0.5"))
+
+# Candidates (class id, score) kept on each result, best first
+TOP_K = int(os.getenv("SPOTR_TOP_K", "5"))
+
+# Size of the decode/preprocess executor, also used as torch's intra-op thread count
+INFERENCE_THREADS = int(os.getenv("SPOTR_INFERENCE_THREADS", str(min(4, os.cpu_count() or 1))))
+
+# Inference engine ("torch", "torch-optimized" or "onnxruntime") and ONNX Runtime session options
+ENGINE = os.getenv("SPOTR_ENGINE", "torch")
+MODEL_ONNX_PATH = os.getenv("SPOTR_MODEL_ONNX", os.path.join(MODELS_DIR, 'spotr_resnet101.onnx'))
+CASCADE_MODEL_ONNX_PATH = os.getenv("SPOTR_CASCADE_MODEL_ONNX", os.path.join(MODELS_DIR, 'spotr_mobilenetv2.onnx'))
+ORT_THREADS = int(os.getenv("SPOTR_ORT_THREADS", str(INFERENCE_THREADS)))
+ORT_GRAPH_OPTIMIZATION = os.getenv("SPOTR_ORT_GRAPH_OPTIMIZATION", "all")
+
+# Precision of the torch engine: "int8" (dynamic quantization), "bf16", "fp32",
+# or "auto" for bf16 on CPUs with native bf16 support and int8 elsewhere
+PRECISION = os.getenv("SPOTR_PRECISION", "int8")
+
+# "torch-optimized" engine: torch.compile on top of BN folding + channels_last,
+# and the validation images for its load-time parity check: a directory of them,
+# or else the first ones of the validation CSV found on disk (paths relative to dataset/)
+TORCH_COMPILE = os.getenv("SPOTR_TORCH_COMPILE", "0") == "1"
+PARITY_CHECK_DIR = os.getenv("SPOTR_PARITY_CHECK_DIR", "")
+DATASET_DIR = os.path.join(os.path.dirname(__file__), '..', 'dataset')
+PARITY_CHECK_CSV = os.getenv("SPOTR_PARITY_CHECK_CSV", os.path.join(DATASET_DIR, 'train1', 'val1.csv'))
+PARITY_CHECK_SAMPLES = int(os.getenv("SPOTR_PARITY_CHECK_SAMPLES", "16"))
+# Largest logit difference from the fp32 model (relative to its largest logit),
+# and on validation images the smallest top-1 agreement, the optimized model is served with
+PARITY_MAX_DIFF = float(os.getenv("SPOTR_PARITY_MAX_DIFF", "0.001"))
+PARITY_MIN_AGREEMENT = float(os.getenv("SPOTR_PARITY_MIN_AGREEMENT", "0.9"))
+
+
+def _nbytes(value):
+    """Returns: bytes held by a tensor or a (nested) tuple of tensors"""
+    if torch.is_tensor(value):
+        return value.nelement() * value.element_size()
+    if isinstance(value, (tuple, list)):
+        return sum(_nbytes(v) for v in value)
+    return 0
+
+
+def _model_nbytes(model):
+    """Returns: bytes held by a model's parameters, buffers and packed weights"""
+    return sum(_nbytes(v) for v in model.state_dict().values())
+
+
+def build_model(arch, num_classes=CAR_DATASET_INFO["num_classes"]):
+    """
+    Accepts architecture name as used by train.py
+        (e.g. "resnet101", "resnet50", "mobilenetv2")
+    Returns: untrained fp32 model with a num_classes-way head
+    """
+    if arch in ("resnet101", "resnet50"):
+        model = getattr(models, arch)(weights=None)
+        model.fc = nn.Linear(model.fc.in_features, num_classes)
+    elif arch == "mobilenetv2":
+        model = models.mobilenet_v2(weights=None)
+        model.classifier[1] = nn.Linear(model.classifier[1].in_features, num_classes)
+    else:
+        raise ValueError(f"Unknown model architecture: {arch}")
+    return model
+
+
+def load_fp32_model(weights_path, arch="resnet101"):
+    """
+    Accepts path to fp32 state dict and its architecture name
+    Returns: fp32 model in eval mode
+    """
+    model = build_model(arch)
+
+    state_dict = torch.load(weights_path, map_location="cpu", mmap=True)
+    model.load_state_dict(state_dict)
+    return model.eval()
+
+
+def build_quantized_model(weights_path, arch="resnet101"):
+    """
+    Accepts path to fp32 state dict and its architecture name
+    Returns: dynamically quantized model in eval mode
+    """
+    model = load_fp32_model(weights_path, arch)
+    return torch.quantization.quantize_dynamic(
+        model, {nn.Linear, nn.Conv2d}, dtype=torch.qint8
+    )
+
+
+def _weights_manifest(weights_path, precision):
+    """Returns: manifest-like dictionary for weights loaded straight from a state dict"""
+    stat = os.stat(weights_path)
+    return {"sha256": f"{stat.st_size:x}-{stat.st_mtime_ns:x}", "precision": precision}
+
+
+def _file_identity(path):
+    """Returns: short identity of a model file (its manifest checksum, else size and mtime), or None if missing"""
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        return read_manifest(path)["sha256"][:16]
+    except (ArtifactError, KeyError):
+        return _weights_manifest(path, None)["sha256"]
+
+
+def should_escalate(probs, metric=CASCADE_METRIC, threshold=CASCADE_THRESHOLD):
+    """
+    Accepts (N, C) softmax probabilities from the cascade's small model
+    Returns: (N,) bool tensor, True where the small model is unsure
+
+    "margin" escalates when top-1 minus top-2 probability is below the
+    threshold, "entropy" when the prediction entropy is above it.
+    """
+    if metric == "margin":
+        top2 = probs.topk(2, dim=1).values
+        return (top2[:, 0] - top2[:, 1]) < threshold
+    if metric == "entropy":
+        entropy = -(probs * probs.clamp_min(1e-12).log()).sum(dim=1)
+        return entropy > threshold
+    raise ValueError(f"Unknown cascade metric: {metric}")
+
+
+def _result(top_k, stage):
+    """
+    Accepts a prediction's [(class id, score), ...] candidates, best first
+    Returns: one prediction as a small, picklable result dictionary
+    """
+    class_id, score = top_k[0]
+    return {
+        "pred_class": CAR_DATASET_INFO["class_names"][class_id],
+        "class_id": class_id,
+        "score": round(score, 4),
+        "stage": stage,
+        "top_k": [(i, round(s, 4)) for i, s in top_k],
+    }
+
+
+def _top_k(probs, k=TOP_K):
+    """Returns: [(class id, score), ...] candidates for each row of probs, best first"""
+    scores, class_ids = probs.topk(min(k, probs.shape[1]), dim=1)
+    return [list(zip(ids, row)) for ids, row in zip(class_ids.tolist(), scores.tolist())]
+
+
+def _notify_candidates(callbacks, index, top_k):
+    """Hands a prediction's provisional candidates to its caller, if it asked for them"""
+    if callbacks and callbacks[index] is not None:
+        try:
+            callbacks[index]([class_id for class_id, _ in top_k])
+        except Exception as e:
+            logger.warning("Candidate callback failed: %s", e)
+
+
+def _mark_cold_load(results, load_seconds):
+    """Record on each result that its batch waited for a model load first"""
+    if load_seconds:
+        for result in results:
+            result["model_load_seconds"] = load_seconds
+    return results
+
+
+class PyTorchEngine:
+    """
+    Eager PyTorch at the configured precision. For int8, the prebuilt
+    artifact if there is one, otherwise the fp32 weights quantized at load
+    time. bf16 is only used on CPUs with native bf16 support; elsewhere
+    the engine falls back to int8.
+    """
+    name = "torch"
+    PRECISIONS = ("int8", "bf16", "fp32", "auto")
+
+    def __init__(self, precision=PRECISION):
+        if precision not in self.PRECISIONS:
+            raise ValueError(f"Unknown precision: {precision}")
+        self.precision = precision
+
+    def load(self, model_instance):
+        """
+        Accepts the LazyPyTorchModel being loaded
+        Returns: (runner, load source, manifest); runner maps an input batch to logits
+        """
+        precision = self.precision
+        if precision in ("bf16", "auto"):
+            if cpu_supports_bf16():
+                precision = "bf16"
+            else:
+                if precision == "bf16":
+                    logger.warning("CPU has no native bf16 support, falling back to int8")
+                precision = "int8"
+
+        if precision == "bf16":
+            model = Bfloat16(load_fp32_model(model_instance.model_path, model_instance.arch))
+            return model, "bf16", _weights_manifest(model_instance.model_path, "bf16")
+        if precision == "fp32":
+            model = load_fp32_model(model_instance.model_path, model_instance.arch)
+            return model, "fp32", _weights_manifest(model_instance.model_path, "fp32")
+
+        if model_instance.artifact_path:
+            try:
+                model, manifest = load_model_artifact(model_instance.artifact_path)
+                return model, "artifact", manifest
+            except ArtifactError as e:
+                logger.warning("Falling back to fp32 weights: %s", e)
+        model = build_quantized_model(model_instance.model_path, model_instance.arch)
+        return model, "fp32", _weights_manifest(model_instance.model_path, "dynamic_int8")
+
+
+class ChannelsLast(nn.Module):
+    """Runs the wrapped model on channels_last input"""
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_batch):
+        return self.model(input_batch.contiguous(memory_format=torch.channels_last))
+
+
+def optimize_for_inference(model):
+    """
+    Accepts an fp32 model in eval mode
+    Returns: equivalent model with BatchNorm folded into the preceding
+        convolutions, running in channels_last memory format
+    """
+    from torch.fx.experimental.optimization import fuse
+
+    return ChannelsLast(fuse(model).to(memory_format=torch.channels_last)).eval()
+
+
+def _parity_check_paths(image_dir, csv_path, num_samples):
+    """
+    Returns: paths of up to num_samples validation images, from image_dir if
+        set, else from the validation CSV if it and its images are on disk
+    """
+    if image_dir:
+        names = sorted(n for n in os.listdir(image_dir) if n.lower().endswith((".jpg", ".jpeg", ".png")))
+        if not names:
+            logger.warning("No images in %s", image_dir)
+        return [os.path.join(image_dir, name) for name in names[:num_samples]]
+    if not os.path.isfile(csv_path):
+        return []
+    paths = []
+    with open(csv_path, newline="") as f:
+        for row in csv.DictReader(f):
+            path = os.path.join(DATASET_DIR, row["filename"])
+            if os.path.isfile(path):
+                paths.append(path)
+            if len(paths) == num_samples:
+                break
+    return paths
+
+
+def parity_check_batch(preprocessor, image_dir=PARITY_CHECK_DIR, num_samples=PARITY_CHECK_SAMPLES,
+                       csv_path=PARITY_CHECK_CSV):
+    """
+    Returns: (N, 3, 224, 224) input batch of validation images (see
+        _parity_check_paths), or a fixed random batch if there are none,
+        and True if the batch is made of real images
+    """
+    paths = _parity_check_paths(image_dir, csv_path, num_samples)
+    if paths:
+        images = []
+        for path in paths:
+            with open(path, "rb") as f:
+                images.append(decode_image(f.read()))
+        return preprocessor(images), True
+    logger.warning("No validation images for the parity check, so top-1 agreement with fp32 is not checked; "
+                   "set SPOTR_PARITY_CHECK_DIR to a directory of car photos to check it")
+    return torch.randn(num_samples, 3, 224, 224, generator=torch.Generator().manual_seed(0)), False
+
+
+def parity_failure(baseline_logits, logits, real_images):
+    """
+    Returns: why logits differ too much from the baseline's, or None
+        Top-1 agreement is only checked on real images: random inputs give
+        near-tied logits whose top-1 flips on rounding alone.
+    """
+    scale = baseline_logits.abs().max().item() or 1.0
+    max_abs_diff = (baseline_logits - logits).abs().max().item()
+    if max_abs_diff > PARITY_MAX_DIFF * scale:
+        return f"max abs logit difference {max_abs_diff:.4g} is over {PARITY_MAX_DIFF} x {scale:.4g}"
+    agreement = (baseline_logits.argmax(dim=1) == logits.argmax(dim=1)).float().mean().item()
+    if real_images and agreement < PARITY_MIN_AGREEMENT:
+        return f"top-1 agreement {agreement:.1%} is under {PARITY_MIN_AGREEMENT:.1%}"
+    return None
+
+
+class OptimizedPyTorchEngine:
+    """
+    Optimized eager PyTorch on the fp32 weights: BatchNorm folded into the
+    convolutions, channels_last activations and, optionally, torch.compile
+    warmed up at load time. Before serving, its logits are checked against
+    the plain fp32 model (see parity_failure); if they differ too much the
+    torch engine is used instead.
+    """
+    name = "torch-optimized"
+
+    def __init__(self, compile=TORCH_COMPILE):
+        self.compile = compile
+
+    def load(self, model_instance):
+        """
+        Accepts the LazyPyTorchModel being loaded
+        Returns: (runner, load source, manifest); runner maps an input batch to logits
+        """
+        baseline = load_fp32_model(model_instance.model_path, model_instance.arch)
+        model = optimize_for_inference(load_fp32_model(model_instance.model_path, model_instance.arch))
+        compiled = False
+        if self.compile:
+            model, compiled = self._compile(model)
+
+        sample, real_images = parity_check_batch(model_instance.preprocessor)
+        with torch.inference_mode():
+            failure = parity_failure(baseline(sample), model(sample), real_images)
+        if failure is not None:
+            logger.error("Optimized %s failed its parity check against fp32 on %s (%s), using the torch engine",
+                         model_instance.name, "validation images" if real_images else "random inputs", failure)
+            return PyTorchEngine().load(model_instance)
+
+        source = "compiled" if compiled else "optimized"
+        return model, source, _weights_manifest(model_instance.model_path, "fp32")
+
+    def _compile(self, model):
+        """
+        Compile for dynamic batch sizes and trigger compilation now, not on the first request
+        Returns: (model to serve, True if it is the compiled one)
+        """
+        compiled = torch.compile(model, dynamic=True)
+        try:
+            with torch.inference_mode():
+                for batch_size in (1, BATCH_MAX_SIZE):
+                    compiled(torch.randn(batch_size, 3, 224, 224))
+        except Exception as e:
+            logger.warning("torch.compile failed, serving the uncompiled model: %s", e)
+            return model, False
+        return compiled, True
+
+
+class OnnxRuntimeSession:
+    """Makes an onnxruntime session callable like a torch module"""
+    def __init__(self, session):
+        self.session = session
+        self.input_name = session.get_inputs()[0].name
+
+    def __call__(self, input_batch):
+        outputs = self.session.run(None, {self.input_name: input_batch.contiguous().numpy()})
+        return torch.from_numpy(outputs[0])
+
+
+class OnnxRuntimeEngine:
+    """
+    ONNX Runtime on the CPU execution provider, running the model exported
+    by scripts/export_onnx.py. Falls back to the PyTorch engine when
+    onnxruntime is not installed or the export is missing or corrupt.
+    """
+    name = "onnxruntime"
+    GRAPH_OPTIMIZATION_LEVELS = {
+        "disable": "ORT_DISABLE_ALL",
+        "basic": "ORT_ENABLE_BASIC",
+        "extended": "ORT_ENABLE_EXTENDED",
+        "all": "ORT_ENABLE_ALL",
+    }
+
+    def __init__(self, threads=ORT_THREADS, graph_optimization=ORT_GRAPH_OPTIMIZATION):
+        if graph_optimization not in self.GRAPH_OPTIMIZATION_LEVELS:
+            raise ValueError(f"Unknown graph optimization level: {graph_optimization}")
+        self.threads = threads
+        self.graph_optimization = graph_optimization
+
+    def load(self, model_instance):
+        """
+        Accepts the LazyPyTorchModel being loaded
+        Returns: (runner, load source, manifest); runner maps an input batch to logits
+        """
+        try:
+            import onnxruntime as ort
+            manifest = verify_checksum(model_instance.onnx_path)
+        except (ImportError, ArtifactError) as e:
+            logger.warning("Falling back to the torch engine: %s", e)
+            return PyTorchEngine().load(model_instance)
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = self.threads
+        options.inter_op_num_threads = 1
+        options.graph_optimization_level = getattr(
+            ort.GraphOptimizationLevel, self.GRAPH_OPTIMIZATION_LEVELS[self.graph_optimization]
+        )
+        session = ort.InferenceSession(
+            model_instance.onnx_path, sess_options=options, providers=["CPUExecutionProvider"]
+        )
+        return OnnxRuntimeSession(session), "onnx", manifest
+
+
+ENGINES = {engine.name: engine for engine in (PyTorchEngine, OptimizedPyTorchEngine, OnnxRuntimeEngine)}
+
+def get_engine(name=ENGINE):
+    """
+    Accepts an engine name ("torch", "torch-optimized" or "onnxruntime")
+    Returns: a new engine instance
+    """
+    if name not in ENGINES:
+        raise ValueError(f"Unknown inference engine: {name}")
+    return ENGINES[name]()
 
 
 class LazyPyTorchModel:
-    def __init__(self):
+    def __init__(self, name="resnet101", pinned=True, model_path=MODEL_PATH,
+                 artifact_path=MODEL_ARTIFACT_PATH, arch="resnet101",
+                 onnx_path=MODEL_ONNX_PATH, engine=None):
+        self.name = name
+        self.arch = arch
         self.model = None
-        self.model_path = os.path.join(os.path.dirname(__file__), '..', 'models', 'spotr_mobilenetv2.pth')
-    
+        self.model_path = model_path
+        self.artifact_path = artifact_path
+        self.onnx_path = onnx_path
+        self.engine = engine or get_engine()
+        self.load_source = None
+        self.load_seconds = {}
+        self.loads = 0
+        self.version = None
+        self._configured_version = None
+        self.precision = None
+        self.preprocessor = Preprocessor()
+        self._lock = threading.Lock()
+        get_residency_manager().register(name, self, pinned=pinned)
+
     def _load_model(self):
-        """Load model only when needed"""
-        if self.model is None:
-            torch.cuda.empty_cache() if torch.cuda.is_available() else None
-            gc.collect()
-            
-            model = models.resnet101(weights=None)
-            model.fc = nn.Linear(model.fc.in_features, CAR_DATASET_INFO["num_classes"])
-            
-            state_dict = torch.load(self.model_path, map_location="cpu", mmap=True)
-            model.load_state_dict(state_dict)
-            model.eval()
-
-            self.model = torch.quantization.quantize_dynamic(
-                model, {nn.Linear, nn.Conv2d}, dtype=torch.qint8
-            )
-    
+        """Load model only when needed, from the artifact if possible"""
+        with self._lock:
+            if self.model is None:
+                torch.cuda.empty_cache() if torch.cuda.is_available() else None
+                gc.collect()
+                start = time.perf_counter()
+
+                self.model, self.load_source, manifest = self.engine.load(self)
+                # the files may have changed since it was last loaded
+                self._configured_version = None
+                self.precision = manifest.get("precision", "unknown")
+                self.version = f"{self.name}:{self.load_source}:{manifest['sha256'][:16]}"
+
+                elapsed = time.perf_counter() - start
+                self.load_seconds[self.load_source] = round(elapsed, 3)
+                self.loads += 1
+                logger.info("Loaded %s from %s (%s) in %.3fs",
+                            self.name, self.load_source, self.precision, elapsed)
+                # frozen TorchScript artifacts and ONNX sessions expose no state dict;
+                # fall back to file size
+                nbytes = (_model_nbytes(self.model) if isinstance(self.model, nn.Module) else 0) \
+                    or manifest.get("size_bytes", 0)
+                get_residency_manager().record_load(
+                    self.name, nbytes, elapsed, source=self.load_source
+                )
+            return self.model
+
+    @property
+    def configured_version(self):
+        """
+        Version of the engine and model files this model is configured
+        with; unlike version, known before (and whether or not) it loads.
+        Read from the files again after each load and unload, so a reload
+        from a replaced file changes it.
+        """
+        if self._configured_version is None:
+            files = "/".join(str(_file_identity(path))
+                             for path in (self.model_path, self.artifact_path, self.onnx_path))
+            precision = getattr(self.engine, "precision", "-")
+            self._configured_version = f"{self.name}:{self.engine.name}:{precision}:{files}"
+        return self._configured_version
+
+    def preload(self):
+        """Load weights now instead of on the first request"""
+        self._load_model()
+
+    def preprocess(self, image: Image.Image):
+        """Turn an RGB image into a (1, 3, 224, 224) input tensor"""
+        return self.preprocessor(image)
+
+    def preprocess_batch(self, images):
+        """Turn a list of RGB images into a (N, 3, 224, 224) input tensor"""
+        return self.preprocessor(images)
+
+    def decode(self, image_bytes, max_pixels=None):
+        """
+        Accepts raw uploaded image bytes, and optionally a pixel count limit
+        Returns: decoded RGB PIL image, JPEGs at reduced resolution
+        """
+        return decode_image(image_bytes, max_pixels=max_pixels)
+
+    def prepare_input(self, image_bytes):
+        """
+        Accepts raw uploaded image bytes
+        Returns: (1, 3, 224, 224) input tensor
+
+        Decoding and preprocessing are CPU bound; call this from the
+        inference executor rather than the event loop.
+        """
+        return self.preprocess(self.decode(image_bytes))
+
+    def forward(self, input_batch):
+        """
+        Accepts a (N, 3, 224, 224) input tensor
+        Returns: (N, num_classes) logits
+        """
+        model = self._load_model()
+        get_residency_manager().touch(self.name)
+        with torch.inference_mode():
+            return model(input_batch)
+
+    def predict_batch(self, input_batch, on_candidates=None):
+        """
+        Accepts a (N, 3, 224, 224) input tensor, and optionally N callbacks
+            for provisional candidates (unused: a single model's are final)
+        Returns: list of N results as {"pred_class", "class_id", "score", "stage", "top_k"} dictionaries
+        """
+        loads = self.loads
+        top_k = _top_k(self.forward(input_batch).softmax(dim=1))
+        return _mark_cold_load([_result(candidates, self.name) for candidates in top_k],
+                               self.cold_load_seconds(loads))
+
+    def cold_load_seconds(self, loads_before):
+        """Returns: seconds spent loading the model since load count loads_before, or 0"""
+        return self.load_seconds[self.load_source] if self.loads != loads_before else 0
+
     def predict(self, image: Image.Image):
         """Make prediction with memory cleanup"""
-        self._load_model()
-        transform = transforms.Compose([
-            transforms.Resize(256),
-            transforms.CenterCrop(224),
-            transforms.ToTensor(),
-            transforms.Normalize(
-                mean=[0.485, 0.456, 0.406],
-                std=[0.229, 0.224, 0.225],
-            ),
-        ])
-        input_tensor = transform(image).unsqueeze(0)
-
-        with torch.no_grad():
-            outputs = self.model(input_tensor)
-            predicted_class_id = outputs.argmax(dim=1).item()
-            class_name = CAR_DATASET_INFO["class_names"][predicted_class_id]
-        del input_tensor, outputs
-        gc.collect()
-        return class_name
-    
+        return self.predict_batch(self.preprocess(image))[0]["pred_class"]
+
+
+    def info(self):
+        """Returns: load state and last load time per source as a dictionary"""
+        return {
+            "name": self.name,
+            "engine": self.engine.name,
+            "precision": self.precision,
+            "loaded": self.model is not None,
+            "load_source": self.load_source,
+            "load_seconds": dict(self.load_seconds),
+        }
+
     def clear_model(self):
         """Clear model from memory"""
-        if self.model is not None:
-            del self.model
-            self.model = None
-            gc.collect()
+        with self._lock:
+            # the next load reads the files again, which may have been replaced
+            self._configured_version = None
+            if self.model is not None:
+                del self.model
+                self.model = None
+                get_residency_manager().record_unload(self.name)
+
+
+class CascadeModel:
+    """
+    Confidence-gated two stage model.
+
+    The small model answers every input; inputs it is unsure about (see
+    should_escalate) are re-run through the primary model. Results record
+    which stage answered. Both stages expect the same 224x224
+    ImageNet-normalized input, so preprocessing is the primary model's.
+    """
+    def __init__(self, small_model, primary_model, metric=CASCADE_METRIC, threshold=CASCADE_THRESHOLD):
+        self.name = "cascade"
+        self.small_model = small_model
+        self.primary_model = primary_model
+        self.metric = metric
+        self.threshold = threshold
+        self.stage_counts = {small_model.name: 0, primary_model.name: 0}
+
+    def preprocess(self, image: Image.Image):
+        return self.primary_model.preprocess(image)
+
+    def preload(self):
+        self.small_model.preload()
+        self.primary_model.preload()
+
+    def decode(self, image_bytes, max_pixels=None):
+        return self.primary_model.decode(image_bytes, max_pixels)
+
+    def preprocess_batch(self, images):
+        return self.primary_model.preprocess_batch(images)
+
+    def prepare_input(self, image_bytes):
+        return self.primary_model.prepare_input(image_bytes)
+
+    @property
+    def version(self):
+        """
+        Combined version of both stages and the escalation rule. Built from
+        what the stages are configured to load, not what they have loaded,
+        so it does not change when the primary model first loads on an
+        escalation (or the small one is evicted).
+        """
+        return (f"{self.small_model.configured_version}+{self.primary_model.configured_version}"
+                f":{self.metric}:{self.threshold}")
+
+    def predict_batch(self, input_batch, on_candidates=None):
+        """
+        Accepts a (N, 3, 224, 224) input tensor, and optionally N callbacks
+            (or None) called with the small model's candidate class ids for
+            inputs escalated to the primary model, before it runs
+        Returns: list of N results as {"pred_class", "class_id", "score", "stage", "top_k"} dictionaries
+        """
+        loads = (self.small_model.loads, self.primary_model.loads)
+        with torch.inference_mode():
+            probs = self.small_model.forward(input_batch).softmax(dim=1)
+            top_k = _top_k(probs)
+            stages = [self.small_model.name] * len(top_k)
+
+            escalate = should_escalate(probs, self.metric, self.threshold)
+            escalated = escalate.nonzero().flatten().tolist()
+            if escalated:
+                for i in escalated:
+                    _notify_candidates(on_candidates, i, top_k[i])
+                escalated_top_k = _top_k(self.primary_model.forward(input_batch[escalate]).softmax(dim=1))
+                for i, candidates in zip(escalated, escalated_top_k):
+                    top_k[i] = candidates
+                    stages[i] = self.primary_model.name
+
+        for stage in stages:
+            self.stage_counts[stage] += 1
+        load_seconds = (self.small_model.cold_load_seconds(loads[0])
+                        + self.primary_model.cold_load_seconds(loads[1]))
+        return _mark_cold_load([_result(candidates, stage) for candidates, stage in zip(top_k, stages)],
+                               load_seconds)
+
+    def info(self):
+        """Returns: both stages' load state and per-stage answer counts"""
+        return {
+            "name": self.name,
+            "metric": self.metric,
+            "threshold": self.threshold,
+            "stage_counts": dict(self.stage_counts),
+            "stages": [self.small_model.info(), self.primary_model.info()],
+        }
+
+    def clear_model(self):
+        """Clear both stages from memory"""
+        self.small_model.clear_model()
+        self.primary_model.clear_model()
+
+
+class BatchScheduler:
+    """
+    Collects preprocessed input tensors from concurrent requests and runs
+    them through the model in a single forward pass.
+
+    A batch is dispatched once it holds max_batch_size inputs or once the
+    oldest input has waited max_wait_ms, whichever comes first. Each caller
+    gets a Future resolving to its own result dictionary. If a batch fails,
+    each of its Futures raises the error and the next batch runs as usual.
+
+    With an inference pool, batches are handed to the pool's worker
+    processes instead of running here, and several can be in flight.
+    """
+    def __init__(self, model_instance, max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS, pool=None):
+        self.model_instance = model_instance
+        self.pool = pool
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait_ms = max_wait_ms
+        self._queue = queue.Queue()
+        self._worker = None
+        self._lock = threading.Lock()
+        self.batches_run = 0
+        self.batch_size_counts = [0] * (self.max_batch_size + 1)
+        self.queue_depth_counts = [0] * (len(QUEUE_DEPTH_BUCKETS) + 1)
+
+    def submit(self, input_tensor, on_candidates=None):
+        """
+        Accepts a (1, 3, 224, 224) input tensor, and optionally a callback
+            called from the batching thread with provisional candidate
+            class ids before the final result (cascade only, not pooled)
+        Returns: concurrent.futures.Future for the result dictionary
+        """
+        self._ensure_worker()
+        depth = self._queue.qsize()
+        bucket = next((i for i, b in enumerate(QUEUE_DEPTH_BUCKETS) if depth <= b), len(QUEUE_DEPTH_BUCKETS))
+        self.queue_depth_counts[bucket] += 1
+
+        future = Future()
+        self._queue.put((input_tensor, future, on_candidates))
+        return future
+
+    def _ensure_worker(self):
+        """Start the batching thread on first use"""
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="spotr-batcher", daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait_ms / 1000
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    if remaining > 0:
+                        batch.append(self._queue.get(timeout=remaining))
+                    else:
+                        batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            # an error must not end this thread: later callers would wait forever
+            try:
+                self._run_batch(batch)
+            except Exception as e:
+                logger.exception("Prediction batch of %d failed", len(batch))
+                self._fail(batch, e)
+
+    def _run_batch(self, batch):
+        batch = [(t, f, c) for t, f, c in batch if f.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        self.batches_run += 1
+        self.batch_size_counts[len(batch)] += 1
+        input_batch = torch.cat([t for t, _, _ in batch])
+        start = time.perf_counter()
+        if self.pool is not None:
+            self.pool.submit(input_batch).add_done_callback(lambda f: self._resolve(batch, f, start))
+            return
+        callbacks = [c for _, _, c in batch]
+        results = self.model_instance.predict_batch(
+            input_batch, on_candidates=callbacks if any(callbacks) else None
+        )
+        PREDICT_STAGE_SECONDS["forward"].observe(time.perf_counter() - start)
+        self._set_results(batch, results)
+
+    def _resolve(self, batch, batch_future, start):
+        """Hand the results of a pooled batch back to each caller"""
+        PREDICT_STAGE_SECONDS["forward"].observe(time.perf_counter() - start)
+        try:
+            self._set_results(batch, batch_future.result())
+        except Exception as e:
+            self._fail(batch, e)
+
+    def _set_results(self, batch, results):
+        for (_, future, _), result in zip(batch, results):
+            future.set_result(result)
+        if len(results) != len(batch):
+            raise RuntimeError(f"model returned {len(results)} results for a batch of {len(batch)}")
+
+    def _fail(self, batch, error):
+        """Fails every caller in batch still waiting for its result"""
+        for _, future, _ in batch:
+            if not future.done():
+                future.set_exception(error)
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def stats(self):
+        """Returns: queue depth and batch size histograms as a dictionary"""
+        depth_labels = [str(b) for b in QUEUE_DEPTH_BUCKETS] + [f">{QUEUE_DEPTH_BUCKETS[-1]}"]
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait_ms,
+            "queue_depth": self.queue_depth(),
+            "batches_run": self.batches_run,
+            "batch_size_histogram": {
+                str(size): count for size, count in enumerate(self.batch_size_counts) if size > 0
+            },
+            "queue_depth_histogram": dict(zip(depth_labels, self.queue_depth_counts)),
+        }
 
 
 _model_instance = None
+_batch_scheduler = None
+_inference_executor = None
 
 def get_model_instance():
     global _model_instance
     if _model_instance is None:
-        _model_instance = LazyPyTorchModel()
+        if CASCADE_ENABLED:
+            _model_instance = CascadeModel(
+                LazyPyTorchModel(
+                    name="mobilenetv2",
+                    pinned=False,
+                    model_path=CASCADE_MODEL_PATH,
+                    artifact_path=CASCADE_MODEL_ARTIFACT_PATH,
+                    arch="mobilenetv2",
+                    onnx_path=CASCADE_MODEL_ONNX_PATH,
+                ),
+                LazyPyTorchModel(pinned=MODEL_PINNED),
+            )
+        else:
+            _model_instance = LazyPyTorchModel(pinned=MODEL_PINNED)
     return _model_instance
+
+
+def get_batch_scheduler():
+    global _batch_scheduler
+    if _batch_scheduler is None:
+        _batch_scheduler = BatchScheduler(get_model_instance(), pool=get_inference_pool(BATCH_MAX_SIZE))
+    return _batch_scheduler
+
+
+def get_serving_version():
+    """Returns: version of the model answering predictions, in-process or in the pool"""
+    pool = get_inference_pool(BATCH_MAX_SIZE)
+    return pool.version if pool is not None else get_model_instance().version
+
+
+def get_inference_executor():
+    """
+    Returns the bounded executor that decodes and preprocesses uploads
+    off the event loop. Torch's intra-op thread pool is sized to match so
+    the forward pass does not oversubscribe the CPU.
+    """
+    global _inference_executor
+    if _inference_executor is None:
+        torch.set_num_threads(INFERENCE_THREADS)
+        _inference_executor = ThreadPoolExecutor(
+            max_workers=INFERENCE_THREADS, thread_name_prefix="spotr-inference"
+        )
+    return _inference_executor
@@ -0,0 +1,47 @@
+# Copyright (C) 2025 Colin Damon
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Reduced precision helpers for SpotR
+
+Responsibilities:
+ - Detect native bf16 support on the CPU
+ - Run a model in bf16 behind an fp32 interface
+
+Kept free of server state, so training and evaluation scripts can use it.
+"""
+
+import torch
+import torch.nn as nn
+
+
+def cpu_supports_bf16():
+    """Returns: True if the CPU has native bf16 instructions (AVX512-BF16 or AMX)"""
+    try:
+        with open("/proc/cpuinfo") as f:
+            flags = set(f.read().split())
+    except OSError:
+        return False
+    return bool(flags & {"avx512_bf16", "amx_bf16"})
+
+
+class Bfloat16(nn.Module):
+    """Runs the wrapped bf16 model on fp32 input, returning fp32 logits"""
+    def __init__(self, model):
+        super().__init__()
+        self.model = model.to(torch.bfloat16)
+
+    def forward(self, input_batch):
+        return self.model(input_batch.to(torch.bfloat16)).float()
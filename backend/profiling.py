@@ -0,0 +1,101 @@
+# Copyright (C) 2025 Colin Damon
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Per-request timing and profiling for SpotR FastAPI backend
+
+Responsibilities:
+ - Format per-request stage timings as a Server-Timing header
+ - Capture a torch.profiler trace of a single opted-in request
+ - Keep the most recent traces on disk for download
+"""
+
+import os
+import re
+import tempfile
+import threading
+import uuid
+import torch
+
+
+PROFILE_HEADER = "x-spotr-profile"
+PROFILE_DIR = os.getenv("SPOTR_PROFILE_DIR", os.path.join(tempfile.gettempdir(), "spotr-profiles"))
+PROFILE_KEEP = int(os.getenv("SPOTR_PROFILE_KEEP", "20"))
+_TRACE_ID = re.compile(r"[0-9a-f]{32}")
+
+
+def server_timing(timings):
+    """
+    Accepts a list of (name, seconds or None) pairs
+    Returns: Server-Timing header value, durations in milliseconds
+    """
+    return ", ".join(
+        name if seconds is None else f"{name};dur={seconds * 1000:.1f}"
+        for name, seconds in timings
+    )
+
+
+class ProfileStore:
+    """
+    Runs functions under torch.profiler and keeps their Chrome traces.
+
+    Only one request is profiled at a time, so concurrent opt-ins queue
+    up rather than skewing each other's traces. The oldest traces are
+    deleted once more than keep are stored.
+    """
+    def __init__(self, directory=PROFILE_DIR, keep=PROFILE_KEEP):
+        self.directory = directory
+        self.keep = keep
+        self._lock = threading.Lock()
+
+    def profile(self, fn, *args):
+        """
+        Calls fn(*args) under the profiler
+        Returns: (fn's return value, trace id)
+        """
+        with self._lock:
+            with torch.profiler.profile(
+                activities=[torch.profiler.ProfilerActivity.CPU], record_shapes=True
+            ) as profiler:
+                result = fn(*args)
+            os.makedirs(self.directory, exist_ok=True)
+            trace_id = uuid.uuid4().hex
+            profiler.export_chrome_trace(os.path.join(self.directory, f"{trace_id}.json"))
+            self._prune()
+        return result, trace_id
+
+    def _prune(self):
+        traces = sorted(
+            (entry for entry in os.scandir(self.directory) if _TRACE_ID.fullmatch(entry.name[:-5] or "")),
+            key=lambda entry: entry.stat().st_mtime,
+        )
+        for entry in traces[:max(0, len(traces) - self.keep)]:
+            os.remove(entry.path)
+
+    def path(self, trace_id):
+        """Returns: path of a stored trace, or None if the id is unknown"""
+        if not _TRACE_ID.fullmatch(trace_id):
+            return None
+        path = os.path.join(self.directory, f"{trace_id}.json")
+        return path if os.path.exists(path) else None
+
+
+_profile_store = None
+
+def get_profile_store():
+    global _profile_store
+    if _profile_store is None:
+        _profile_store = ProfileStore()
+    return _profile_store
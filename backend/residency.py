@@ -0,0 +1,236 @@
+# Copyright (C) 2025 Colin Damon
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Model residency manager for SpotR FastAPI backend
+
+Responsibilities:
+ - Track which models are loaded and how much memory they hold
+ - Evict unpinned models when resident memory crosses the budget
+ - Evict unpinned models that have sat idle for too long
+ - Evict unpinned models while the whole system is short of memory
+ - Run garbage collection periodically in the background
+ - Report load and eviction counts and reasons
+"""
+
+import gc
+import os
+import threading
+import time
+from collections import Counter
+import psutil
+
+
+MODEL_MEMORY_BUDGET_MB = float(os.getenv("SPOTR_MODEL_MEMORY_BUDGET_MB", "1024"))
+MEMORY_HIGH_WATERMARK = float(os.getenv("SPOTR_MEMORY_HIGH_WATERMARK", "0.9"))
+MEMORY_LOW_WATERMARK = float(os.getenv("SPOTR_MEMORY_LOW_WATERMARK", "0.7"))
+MODEL_IDLE_SECONDS = float(os.getenv("SPOTR_MODEL_IDLE_SECONDS", "900"))
+GC_INTERVAL_SECONDS = float(os.getenv("SPOTR_GC_INTERVAL_SECONDS", "30"))
+# System memory use (percent) above which unpinned models are evicted, whatever the budget
+SYSTEM_MEMORY_PRESSURE_PERCENT = float(os.getenv("SPOTR_SYSTEM_MEMORY_PRESSURE_PERCENT", "85"))
+
+
+class ModelResidencyManager:
+    """
+    Owns loaded models against an explicit byte budget.
+
+    Eviction uses hysteresis: once resident model memory rises above
+    high_watermark * budget, least recently used unpinned models are
+    unloaded until it falls below low_watermark * budget. Independently,
+    while system memory use is above memory_pressure_percent (other
+    processes count too), least recently used unpinned models are
+    unloaded one by one. Pinned models are only unloaded on explicit
+    request.
+
+    Registered models must provide a clear_model() method.
+    """
+    def __init__(self, budget_mb=MODEL_MEMORY_BUDGET_MB, high_watermark=MEMORY_HIGH_WATERMARK,
+                 low_watermark=MEMORY_LOW_WATERMARK, idle_seconds=MODEL_IDLE_SECONDS,
+                 gc_interval=GC_INTERVAL_SECONDS, memory_pressure_percent=SYSTEM_MEMORY_PRESSURE_PERCENT):
+        self.budget_bytes = int(budget_mb * 1024 * 1024)
+        self.high_watermark = high_watermark
+        self.low_watermark = min(low_watermark, high_watermark)
+        self.idle_seconds = idle_seconds
+        self.gc_interval = gc_interval
+        self.memory_pressure_percent = memory_pressure_percent
+        self._entries = {}
+        self._lock = threading.RLock()
+        self._sweeper = None
+        self.load_counts = Counter()
+        self.eviction_counts = Counter()
+        self.gc_runs = 0
+
+    def register(self, name, model_instance, pinned=False):
+        """Start tracking a (possibly not yet loaded) model under name"""
+        with self._lock:
+            self._entries[name] = {
+                "model_instance": model_instance,
+                "pinned": pinned,
+                "nbytes": 0,
+                "resident": False,
+                "last_used": time.monotonic(),
+                "loads": 0,
+                "last_load_seconds": None,
+                "last_load_source": None,
+                "last_eviction_reason": None,
+            }
+        self.start()
+
+    def record_load(self, name, nbytes, load_seconds, source=None):
+        """Called by a model after it has loaded its weights"""
+        with self._lock:
+            entry = self._entries[name]
+            self.load_counts["initial" if entry["loads"] == 0 else "reload"] += 1
+            entry.update(
+                nbytes=nbytes,
+                resident=True,
+                last_used=time.monotonic(),
+                last_load_seconds=load_seconds,
+                last_load_source=source,
+            )
+            entry["loads"] += 1
+            self._enforce_budget(exclude=name)
+            self._relieve_memory_pressure(exclude=name)
+
+    def record_unload(self, name):
+        """Called by a model when it drops its weights"""
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is not None:
+                entry["resident"] = False
+
+    def touch(self, name):
+        """Mark a model as just used"""
+        entry = self._entries.get(name)
+        if entry is not None:
+            entry["last_used"] = time.monotonic()
+
+    def resident_bytes(self):
+        with self._lock:
+            return sum(e["nbytes"] for e in self._entries.values() if e["resident"])
+
+    def evict(self, name, reason):
+        """Unload a single model and record why"""
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is None or not entry["resident"]:
+                return False
+            entry["model_instance"].clear_model()
+            entry["resident"] = False
+            entry["last_eviction_reason"] = reason
+            self.eviction_counts[reason] += 1
+            return True
+
+    def evict_all(self, reason="manual"):
+        """Unload every model, pinned or not"""
+        with self._lock:
+            evicted = [name for name in list(self._entries) if self.evict(name, reason)]
+        gc.collect()
+        return evicted
+
+    def _enforce_budget(self, exclude=None):
+        if self.resident_bytes() <= self.budget_bytes * self.high_watermark:
+            return
+        candidates = sorted(
+            (e["last_used"], name) for name, e in self._entries.items()
+            if e["resident"] and not e["pinned"] and name != exclude
+        )
+        for _, name in candidates:
+            if self.resident_bytes() <= self.budget_bytes * self.low_watermark:
+                break
+            self.evict(name, "memory_budget")
+
+    def _relieve_memory_pressure(self, exclude=None):
+        candidates = sorted(
+            (e["last_used"], name) for name, e in self._entries.items()
+            if e["resident"] and not e["pinned"] and name != exclude
+        )
+        for _, name in candidates:
+            if psutil.virtual_memory().percent <= self.memory_pressure_percent:
+                break
+            self.evict(name, "memory_pressure")
+            gc.collect()
+
+    def _evict_idle(self):
+        now = time.monotonic()
+        with self._lock:
+            for name, entry in list(self._entries.items()):
+                if entry["resident"] and not entry["pinned"] and now - entry["last_used"] > self.idle_seconds:
+                    self.evict(name, "idle")
+
+    def start(self):
+        """Start the background sweep thread if it is not running"""
+        with self._lock:
+            if self._sweeper is None or not self._sweeper.is_alive():
+                self._sweeper = threading.Thread(target=self._sweep, name="spotr-residency", daemon=True)
+                self._sweeper.start()
+
+    def _sweep(self):
+        while True:
+            time.sleep(self.gc_interval)
+            self._evict_idle()
+            with self._lock:
+                self._enforce_budget()
+                self._relieve_memory_pressure()
+            gc.collect()
+            self.gc_runs += 1
+
+    def stats(self):
+        """Returns: residency, load and eviction statistics as a dictionary"""
+        now = time.monotonic()
+        with self._lock:
+            models = {
+                name: {
+                    "resident": e["resident"],
+                    "pinned": e["pinned"],
+                    "size_mb": round(e["nbytes"] / (1024 * 1024), 1),
+                    "idle_seconds": round(now - e["last_used"], 1),
+                    "loads": e["loads"],
+                    "last_load_seconds": e["last_load_seconds"] and round(e["last_load_seconds"], 3),
+                    "last_load_source": e["last_load_source"],
+                    "last_eviction_reason": e["last_eviction_reason"],
+                }
+                for name, e in self._entries.items()
+            }
+            return {
+                "budget_mb": round(self.budget_bytes / (1024 * 1024), 1),
+                "resident_mb": round(self.resident_bytes() / (1024 * 1024), 1),
+                "high_watermark": self.high_watermark,
+                "low_watermark": self.low_watermark,
+                "idle_seconds": self.idle_seconds,
+                "memory_pressure_percent": self.memory_pressure_percent,
+                "models": models,
+                "loads": dict(self.load_counts),
+                "evictions": dict(self.eviction_counts),
+                "gc_runs": self.gc_runs,
+            }
+
+
+_residency_manager = None
+
+def get_residency_manager():
+    global _residency_manager
+    if _residency_manager is None:
+        _residency_manager = ModelResidencyManager()
+    return _residency_manager
+
+
+def _reset_after_fork():
+    """A forked worker inherits neither the sweep thread nor a usable lock"""
+    if _residency_manager is not None:
+        _residency_manager._lock = threading.RLock()
+        _residency_manager._sweeper = None
+
+os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,116 @@
+# Copyright (C) 2025 Colin Damon
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Multi-process launcher for SpotR FastAPI backend
+
+Usage:
+    python -m backend.serve
+
+Loads the model once in the parent process, then forks SPOTR_WORKERS
+uvicorn workers that all accept connections on one shared socket. The
+workers inherit the loaded weights copy-on-write; since inference never
+writes to them, the pages stay shared and each extra worker only costs
+its own interpreter and activation memory. Weights memory-mapped from an
+artifact are shared through the page cache as well.
+
+The parent restarts workers that exit unexpectedly. Each worker reports
+its own and its shared memory under "process" in /health.
+"""
+
+import logging
+import os
+import signal
+import socket
+import sys
+import uvicorn
+from backend.main import app
+from backend.model import get_model_instance
+from backend.residency import get_residency_manager
+from backend.workers import INFERENCE_PROCESSES
+
+logger = logging.getLogger(__name__)
+
+WORKERS = int(os.getenv("SPOTR_WORKERS", "2"))
+HOST = os.getenv("SPOTR_HOST", "0.0.0.0")
+PORT = int(os.getenv("SPOTR_PORT", "8000"))
+
+
+def _bind_socket(host, port):
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _spawn_worker(sock):
+    """Fork a worker serving the app on sock; returns its pid in the parent"""
+    pid = os.fork()
+    if pid:
+        return pid
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    get_residency_manager().start()
+    try:
+        config = uvicorn.Config(app, log_level="info")
+        uvicorn.Server(config).run(sockets=[sock])
+    finally:
+        os._exit(0)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+
+    # weights are loaded before forking so every worker shares them; with
+    # an inference pool each web worker starts its own pool processes instead
+    if INFERENCE_PROCESSES == 0:
+        get_model_instance().preload()
+    sock = _bind_socket(HOST, PORT)
+    logger.info("Serving on %s:%d with %d workers", HOST, PORT, WORKERS)
+
+    workers = {_spawn_worker(sock) for _ in range(WORKERS)}
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        workers.discard(pid)
+        if not stopping:
+            logger.warning("Worker %d exited with status %d, restarting", pid, status)
+            workers.add(_spawn_worker(sock))
+    sock.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,158 @@
+# Copyright (C) 2025 Colin Damon
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Persistent car specs cache for SpotR FastAPI backend
+
+Responsibilities:
+ - Store car specs API results on disk (SQLite), keyed by (year, make, model)
+ - Keep found specs for a long TTL, and "no data" answers for a shorter one
+ - Keep expired entries for a while longer, to serve stale while the API
+   is unavailable or an entry is being refreshed
+ - Share entries across worker processes and keep them across restarts
+
+Only definite answers are cached: HTTP errors and timeouts are not, so a
+transient API failure is retried on the next lookup.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = os.path.join(os.path.dirname(__file__), '..', 'cache')
+# Empty to disable the cache
+SPECS_CACHE_PATH = os.getenv("SPOTR_SPECS_CACHE_PATH", os.path.join(CACHE_DIR, 'car_specs.sqlite3'))
+SPECS_CACHE_TTL_SECONDS = float(os.getenv("SPOTR_SPECS_CACHE_TTL_SECONDS", str(30 * 24 * 3600)))
+SPECS_CACHE_NEGATIVE_TTL_SECONDS = float(os.getenv("SPOTR_SPECS_CACHE_NEGATIVE_TTL_SECONDS", str(24 * 3600)))
+# How long past its TTL an entry may still be served stale
+SPECS_CACHE_STALE_SECONDS = float(os.getenv("SPOTR_SPECS_CACHE_STALE_SECONDS", str(90 * 24 * 3600)))
+
+# Returned by lookups with no answer (no fresh entry); None means "known to have no data"
+MISS = object()
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS car_specs (
+    year INTEGER NOT NULL,
+    make TEXT NOT NULL,
+    model TEXT NOT NULL,
+    specs TEXT,
+    fetched_at REAL NOT NULL,
+    expires_at REAL NOT NULL,
+    PRIMARY KEY (year, make, model)
+)
+"""
+
+
+class SpecsCache:
+    """
+    SQLite-backed TTL cache of parsed car specs dictionaries.
+
+    Each thread (and each forked worker) opens its own connection; the
+    database runs in WAL mode so workers can read while one writes.
+    Database errors are logged and treated as misses, never raised.
+    """
+    def __init__(self, path=SPECS_CACHE_PATH, ttl_seconds=SPECS_CACHE_TTL_SECONDS,
+                 negative_ttl_seconds=SPECS_CACHE_NEGATIVE_TTL_SECONDS, stale_seconds=SPECS_CACHE_STALE_SECONDS):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.negative_ttl_seconds = negative_ttl_seconds
+        self.stale_seconds = stale_seconds
+        self._local = threading.local()
+
+    def _connection(self):
+        pid = os.getpid()
+        if getattr(self._local, "pid", None) != pid:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(_SCHEMA)
+            self._local.connection, self._local.pid = connection, pid
+        return self._local.connection
+
+    def lookup(self, key):
+        """
+        Accepts a (year, make, model) tuple
+        Returns: (cached specs dictionary, None for a cached "no data"
+            answer, or MISS; True if the entry is within its TTL). Entries
+            up to stale_seconds past their TTL are returned as not fresh.
+        """
+        now = time.time()
+        try:
+            row = self._connection().execute(
+                "SELECT specs, expires_at FROM car_specs "
+                "WHERE year = ? AND make = ? AND model = ? AND expires_at > ?",
+                (*key, now - self.stale_seconds),
+            ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning("Specs cache read failed: %s", e)
+            return MISS, False
+        if row is None:
+            return MISS, False
+        return (None if row[0] is None else json.loads(row[0])), row[1] > now
+
+    def get(self, key):
+        """
+        Accepts a (year, make, model) tuple
+        Returns: cached specs dictionary, None for a cached "no data"
+            answer, or MISS if there is no fresh entry
+        """
+        specs, fresh = self.lookup(key)
+        return specs if fresh else MISS
+
+    def put(self, key, specs):
+        """
+        Accepts a (year, make, model) tuple and its specs dictionary,
+            or None if the API has no data for it
+        """
+        now = time.time()
+        ttl = self.negative_ttl_seconds if specs is None else self.ttl_seconds
+        try:
+            self._connection().execute(
+                "INSERT OR REPLACE INTO car_specs VALUES (?, ?, ?, ?, ?, ?)",
+                (*key, None if specs is None else json.dumps(specs), now, now + ttl),
+            )
+        except sqlite3.Error as e:
+            logger.warning("Specs cache write failed: %s", e)
+
+    def stats(self):
+        """Returns: entry counts as a dictionary"""
+        try:
+            positive, negative, expired = self._connection().execute(
+                "SELECT COUNT(specs), COUNT(*) - COUNT(specs), SUM(expires_at <= ?) FROM car_specs",
+                (time.time(),),
+            ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning("Specs cache read failed: %s", e)
+            return {"path": self.path, "error": str(e)}
+        return {"path": self.path, "entries": positive, "negative_entries": negative, "expired": expired or 0}
+
+
+_specs_cache = None
+
+def get_specs_cache():
+    """Returns: the shared SpecsCache, or None if SPOTR_SPECS_CACHE_PATH is empty"""
+    global _specs_cache
+    if _specs_cache is None and SPECS_CACHE_PATH:
+        _specs_cache = SpecsCache()
+    return _specs_cache
@@ -0,0 +1,322 @@
+# Copyright (C) 2025 Colin Damon
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Async HTTP client for the car specs API
+
+Responsibilities:
+ - Keep a pool of keep-alive connections to the specs API
+ - Coalesce concurrent lookups of the same car into one upstream request
+ - Cap the number of requests in flight to stay within the API rate limit
+ - Give each lookup a total deadline, retrying failures with jittered backoff
+ - Stop calling the API while it is failing or slow (circuit breaker)
+ - Record call, failure and latency metrics
+
+The client belongs to the event loop that first uses it; the cap and the
+breaker are per worker process.
+"""
+
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+import httpx
+from dotenv import load_dotenv
+from backend.metrics import (
+    SPECS_API_CALLS, SPECS_API_FAILURES, SPECS_API_QUEUE_TIMEOUTS, SPECS_API_RETRIES, SPECS_API_SECONDS,
+    SPECS_BREAKER_REJECTIONS,
+)
+
+logger = logging.getLogger(__name__)
+
+
+load_dotenv()
+SPECS_API_URL = os.getenv("SPOTR_SPECS_API_URL", "https://api.api-ninjas.com/v1/cars")
+SPECS_API_TIMEOUT_SECONDS = float(os.getenv("SPOTR_SPECS_API_TIMEOUT_SECONDS", "10"))
+SPECS_API_CONCURRENCY = int(os.getenv("SPOTR_SPECS_API_CONCURRENCY", "4"))
+SPECS_API_KEEPALIVE_SECONDS = float(os.getenv("SPOTR_SPECS_API_KEEPALIVE_SECONDS", "30"))
+# Total time one lookup may spend on the API, retries and backoff included
+SPECS_API_DEADLINE_SECONDS = float(os.getenv("SPOTR_SPECS_API_DEADLINE_SECONDS", "3"))
+SPECS_API_MAX_RETRIES = int(os.getenv("SPOTR_SPECS_API_RETRIES", "2"))
+SPECS_API_BACKOFF_SECONDS = float(os.getenv("SPOTR_SPECS_API_BACKOFF_SECONDS", "0.2"))
+
+# Circuit breaker (see CircuitBreaker)
+BREAKER_WINDOW = int(os.getenv("SPOTR_SPECS_BREAKER_WINDOW", "20"))
+BREAKER_MIN_CALLS = int(os.getenv("SPOTR_SPECS_BREAKER_MIN_CALLS", "5"))
+BREAKER_FAILURE_RATE = float(os.getenv("SPOTR_SPECS_BREAKER_FAILURE_RATE", "0.5"))
+BREAKER_SLOW_CALL_SECONDS = float(os.getenv("SPOTR_SPECS_BREAKER_SLOW_CALL_SECONDS", "2"))
+BREAKER_SLOW_CALL_RATE = float(os.getenv("SPOTR_SPECS_BREAKER_SLOW_CALL_RATE", "0.8"))
+BREAKER_OPEN_SECONDS = float(os.getenv("SPOTR_SPECS_BREAKER_OPEN_SECONDS", "30"))
+
+BREAKER_STATES = ("closed", "half_open", "open")
+
+
+class CircuitBreaker:
+    """
+    Count-based circuit breaker.
+
+    Keeps the outcome of the last window calls. Once at least min_calls
+    are recorded, it opens when the share of failures reaches
+    failure_rate, or the share of calls slower than slow_call_seconds
+    reaches slow_call_rate. While open, calls are rejected; after
+    open_seconds it lets a single probe call through (half open), and
+    closes again if the probe succeeds in time.
+    """
+    def __init__(self, window=BREAKER_WINDOW, min_calls=BREAKER_MIN_CALLS, failure_rate=BREAKER_FAILURE_RATE,
+                 slow_call_seconds=BREAKER_SLOW_CALL_SECONDS, slow_call_rate=BREAKER_SLOW_CALL_RATE,
+                 open_seconds=BREAKER_OPEN_SECONDS):
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate = slow_call_rate
+        self.open_seconds = open_seconds
+        self.state = "closed"
+        self.opened_at = None
+        self.transitions = 0
+        self._outcomes = deque(maxlen=window)
+        self._probe_started = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Returns: True if a call may be made now"""
+        with self._lock:
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.open_seconds:
+                self._set_state("half_open")
+            if self.state == "closed":
+                return True
+            # a probe that never reported back (e.g. cancelled) is given up on
+            if self.state == "half_open" and (
+                self._probe_started is None or time.monotonic() - self._probe_started >= self.open_seconds
+            ):
+                self._probe_started = time.monotonic()
+                return True
+            return False
+
+    def record(self, ok, seconds):
+        """Records the outcome and latency of an allowed call"""
+        slow = seconds >= self.slow_call_seconds
+        with self._lock:
+            if self.state == "half_open":
+                self._probe_started = None
+                self._set_state("closed" if ok and not slow else "open")
+                return
+            self._outcomes.append((ok, slow))
+            if self.state == "closed" and len(self._outcomes) >= self.min_calls:
+                failures = sum(1 for ok, _ in self._outcomes if not ok) / len(self._outcomes)
+                slow_calls = sum(1 for _, slow in self._outcomes if slow) / len(self._outcomes)
+                if failures >= self.failure_rate or slow_calls >= self.slow_call_rate:
+                    self._set_state("open")
+
+    def _set_state(self, state):
+        logger.warning("Specs API circuit breaker %s -> %s", self.state, state)
+        self.state = state
+        self.transitions += 1
+        if state == "open":
+            self.opened_at = time.monotonic()
+        self._outcomes.clear()
+
+    def stats(self):
+        """Returns: breaker state and recent outcomes as a dictionary"""
+        with self._lock:
+            return {
+                "state": self.state,
+                "transitions": self.transitions,
+                "recent_calls": len(self._outcomes),
+                "recent_failures": sum(1 for ok, _ in self._outcomes if not ok),
+                "recent_slow_calls": sum(1 for _, slow in self._outcomes if slow),
+            }
+
+
+class SpecsClient:
+    """
+    Single-flight, concurrency-capped client for the specs API.
+
+    fetch() callers asking for a key already being fetched wait for that
+    request instead of sending their own. At most max_concurrency
+    requests are in flight at once; others queue for a slot. Failed
+    requests (errors, 429/5xx, timeouts) are retried with full-jitter
+    exponential backoff until the lookup's deadline, and not at all
+    while the circuit breaker is open.
+    """
+    def __init__(self, url=SPECS_API_URL, timeout=SPECS_API_TIMEOUT_SECONDS,
+                 max_concurrency=SPECS_API_CONCURRENCY, keepalive_seconds=SPECS_API_KEEPALIVE_SECONDS,
+                 deadline_seconds=SPECS_API_DEADLINE_SECONDS, retries=SPECS_API_MAX_RETRIES,
+                 backoff_seconds=SPECS_API_BACKOFF_SECONDS, breaker=None, transport=None):
+        self.url = url
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.keepalive_seconds = keepalive_seconds
+        self.deadline_seconds = deadline_seconds
+        self.retries = retries
+        self.backoff_seconds = backoff_seconds
+        self.breaker = breaker or CircuitBreaker()
+        # an httpx transport to use instead of the network (e.g. httpx.MockTransport)
+        self.transport = transport
+        self.requests_sent = 0
+        self.coalesced = 0
+        self._loop = None
+        self._client = None
+        self._slots = None
+        self._inflight = {}
+        # latest deadline (monotonic) of anyone waiting on each in-flight key
+        self._deadlines = {}
+
+    def _bind(self):
+        """Creates the connection pool and semaphore on the running event loop"""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # a client bound to another (closed) loop cannot be reused
+            self._loop = loop
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                transport=self.transport,
+                limits=httpx.Limits(
+                    max_connections=self.max_concurrency,
+                    max_keepalive_connections=self.max_concurrency,
+                    keepalive_expiry=self.keepalive_seconds,
+                ),
+            )
+            self._slots = asyncio.Semaphore(self.max_concurrency)
+            self._inflight = {}
+            self._deadlines = {}
+
+    async def fetch(self, key, api_key, deadline_seconds=None):
+        """
+        Accepts a (year, make, model) tuple, the API key, and optionally
+            the seconds this caller will wait (default deadline_seconds)
+        Returns: (raw JSON list or None, True if the answer is definite)
+            An empty list is definite; failures and timeouts are not.
+        """
+        self._bind()
+        deadline_seconds = self.deadline_seconds if deadline_seconds is None else deadline_seconds
+        # the shared request keeps retrying until the last waiting caller's deadline
+        deadline = time.monotonic() + deadline_seconds
+        self._deadlines[key] = max(self._deadlines.get(key, deadline), deadline)
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch_with_retries(key, api_key))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._finish(key))
+        else:
+            self.coalesced += 1
+        try:
+            # shield: one caller giving up must not cancel the request for the others
+            return await asyncio.wait_for(asyncio.shield(task), deadline_seconds)
+        except asyncio.TimeoutError:
+            return None, False
+
+    def _finish(self, key):
+        """Forgets a key once its shared request is done"""
+        self._inflight.pop(key, None)
+        self._deadlines.pop(key, None)
+
+    def _backoff(self, attempt):
+        """Returns: seconds to sleep before retry attempt (1, 2, ...): full jitter up to the exponential backoff"""
+        return random.uniform(0, self.backoff_seconds * 2 ** (attempt - 1))
+
+    async def _fetch_with_retries(self, key, api_key):
+        for attempt in range(self.retries + 1):
+            if attempt:
+                backoff = self._backoff(attempt)
+                if time.monotonic() + backoff >= self._deadlines[key]:
+                    break
+                SPECS_API_RETRIES.inc()
+                await asyncio.sleep(backoff)
+            try:
+                # time queued behind the concurrency cap is ours, not the API's:
+                # it is neither timed nor recorded by the breaker
+                await asyncio.wait_for(self._slots.acquire(), self._deadlines[key] - time.monotonic())
+            except asyncio.TimeoutError:
+                SPECS_API_QUEUE_TIMEOUTS.inc()
+                break
+            try:
+                if not self.breaker.allow():
+                    SPECS_BREAKER_REJECTIONS.inc()
+                    break
+                remaining = self._deadlines[key] - time.monotonic()
+                start = time.perf_counter()
+                cut_short = False
+                try:
+                    data, definite, retryable = await asyncio.wait_for(self._request(key, api_key), remaining)
+                except asyncio.TimeoutError:
+                    SPECS_API_FAILURES["timeout"].inc()
+                    data, definite, retryable = None, False, True
+                    cut_short = True
+                seconds = time.perf_counter() - start
+                # a call the deadline cut short before it could count as slow says nothing about the API
+                if not cut_short or seconds >= self.breaker.slow_call_seconds:
+                    self.breaker.record(definite, seconds)
+            finally:
+                self._slots.release()
+            if definite or not retryable:
+                return data, definite
+        return None, False
+
+    async def _request(self, key, api_key):
+        """
+        Sends one request; the caller holds a slot
+        Returns: (raw JSON list or None, True if definite, True if worth retrying)
+        """
+        year, make, model = key
+        SPECS_API_CALLS.inc()
+        self.requests_sent += 1
+        start = time.perf_counter()
+        try:
+            response = await self._client.get(
+                self.url,
+                params={"year": year, "make": make, "model": model},
+                headers={"X-Api-Key": api_key},
+            )
+            SPECS_API_SECONDS.observe(time.perf_counter() - start)
+            if response.status_code == 200:
+                data = response.json()
+                return (data or None, True, False) if isinstance(data, list) else (None, False, True)
+            SPECS_API_FAILURES["http_error"].inc()
+            # other client errors (e.g. a bad API key) will not go away on retry
+            return None, False, response.status_code == 429 or response.status_code >= 500
+        except httpx.TimeoutException:
+            SPECS_API_FAILURES["timeout"].inc()
+            return None, False, True
+        except Exception:
+            SPECS_API_FAILURES["exception"].inc()
+            return None, False, True
+
+    def stats(self):
+        """Returns: request counters as a dictionary"""
+        return {
+            "requests_sent": self.requests_sent,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._inflight),
+            "max_concurrency": self.max_concurrency,
+            "breaker": self.breaker.stats(),
+        }
+
+    async def close(self):
+        """Closes pooled connections; the next fetch opens a new pool"""
+        if self._client is not None:
+            await self._client.aclose()
+        self._loop = self._client = None
+
+
+_specs_client = None
+
+def get_specs_client():
+    global _specs_client
+    if _specs_client is None:
+        _specs_client = SpecsClient()
+    return _specs_client
@@ -0,0 +1,122 @@
+# Copyright (C) 2025 Colin Damon
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Offline car specs snapshot for SpotR FastAPI backend
+
+Responsibilities:
+ - Read and write the versioned snapshot of specs for every class,
+   built by scripts/build_specs_snapshot.py
+ - Hold it in memory, keyed by class name, for lookups without network
+
+A snapshot maps class names to specs dictionaries, or to null when the
+API has no data for that car. Classes missing from it (e.g. the API
+failed while building) are looked up live, unless SPOTR_SPECS_LIVE_FALLBACK=0.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import time
+from backend.specs_cache import MISS
+
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FORMAT = "spotr-specs-snapshot"
+SNAPSHOT_FORMAT_VERSION = 1
+MODELS_DIR = os.path.join(os.path.dirname(__file__), '..', 'models')
+# Empty to disable the snapshot
+SPECS_SNAPSHOT_PATH = os.getenv("SPOTR_SPECS_SNAPSHOT_PATH", os.path.join(MODELS_DIR, 'car_specs.snapshot.json'))
+SPECS_LIVE_FALLBACK = os.getenv("SPOTR_SPECS_LIVE_FALLBACK", "1") == "1"
+
+
+def read_snapshot(path):
+    """
+    Returns: the snapshot's {class name: specs or None} dictionary and its
+        header, or raises ValueError if the file is not a snapshot
+    """
+    with open(path) as f:
+        snapshot = json.load(f)
+    if snapshot.get("format") != SNAPSHOT_FORMAT or snapshot.get("format_version") != SNAPSHOT_FORMAT_VERSION:
+        raise ValueError(f"{path} is not a version {SNAPSHOT_FORMAT_VERSION} specs snapshot")
+    classes = snapshot.pop("classes")
+    return classes, snapshot
+
+
+def write_snapshot(path, classes, **metadata):
+    """
+    Atomically writes a snapshot of classes ({class name: specs or None}).
+    Extra keyword arguments are stored in the header as-is.
+    Returns: the header dictionary
+    """
+    body = json.dumps(classes, sort_keys=True, separators=(",", ":"))
+    header = {
+        "format": SNAPSHOT_FORMAT,
+        "format_version": SNAPSHOT_FORMAT_VERSION,
+        "version": hashlib.sha256(body.encode()).hexdigest()[:16],
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "num_classes": len(classes),
+        **metadata,
+    }
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({**header, "classes": dict(sorted(classes.items()))}, f, separators=(",", ":"))
+    os.replace(tmp_path, path)
+    return header
+
+
+class SpecsSnapshot:
+    """In-memory index of a specs snapshot; empty if the file is missing or invalid"""
+    def __init__(self, path=SPECS_SNAPSHOT_PATH):
+        self.path = path
+        self.classes = {}
+        self.header = None
+        if path and os.path.exists(path):
+            try:
+                self.classes, self.header = read_snapshot(path)
+                logger.info("Loaded specs snapshot %s with %d classes from %s",
+                            self.header["version"], len(self.classes), path)
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning("Ignoring specs snapshot %s: %s", path, e)
+
+    def get(self, pred_class):
+        """
+        Accepts a class name
+        Returns: its specs dictionary, None if the API has no data for it,
+            or MISS if the snapshot does not cover it
+        """
+        return self.classes.get(pred_class, MISS)
+
+    def stats(self):
+        """Returns: snapshot version and coverage as a dictionary"""
+        return {
+            "path": self.path,
+            "version": self.header["version"] if self.header else None,
+            "created_at": self.header["created_at"] if self.header else None,
+            "classes": len(self.classes),
+            "with_specs": sum(1 for specs in self.classes.values() if specs is not None),
+            "live_fallback": SPECS_LIVE_FALLBACK,
+        }
+
+
+_specs_snapshot = None
+
+def get_specs_snapshot():
+    global _specs_snapshot
+    if _specs_snapshot is None:
+        _specs_snapshot = SpecsSnapshot()
+    return _specs_snapshot
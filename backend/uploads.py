@@ -0,0 +1,528 @@
+# Copyright (C) 2025 Colin Damon
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Upload guards for SpotR FastAPI backend
+
+Responsibilities:
+ - Read uploads incrementally up to a configurable byte cap
+ - Check image format and dimensions from the header, before decoding
+ - Cap request bodies as they are received, declared size or not
+ - Reject oversized uploads and decompression bombs up front
+ - Spool batch uploads to disk and read their images one at a time, from
+   multipart parts or zip/tar archives, while the rest is still arriving
+ - Cap the number of members and decompressed bytes of batch archives
+"""
+
+import asyncio
+import io
+import json
+import os
+import tarfile
+import tempfile
+import threading
+import zipfile
+import zlib
+from PIL import Image
+from starlette.requests import ClientDisconnect
+from starlette.responses import StreamingResponse
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+
+MAX_UPLOAD_MB = float(os.getenv("SPOTR_MAX_UPLOAD_MB", "20"))
+MAX_IMAGE_PIXELS = int(os.getenv("SPOTR_MAX_IMAGE_PIXELS", "50000000"))
+ALLOWED_FORMATS = tuple(
+    f.strip().upper() for f in os.getenv("SPOTR_ALLOWED_FORMATS", "JPEG,PNG,WEBP").split(",") if f.strip()
+)
+READ_CHUNK_BYTES = 1024 * 1024
+# /predict/batch: whole request body, and number of images in it
+MAX_BATCH_UPLOAD_MB = float(os.getenv("SPOTR_MAX_BATCH_UPLOAD_MB", "2048"))
+MAX_BATCH_ITEMS = int(os.getenv("SPOTR_MAX_BATCH_ITEMS", "10000"))
+# /predict/batch archives (zip bombs): entries of any kind, and total size once decompressed
+MAX_BATCH_ARCHIVE_MEMBERS = int(os.getenv("SPOTR_MAX_BATCH_ARCHIVE_MEMBERS", "20000"))
+MAX_BATCH_UNCOMPRESSED_MB = float(os.getenv("SPOTR_MAX_BATCH_UNCOMPRESSED_MB", "4096"))
+
+# Archive kinds by Content-Type (of the body or of a multipart part) and file name suffix
+ARCHIVE_CONTENT_TYPES = {
+    "application/zip": "zip", "application/x-zip-compressed": "zip",
+    "application/x-tar": "tar", "application/gzip": "tar", "application/x-gzip": "tar", "application/x-gtar": "tar",
+}
+ARCHIVE_SUFFIXES = {".zip": "zip", ".tar": "tar", ".tar.gz": "tar", ".tgz": "tar"}
+
+# Headroom for multipart boundaries and headers around the file itself
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+
+class UploadRejected(Exception):
+    """Raised when an upload is refused, with the HTTP status to answer with"""
+    def __init__(self, status_code, detail):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def max_upload_bytes():
+    return int(MAX_UPLOAD_MB * 1024 * 1024)
+
+
+def max_batch_upload_bytes():
+    return int(MAX_BATCH_UPLOAD_MB * 1024 * 1024)
+
+
+def max_batch_uncompressed_bytes():
+    return int(MAX_BATCH_UNCOMPRESSED_MB * 1024 * 1024)
+
+
+class UploadSizeLimitMiddleware:
+    """
+    ASGI middleware capping POST bodies at max_bytes(path) (plus multipart
+    overhead). A declared Content-Length over the cap is rejected before
+    anything is read; bodies without one (chunked) are counted as they
+    arrive, and the request is cut off with a 413 once they pass the cap,
+    before Starlette spools any more of it to disk.
+    """
+    def __init__(self, app, max_bytes):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST":
+            return await self.app(scope, receive, send)
+        max_bytes = self.max_bytes(scope["path"])
+        headers = dict(scope["headers"])
+        try:
+            content_length = headers.get(b"content-length")
+            check_content_length(content_length.decode("latin-1") if content_length else None, max_bytes)
+        except UploadRejected as e:
+            return await _send_rejection(send, e)
+
+        state = {"received": 0, "started": False, "rejected": False}
+
+        async def limited_receive():
+            if state["rejected"]:
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.request":
+                state["received"] += len(message.get("body", b""))
+                if state["received"] > max_bytes + MULTIPART_OVERHEAD_BYTES:
+                    state["rejected"] = True
+                    if not state["started"]:
+                        await _send_rejection(send, UploadRejected(
+                            413, f"Upload exceeds {max_bytes // (1024 * 1024)} MB limit"
+                        ))
+                    # the app sees a disconnect and stops reading the body
+                    return {"type": "http.disconnect"}
+            return message
+
+        async def guarded_send(message):
+            if message["type"] == "http.response.start":
+                if state["rejected"]:
+                    return
+                state["started"] = True
+            elif state["rejected"] and not state["started"]:
+                return
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except Exception:
+            # the app failing on the cut-off body is expected; the 413 is already sent
+            if not state["rejected"] or state["started"]:
+                raise
+
+
+async def _send_rejection(send, rejection):
+    body = json.dumps({"detail": rejection.detail}).encode()
+    await send({
+        "type": "http.response.start",
+        "status": rejection.status_code,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+def check_content_length(content_length, max_bytes=None):
+    """
+    Accepts the request's Content-Length header value (or None)
+    Raises UploadRejected(413) if the body is already known to be too big
+    """
+    max_bytes = max_upload_bytes() if max_bytes is None else max_bytes
+    if content_length is None:
+        return
+    try:
+        length = int(content_length)
+    except ValueError:
+        raise UploadRejected(400, "Invalid Content-Length header")
+    if length > max_bytes + MULTIPART_OVERHEAD_BYTES:
+        raise UploadRejected(413, f"Upload exceeds {max_bytes // (1024 * 1024)} MB limit")
+
+
+async def read_upload(file, max_bytes=None):
+    """
+    Accepts a FastAPI UploadFile
+    Returns: its contents as bytes, read in chunks and never past max_bytes
+    """
+    max_bytes = max_upload_bytes() if max_bytes is None else max_bytes
+    buffer = bytearray()
+    while True:
+        chunk = await file.read(READ_CHUNK_BYTES)
+        if not chunk:
+            return bytes(buffer)
+        if len(buffer) + len(chunk) > max_bytes:
+            raise UploadRejected(413, f"Upload exceeds {max_bytes // (1024 * 1024)} MB limit")
+        buffer += chunk
+
+
+def probe_image(image_bytes, max_pixels=MAX_IMAGE_PIXELS, allowed_formats=ALLOWED_FORMATS):
+    """
+    Accepts raw uploaded image bytes
+    Returns: (format, width, height), read from the header only
+
+    Raises UploadRejected(415) for unreadable or disallowed formats and
+    UploadRejected(413) when width * height exceeds max_pixels.
+    """
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            image_format, (width, height) = image.format, image.size
+    except Image.DecompressionBombError:
+        raise UploadRejected(413, "Image dimensions too large")
+    except Exception:
+        raise UploadRejected(415, "File is not a readable image")
+
+    if image_format not in allowed_formats:
+        raise UploadRejected(415, f"Unsupported image format {image_format}")
+    if width * height > max_pixels:
+        raise UploadRejected(413, f"Image has {width * height} pixels, limit is {max_pixels}")
+    return image_format, width, height
+
+
+class SpooledBody:
+    """
+    Request body spooled to an anonymous temporary file as it arrives, and
+    readable from another thread while it is still being written.
+
+    read() blocks until more of the body is in and returns b"" at its end,
+    or raises the error the body ended with. The writer never waits for
+    the reader, so the client can always finish sending the body.
+    """
+    def __init__(self):
+        self._file = tempfile.TemporaryFile()
+        self._written = 0
+        self._read = 0
+        self._done = False
+        self._error = None
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def write(self, chunk):
+        with self._cond:
+            if not self._closed:
+                self._file.seek(self._written)
+                self._file.write(chunk)
+                self._written += len(chunk)
+                self._cond.notify_all()
+
+    def finish(self, error=None):
+        """Marks the end of the body; readers get error (an exception) once they reach it"""
+        with self._cond:
+            self._done = True
+            self._error = error
+            self._cond.notify_all()
+
+    def read(self, size=-1):
+        with self._cond:
+            while self._read >= self._written and not self._done and not self._closed:
+                self._cond.wait()
+            if self._closed:
+                raise ValueError("read from closed body")
+            if self._read >= self._written:
+                if self._error is not None:
+                    raise self._error
+                return b""
+            available = self._written - self._read
+            self._file.seek(self._read)
+            data = self._file.read(available if size is None or size < 0 else min(size, available))
+            self._read += len(data)
+            return data
+
+    def complete_file(self):
+        """Returns: the whole body's file, rewound, once all of it is in (for formats that need to seek)"""
+        with self._cond:
+            while not self._done and not self._closed:
+                self._cond.wait()
+            if self._closed:
+                raise ValueError("read from closed body")
+            if self._error is not None:
+                raise self._error
+            self._file.seek(0)
+            return self._file
+
+    def close(self):
+        """Deletes the spooled body; blocked readers raise ValueError"""
+        with self._cond:
+            self._closed = True
+            self._file.close()
+            self._cond.notify_all()
+
+
+async def spool_body(request, body, max_bytes=None):
+    """
+    Accepts a Starlette Request and a SpooledBody
+    Writes the request body into it in chunks as they arrive, never past
+        max_bytes. The body ends with UploadRejected if it is too large or
+        the client goes away.
+    """
+    max_bytes = max_batch_upload_bytes() if max_bytes is None else max_bytes
+    size = 0
+    try:
+        async for chunk in request.stream():
+            size += len(chunk)
+            if size > max_bytes:
+                raise UploadRejected(413, f"Upload exceeds {max_bytes // (1024 * 1024)} MB limit")
+            body.write(chunk)
+    except UploadRejected as e:
+        body.finish(e)
+    except ClientDisconnect:
+        body.finish(UploadRejected(400, "Upload ended before the end of the body"))
+    else:
+        body.finish()
+
+
+class BodyStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse sent while the request body is still being read
+    (by body_task). Listening for a client disconnect also reads from the
+    request, so it waits until the body is in; until then a disconnect
+    ends the body instead.
+    """
+    def __init__(self, content, body_task, **kwargs):
+        super().__init__(content, **kwargs)
+        self.body_task = body_task
+
+    async def listen_for_disconnect(self, receive):
+        await asyncio.wait([self.body_task])
+        await super().listen_for_disconnect(receive)
+
+
+def _archive_kind(content_type, filename=None):
+    """Returns: "zip" or "tar" if the Content-Type or file name is an archive's, else None"""
+    kind = ARCHIVE_CONTENT_TYPES.get(content_type.split(";", 1)[0].strip().lower())
+    if kind is None and filename:
+        kind = next((k for suffix, k in ARCHIVE_SUFFIXES.items() if filename.lower().endswith(suffix)), None)
+    return kind
+
+
+def _too_large(max_bytes):
+    return UploadRejected(413, f"Image exceeds {max_bytes // (1024 * 1024)} MB limit")
+
+
+class ArchiveLimits:
+    """
+    Members and decompressed bytes read from one batch's archives so far.
+    Raises UploadRejected(413) once either passes its limit.
+    """
+    def __init__(self, max_members=MAX_BATCH_ARCHIVE_MEMBERS, max_bytes=None):
+        self.max_members = max_members
+        self.max_bytes = max_batch_uncompressed_bytes() if max_bytes is None else max_bytes
+        self.members = 0
+        self.bytes = 0
+
+    def add_member(self):
+        self.members += 1
+        if self.members > self.max_members:
+            raise UploadRejected(413, f"Batch archives exceed {self.max_members} entries")
+
+    def add_bytes(self, nbytes):
+        self.bytes += nbytes
+        if self.bytes > self.max_bytes:
+            raise UploadRejected(413, f"Batch archives exceed {self.max_bytes // (1024 * 1024)} MB decompressed")
+
+
+def _read_zip_member(archive, info, max_item_bytes):
+    """
+    Returns: a zip member's bytes, at most max_item_bytes + 1 of them, or
+        UploadRejected if this entry cannot be read (the others still can)
+    """
+    if info.flag_bits & 0x1:
+        return UploadRejected(415, "Archive entry is encrypted")
+    try:
+        with archive.open(info) as member:
+            # the header's size is not trusted: read one byte past the limit
+            return member.read(max_item_bytes + 1)
+    except NotImplementedError as e:
+        # e.g. a compression method zipfile does not support
+        return UploadRejected(415, f"Unsupported archive entry: {e}")
+    except RuntimeError as e:
+        return UploadRejected(415, f"Unreadable archive entry: {e}")
+    except (zipfile.BadZipFile, EOFError, OSError, zlib.error) as e:
+        return UploadRejected(400, f"Corrupt archive entry: {e}")
+
+
+def _iter_archive(fileobj, kind, max_item_bytes, limits):
+    """
+    Yields: (member name, bytes or UploadRejected) for each file in a zip/tar
+        archive, counting every entry and decompressed byte against limits.
+        Tar archives are read front to back as they arrive; zip archives,
+        indexed at their end, once the whole body is in.
+    """
+    try:
+        if kind == "zip":
+            if isinstance(fileobj, SpooledBody):
+                fileobj = fileobj.complete_file()
+            with zipfile.ZipFile(fileobj) as archive:
+                for info in archive.infolist():
+                    limits.add_member()
+                    name = info.filename
+                    if info.is_dir() or os.path.basename(name).startswith(".") or name.startswith("__MACOSX/"):
+                        continue
+                    if info.file_size > max_item_bytes:
+                        yield name, _too_large(max_item_bytes)
+                        continue
+                    data = _read_zip_member(archive, info, max_item_bytes)
+                    if isinstance(data, UploadRejected):
+                        yield name, data
+                        continue
+                    limits.add_bytes(len(data))
+                    yield name, data if len(data) <= max_item_bytes else _too_large(max_item_bytes)
+        else:
+            # stream mode: no seeking back, so it works on a body still arriving
+            with tarfile.open(fileobj=fileobj, mode="r|*") as archive:
+                for member in archive:
+                    limits.add_member()
+                    # skipped members are decompressed too, to get past them
+                    limits.add_bytes(member.size)
+                    if not member.isfile() or os.path.basename(member.name).startswith("."):
+                        continue
+                    if member.size > max_item_bytes:
+                        yield member.name, _too_large(max_item_bytes)
+                        continue
+                    yield member.name, archive.extractfile(member).read()
+    except (zipfile.BadZipFile, tarfile.TarError, EOFError, OSError) as e:
+        raise UploadRejected(400, f"Unreadable {kind} archive: {e}")
+
+
+def _iter_multipart(fileobj, boundary, max_item_bytes, limits):
+    """
+    Yields: (file name, bytes or UploadRejected) for each file part of a
+        multipart body as soon as the part is read, and for each file in
+        parts that are archives. Archive parts are spooled to their own
+        temporary file.
+    """
+    completed = []
+    part = {}
+
+    def on_part_begin():
+        part.clear()
+        part.update(headers={}, field=b"", value=b"", filename=None, kind=None, data=None, too_large=False)
+
+    def on_header_field(data, start, end):
+        part["field"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        part["value"] += data[start:end]
+
+    def on_header_end():
+        part["headers"][part["field"].decode("latin-1").lower()] = part["value"].decode("latin-1")
+        part["field"] = part["value"] = b""
+
+    def on_headers_finished():
+        _, options = parse_options_header(part["headers"].get("content-disposition", ""))
+        filename = options.get(b"filename")
+        if filename is not None:
+            part["filename"] = filename.decode("utf-8", "replace")
+            part["kind"] = _archive_kind(part["headers"].get("content-type", ""), part["filename"])
+            part["data"] = tempfile.TemporaryFile() if part["kind"] else bytearray()
+
+    def on_part_data(data, start, end):
+        if part["data"] is None or part["too_large"]:
+            return
+        if part["kind"]:
+            part["data"].write(data[start:end])
+        elif len(part["data"]) + end - start > max_item_bytes:
+            part["too_large"] = True
+            part["data"] = bytearray()
+        else:
+            part["data"] += data[start:end]
+
+    def on_part_end():
+        if part["data"] is not None:
+            completed.append(dict(part))
+
+    parser = MultipartParser(boundary, {
+        "on_part_begin": on_part_begin, "on_header_field": on_header_field, "on_header_value": on_header_value,
+        "on_header_end": on_header_end, "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data, "on_part_end": on_part_end,
+    })
+    while True:
+        chunk = fileobj.read(READ_CHUNK_BYTES)
+        try:
+            if chunk:
+                parser.write(chunk)
+            else:
+                parser.finalize()
+        except Exception as e:
+            raise UploadRejected(400, f"Malformed multipart body: {e}")
+        for item in completed:
+            if item["kind"]:
+                with item["data"] as archive:
+                    archive.seek(0)
+                    yield from _iter_archive(archive, item["kind"], max_item_bytes, limits)
+            elif item["too_large"]:
+                yield item["filename"], _too_large(max_item_bytes)
+            else:
+                yield item["filename"], bytes(item["data"])
+        completed.clear()
+        if not chunk:
+            return
+
+
+def iter_batch_items(body, content_type, max_item_bytes=None, max_items=MAX_BATCH_ITEMS, limits=None):
+    """
+    Accepts a batch upload (a SpooledBody, see spool_body, or a file) and
+        its Content-Type: multipart/form-data with image and/or archive
+        file parts, or a zip/tar(.gz) archive as the body itself
+    Returns: an iterator of (name, image bytes or UploadRejected), reading
+        one image at a time, blocking while the body is still arriving. It
+        raises UploadRejected when the body turns out to be malformed, to
+        hold more than max_items images, or its archives to pass limits
+        (an ArchiveLimits).
+
+    Raises UploadRejected(415) for other content types, and (400) for
+    multipart bodies without a boundary.
+    """
+    max_item_bytes = max_upload_bytes() if max_item_bytes is None else max_item_bytes
+    limits = ArchiveLimits() if limits is None else limits
+    media_type, options = parse_options_header(content_type)
+    if media_type == b"multipart/form-data":
+        boundary = options.get(b"boundary")
+        if not boundary:
+            raise UploadRejected(400, "Multipart body has no boundary")
+        items = _iter_multipart(body, boundary, max_item_bytes, limits)
+    else:
+        kind = _archive_kind(content_type)
+        if kind is None:
+            raise UploadRejected(415, "Batch must be multipart/form-data, or a zip or tar archive")
+        items = _iter_archive(body, kind, max_item_bytes, limits)
+    return _limit_items(items, max_items)
+
+
+def _limit_items(items, max_items):
+    for count, item in enumerate(items, 1):
+        if count > max_items:
+            raise UploadRejected(413, f"Batch exceeds {max_items} images")
+        yield item
@@ -0,0 +1,264 @@
+# Copyright (C) 2025 Colin Damon
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Inference worker pool for SpotR FastAPI backend
+
+Responsibilities:
+ - Run the model in long-lived worker processes instead of the web process
+ - Hand input batches to workers through shared memory, without pickling
+ - Restart workers that crash and fail the batch they were running
+ - Report queue depth and per-worker state
+
+Each worker owns one shared memory slot large enough for a full batch.
+The web process writes a batch into an idle worker's slot and sends only
+(job id, batch size) over a queue; the worker answers with the small
+per-item result dictionaries for that batch.
+"""
+
+import itertools
+import logging
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing import resource_tracker, shared_memory
+import torch
+from backend.preprocess import CROP_SIZE
+
+logger = logging.getLogger(__name__)
+
+INFERENCE_PROCESSES = int(os.getenv("SPOTR_INFERENCE_PROCESSES", "0"))
+INFERENCE_PROCESS_THREADS = int(os.getenv("SPOTR_INFERENCE_PROCESS_THREADS", "1"))
+INPUT_NUMEL = 3 * CROP_SIZE * CROP_SIZE
+
+
+def _attach_shared_memory(name):
+    """
+    Attach to the web process's slot without registering it with the
+    resource tracker: the web process alone registers and unlinks it
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        pass
+    # Python < 3.13 registers every attach. A worker with a tracker of its own
+    # would have it unlink the slot when the worker exits, and unregistering
+    # after attaching would drop the web process's entry from a shared one
+    register = resource_tracker.register
+    resource_tracker.register = lambda name, rtype: None
+    try:
+        return shared_memory.SharedMemory(name=name)
+    finally:
+        resource_tracker.register = register
+
+
+def _worker_main(worker_id, shm_name, capacity, tasks, results, torch_threads):
+    """Entry point of a worker process"""
+    from backend.model import get_model_instance
+
+    torch.set_num_threads(torch_threads)
+    shm = _attach_shared_memory(shm_name)
+    inputs = torch.frombuffer(shm.buf, dtype=torch.float32, count=capacity * INPUT_NUMEL)
+    inputs = inputs.view(capacity, 3, CROP_SIZE, CROP_SIZE)
+
+    model_instance = get_model_instance()
+    model_instance.preload()
+    results.put(("ready", worker_id, None, model_instance.version))
+    while True:
+        job = tasks.get()
+        if job is None:
+            break
+        job_id, size = job
+        try:
+            results.put(("done", worker_id, job_id, model_instance.predict_batch(inputs[:size])))
+        except Exception as e:
+            results.put(("error", worker_id, job_id, f"{type(e).__name__}: {e}"))
+    del inputs
+    shm.close()
+
+
+class InferencePool:
+    """
+    Pool of long-lived inference processes fed through shared memory.
+
+    submit() never blocks: batches wait in a pending queue until a worker
+    is idle. If a worker dies, the batch it was running fails and a fresh
+    worker is started in its place.
+    """
+    def __init__(self, processes=INFERENCE_PROCESSES, torch_threads=INFERENCE_PROCESS_THREADS, capacity=8):
+        self.processes = max(1, processes)
+        self.torch_threads = torch_threads
+        self.capacity = capacity
+        self.version = None
+        self.restarts = 0
+        self.batches_run = 0
+        self._ctx = mp.get_context("spawn")
+        self._results = self._ctx.Queue()
+        self._pending = queue.Queue()
+        self._idle = queue.Queue()
+        self._workers = []
+        self._job_ids = itertools.count()
+        self._lock = threading.Lock()
+        self._closing = False
+
+    def start(self):
+        for worker_id in range(self.processes):
+            shm = shared_memory.SharedMemory(create=True, size=self.capacity * INPUT_NUMEL * 4)
+            self._workers.append({"shm": shm, "process": None, "tasks": None, "job": None, "generation": 0})
+            self._start_worker(worker_id)
+        threading.Thread(target=self._dispatch, name="spotr-pool-dispatch", daemon=True).start()
+        threading.Thread(target=self._collect, name="spotr-pool-collect", daemon=True).start()
+        return self
+
+    def _start_worker(self, worker_id):
+        worker = self._workers[worker_id]
+        worker["tasks"] = self._ctx.Queue()
+        worker["generation"] += 1
+        worker["ready"] = False
+        worker["process"] = self._ctx.Process(
+            target=_worker_main,
+            args=(worker_id, worker["shm"].name, self.capacity, worker["tasks"], self._results, self.torch_threads),
+            name=f"spotr-inference-{worker_id}",
+            daemon=True,
+        )
+        worker["process"].start()
+
+    def submit(self, input_batch):
+        """
+        Accepts a (N, 3, 224, 224) input tensor, N <= capacity
+        Returns: concurrent.futures.Future for the list of N result dictionaries
+        """
+        if input_batch.shape[0] > self.capacity:
+            raise ValueError(f"Batch of {input_batch.shape[0]} exceeds pool capacity {self.capacity}")
+        future = Future()
+        self._pending.put((input_batch, future))
+        return future
+
+    def _dispatch(self):
+        while True:
+            input_batch, future = self._pending.get()
+            if not future.set_running_or_notify_cancel():
+                continue
+            while True:
+                worker_id, generation = self._idle.get()
+                with self._lock:
+                    worker = self._workers[worker_id]
+                    if generation != worker["generation"] or not worker["process"].is_alive():
+                        continue
+                    size = input_batch.shape[0]
+                    slot = torch.frombuffer(worker["shm"].buf, dtype=torch.float32, count=size * INPUT_NUMEL)
+                    slot.copy_(input_batch.reshape(-1))
+                    del slot
+                    job_id = next(self._job_ids)
+                    worker["job"] = (job_id, future)
+                    worker["tasks"].put((job_id, size))
+                    break
+
+    def _collect(self):
+        last_check = time.monotonic()
+        while not self._closing:
+            if time.monotonic() - last_check >= 1:
+                self._check_workers()
+                last_check = time.monotonic()
+            try:
+                kind, worker_id, job_id, payload = self._results.get(timeout=1)
+            except queue.Empty:
+                continue
+            with self._lock:
+                worker = self._workers[worker_id]
+                if kind == "ready":
+                    worker["ready"] = True
+                    self.version = payload
+                else:
+                    job = worker["job"]
+                    worker["job"] = None
+                    if job is not None and job[0] == job_id:
+                        if kind == "done":
+                            self.batches_run += 1
+                            job[1].set_result(payload)
+                        else:
+                            job[1].set_exception(RuntimeError(payload))
+                generation = worker["generation"]
+            self._idle.put((worker_id, generation))
+
+    def _check_workers(self):
+        with self._lock:
+            for worker_id, worker in enumerate(self._workers):
+                if self._closing or worker["process"].is_alive():
+                    continue
+                logger.warning("Inference worker %d died (exit code %s), restarting",
+                               worker_id, worker["process"].exitcode)
+                if worker["job"] is not None:
+                    worker["job"][1].set_exception(RuntimeError("Inference worker crashed"))
+                    worker["job"] = None
+                self.restarts += 1
+                self._start_worker(worker_id)
+
+    def queue_depth(self):
+        return self._pending.qsize()
+
+    def close(self):
+        self._closing = True
+        for worker in self._workers:
+            worker["tasks"].put(None)
+        deadline = time.monotonic() + 5
+        for worker in self._workers:
+            worker["process"].join(max(0, deadline - time.monotonic()))
+            if worker["process"].is_alive():
+                worker["process"].terminate()
+            worker["shm"].close()
+            worker["shm"].unlink()
+
+    def stats(self):
+        """Returns: queue depth and per-worker state as a dictionary"""
+        with self._lock:
+            workers = [
+                {
+                    "pid": w["process"].pid,
+                    "alive": w["process"].is_alive(),
+                    "ready": w["ready"],
+                    "busy": w["job"] is not None,
+                }
+                for w in self._workers
+            ]
+        return {
+            "processes": self.processes,
+            "torch_threads": self.torch_threads,
+            "queue_depth": self.queue_depth(),
+            "batches_run": self.batches_run,
+            "restarts": self.restarts,
+            "model_version": self.version,
+            "workers": workers,
+        }
+
+
+_inference_pool = None
+
+def get_inference_pool(capacity=8):
+    """Returns: the started pool, or None when SPOTR_INFERENCE_PROCESSES is 0"""
+    global _inference_pool
+    if _inference_pool is None and INFERENCE_PROCESSES > 0:
+        _inference_pool = InferencePool(capacity=capacity).start()
+    return _inference_pool
+
+
+def close_inference_pool():
+    global _inference_pool
+    if _inference_pool is not None:
+        _inference_pool.close()
+        _inference_pool = None
@@ -0,0 +1,363 @@
+# Copyright (C) 2025 Colin Damon
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+HTTP load benchmark for SpotR FastAPI backend
+
+Usage (from the repo root):
+    python -m benchmarks.http_load --clients 8 --duration 30 --output run.json
+
+Starts the backend locally (uvicorn, or backend.serve with --launcher
+serve) with the car specs API replaced by a local mock, then has
+--clients concurrent clients each upload an image to /predict and look
+up specs for the result on /car-specs, like the frontend does. Images
+come from a dataset CSV when its files are on disk, otherwise from
+synthetic photos of varied sizes and formats (JPEG, PNG, WEBP).
+
+The report (JSON, to stdout or --output) has throughput, p50/p95/p99
+latency and error rate per endpoint, and the server's peak RSS and PSS
+summed over all its processes. The backend reads its configuration from
+the usual SPOTR_* environment variables, which the report records, so
+runs can be compared across commits and configurations, e.g.:
+    SPOTR_BATCH_MAX_SIZE=1 python -m benchmarks.http_load --output no_batching.json
+    SPOTR_ENGINE=onnxruntime python -m benchmarks.http_load --output onnx.json
+
+The prediction and specs caches (and the specs snapshot) are disabled
+unless --cache is passed, so repeated images measure inference and specs
+lookups rather than cache hits.
+
+To see how /car-specs behaves when the specs API misbehaves, the mock
+can fail (--specs-error-rate) or hang (--specs-hang-rate) a share of
+requests; the report includes the backend's specs client retry and
+circuit breaker state, e.g.:
+    python -m benchmarks.http_load --specs-error-rate 0.5 --specs-hang-rate 0.2
+"""
+
+import argparse
+import csv
+import io
+import itertools
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import psutil
+import requests
+from PIL import Image, ImageDraw, ImageFilter
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SYNTHETIC_SIZES = ((320, 240), (640, 480), (1024, 768), (1920, 1080), (4032, 3024))
+SYNTHETIC_FORMATS = ("JPEG", "JPEG", "JPEG", "PNG", "WEBP")
+MOCK_SPECS = [{
+    "class": "midsize car", "displacement": 2.0, "cylinders": 4,
+    "fuel_type": "gas", "transmission": "a", "drive": "fwd",
+}]
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_mock_specs_api(latency_ms, error_rate=0, hang_rate=0, hang_seconds=15, seed=0):
+    """
+    Returns: (server, URL) of a local stand-in for the car specs API that
+        fails error_rate of requests with a 503 and answers hang_rate of
+        them only after hang_seconds
+    """
+    body = json.dumps(MOCK_SPECS).encode()
+    rng = random.Random(seed)
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            fault = rng.random()
+            if fault < error_rate:
+                self.send_response(503)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            time.sleep(hang_seconds if fault < error_rate + hang_rate else latency_ms / 1000)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", _free_port()), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}/v1/cars"
+
+
+def dataset_images(csv_path, image_dir, count, seed):
+    """Returns: up to count (filename, bytes, content type) uploads listed in a dataset CSV"""
+    if not csv_path or not os.path.exists(csv_path):
+        return []
+    with open(csv_path, newline="") as f:
+        rows = list(csv.DictReader(f))
+    random.Random(seed).shuffle(rows)
+    images = []
+    for row in rows:
+        path = os.path.join(image_dir, row["filename"])
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                images.append((os.path.basename(path), f.read(), "image/jpeg"))
+            if len(images) == count:
+                break
+    return images
+
+
+def synthetic_images(count, seed):
+    """Returns: count synthetic photo-like uploads of varied sizes and formats"""
+    rng = random.Random(seed)
+    images = []
+    for i in range(count):
+        width, height = SYNTHETIC_SIZES[i % len(SYNTHETIC_SIZES)]
+        image_format = SYNTHETIC_FORMATS[i % len(SYNTHETIC_FORMATS)]
+        if image_format != "JPEG":
+            # lossless formats of a 12 MP photo would dwarf typical uploads
+            width, height = min(width, 1280), min(height, 960)
+        image = Image.new("RGB", (width, height), tuple(rng.randrange(256) for _ in range(3)))
+        draw = ImageDraw.Draw(image)
+        for _ in range(24):
+            x, y = rng.randrange(width), rng.randrange(height)
+            w, h = rng.randrange(width // 8, width // 2), rng.randrange(height // 8, height // 2)
+            draw.ellipse((x, y, x + w, y + h), fill=tuple(rng.randrange(256) for _ in range(3)))
+        image = image.filter(ImageFilter.GaussianBlur(radius=max(1, width // 400)))
+        buffer = io.BytesIO()
+        image.save(buffer, format=image_format, quality=90)
+        images.append((f"synthetic{i}.{image_format.lower()}", buffer.getvalue(), f"image/{image_format.lower()}"))
+    return images
+
+
+class RssSampler:
+    """Samples the summed RSS and PSS of a process and its children, keeping the peak"""
+    def __init__(self, pid, interval=0.2):
+        self.process = psutil.Process(pid)
+        self.interval = interval
+        self.peak_rss = 0
+        self.peak_pss = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.is_set():
+            rss = pss = 0
+            try:
+                for process in [self.process] + self.process.children(recursive=True):
+                    memory = process.memory_full_info()
+                    rss += memory.rss
+                    pss += getattr(memory, "pss", memory.rss)
+            except psutil.Error:
+                pass
+            self.peak_rss = max(self.peak_rss, rss)
+            self.peak_pss = max(self.peak_pss, pss)
+            self._stop.wait(self.interval)
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+
+def start_backend(launcher, port, env):
+    """Starts the backend and waits for /health; returns the subprocess"""
+    if launcher == "serve":
+        env = {**env, "SPOTR_HOST": "127.0.0.1", "SPOTR_PORT": str(port)}
+        command = [sys.executable, "-m", "backend.serve"]
+    else:
+        command = [sys.executable, "-m", "uvicorn", "backend.main:app",
+                   "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"]
+    process = subprocess.Popen(command, cwd=REPO_ROOT, env=env)
+    deadline = time.monotonic() + 300
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"backend exited with code {process.returncode}")
+        try:
+            if requests.get(f"http://127.0.0.1:{port}/health", timeout=5).status_code == 200:
+                return process
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError("backend did not become healthy within 300s")
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(q / 100 * len(sorted_values)))]
+
+
+def summarize(samples, elapsed):
+    """Accepts [(latency seconds, ok), ...]; returns throughput, latency and error statistics"""
+    latencies = sorted(round(latency * 1000, 2) for latency, ok in samples if ok)
+    errors = sum(1 for _, ok in samples if not ok)
+    return {
+        "requests": len(samples),
+        "errors": errors,
+        "error_rate": round(errors / len(samples), 4) if samples else 0,
+        "throughput_rps": round(len(latencies) / elapsed, 2),
+        "latency_ms": {
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "mean": round(sum(latencies) / len(latencies), 2) if latencies else None,
+            "max": latencies[-1] if latencies else None,
+        },
+    }
+
+
+def run_clients(base_url, images, clients, duration, total_requests, with_specs):
+    """Returns: ({endpoint: [(latency seconds, ok), ...]}, elapsed seconds)"""
+    samples = {"predict": [], "car-specs": []}
+    counter = itertools.count()
+    deadline = time.monotonic() + duration
+    lock = threading.Lock()
+
+    def client():
+        session = requests.Session()
+        while True:
+            n = next(counter)
+            if (total_requests and n >= total_requests) or (not total_requests and time.monotonic() > deadline):
+                return
+            name, data, content_type = images[n % len(images)]
+            start = time.perf_counter()
+            try:
+                response = session.post(f"{base_url}/predict", files={"file": (name, data, content_type)}, timeout=120)
+                ok = response.status_code == 200
+            except requests.RequestException:
+                ok = False
+            with lock:
+                samples["predict"].append((time.perf_counter() - start, ok))
+            if not (ok and with_specs):
+                continue
+            start = time.perf_counter()
+            try:
+                specs = session.get(f"{base_url}/car-specs",
+                                    params={"pred_class": response.json()["pred_class"]}, timeout=30)
+                ok = specs.status_code == 200 and "error" not in specs.json()
+            except requests.RequestException:
+                ok = False
+            with lock:
+                samples["car-specs"].append((time.perf_counter() - start, ok))
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples, time.perf_counter() - start
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP load benchmark for the SpotR backend")
+    parser.add_argument("--clients", type=int, default=8, help="concurrent clients")
+    parser.add_argument("--duration", type=float, default=30, help="seconds to run (ignored with --requests)")
+    parser.add_argument("--requests", type=int, default=0, help="total /predict requests to send")
+    parser.add_argument("--warmup", type=int, default=4, help="untimed requests sent first")
+    parser.add_argument("--launcher", choices=("uvicorn", "serve"), default="uvicorn",
+                        help="single uvicorn process, or the multi-worker backend.serve")
+    parser.add_argument("--csv", default="dataset/train1/test1.csv", help="dataset CSV to draw images from")
+    parser.add_argument("--image-dir", default="dataset/", help="directory the CSV's filenames are relative to")
+    parser.add_argument("--images", type=int, default=64, help="distinct images to cycle through")
+    parser.add_argument("--no-specs", action="store_true", help="only call /predict")
+    parser.add_argument("--specs-latency-ms", type=float, default=50, help="mock specs API response delay")
+    parser.add_argument("--specs-error-rate", type=float, default=0, help="share of mock specs API requests failing with 503")
+    parser.add_argument("--specs-hang-rate", type=float, default=0,
+                        help="share of mock specs API requests answered only after --specs-hang-seconds")
+    parser.add_argument("--specs-hang-seconds", type=float, default=15)
+    parser.add_argument("--cache", action="store_true", help="leave the prediction and specs caches enabled")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    images = dataset_images(args.csv, args.image_dir, args.images, args.seed)
+    image_source = "dataset"
+    if not images:
+        images, image_source = synthetic_images(args.images, args.seed), "synthetic"
+    print(f"USING {len(images)} {image_source.upper()} IMAGES", file=sys.stderr)
+
+    mock_server, mock_url = start_mock_specs_api(
+        args.specs_latency_ms, args.specs_error_rate, args.specs_hang_rate, args.specs_hang_seconds, args.seed
+    )
+    env = {**os.environ, "API_NINJAS_KEY": "benchmark", "SPOTR_SPECS_API_URL": mock_url}
+    if not args.cache:
+        env["SPOTR_PREDICTION_CACHE_ENTRIES"] = "0"
+        env["SPOTR_SPECS_CACHE_PATH"] = ""
+        env["SPOTR_SPECS_SNAPSHOT_PATH"] = ""
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [REPO_ROOT, env.get("PYTHONPATH")]))
+
+    port = _free_port()
+    print(f"STARTING BACKEND ({args.launcher}) ON PORT {port}...", file=sys.stderr)
+    backend = start_backend(args.launcher, port, env)
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        sampler = RssSampler(backend.pid).start()
+        print("WARMING UP...", file=sys.stderr)
+        run_clients(base_url, images, 1, 0, args.warmup, not args.no_specs)
+        print(f"RUNNING {args.clients} CLIENTS...", file=sys.stderr)
+        samples, elapsed = run_clients(
+            base_url, images, args.clients, args.duration, args.requests, not args.no_specs
+        )
+        sampler.stop()
+        # one worker's view with --launcher serve
+        specs_client = requests.get(f"{base_url}/health", timeout=30).json().get("specs_client")
+    finally:
+        backend.terminate()
+        backend.wait(timeout=30)
+        mock_server.shutdown()
+
+    report = {
+        "commit": git_commit(),
+        "config": {
+            **{k: v for k, v in vars(args).items() if k != "output"},
+            "image_source": image_source,
+            "env": {k: v for k, v in sorted(env.items()) if k.startswith("SPOTR_") and k != "SPOTR_SPECS_API_URL"},
+        },
+        "elapsed_seconds": round(elapsed, 3),
+        "endpoints": {name: summarize(s, elapsed) for name, s in samples.items() if s},
+        "peak_rss_mb": round(sampler.peak_rss / (1024 * 1024), 1),
+        "peak_pss_mb": round(sampler.peak_pss / (1024 * 1024), 1),
+        "specs_client": specs_client,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
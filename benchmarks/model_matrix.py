@@ -0,0 +1,329 @@
+# Copyright (C) 2025 Colin Damon
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Inference engine micro-benchmark matrix for SpotR's model layer
+
+Usage (from the repo root):
+    python -m benchmarks.model_matrix --weights resnet101=models/spotr_resnet101.pth \\
+        --accuracy-target 0.85 --output matrix.json
+
+Loads models through the backend's engines (LazyPyTorchModel), without
+HTTP, for every combination of:
+    - architecture (--archs): mobilenetv2, resnet50, resnet101
+    - precision (--precisions):
+        fp32            torch engine, fp32 weights
+        int8            torch engine, weights dynamically quantized at load
+        int8-artifact   torch engine, prebuilt dynamic int8 artifact (--artifact ARCH=PATH)
+        static-int8     torch engine, static int8 artifact from quantize.py
+                        (--static-artifact ARCH=PATH)
+        bf16            torch engine in bf16, on CPUs with native support
+        fp32-optimized  torch-optimized engine (BN folding, channels_last)
+        fp32-compiled   torch-optimized engine with torch.compile
+        onnx            onnxruntime engine (--onnx ARCH=PATH)
+    - torch thread count (--threads)
+    - batch size (--batch-sizes, 1 to 64)
+
+Each (architecture, precision, threads) runs in a fresh process, so
+every load is cold and memory is not shared between configurations.
+Per batch size the table has the first (cold) forward pass, warm p50/p95
+latency, images/sec, images/sec per thread and the process's peak RSS.
+The model load time and resident model size are per configuration; a
+request that hits an unloaded model pays load_s + first_ms.
+
+Architectures without --weights are benchmarked on random weights, which
+time the same as trained ones. With trained weights and the dataset on
+disk, top-1 accuracy is measured on --eval-images test images, and with
+--accuracy-target the configurations meeting it are ranked by images/sec
+per thread, i.e. by CPU cost per image. Configurations an engine could
+not serve as asked (e.g. bf16 on a CPU without bf16 instructions) are
+reported as skipped rather than timed under the fallback.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import psutil
+import torch
+
+ARCHS = ("mobilenetv2", "resnet50", "resnet101")
+PRECISIONS = ("fp32", "int8", "int8-artifact", "static-int8", "bf16", "fp32-optimized", "fp32-compiled", "onnx")
+DEFAULT_PRECISIONS = ("fp32", "int8", "int8-artifact", "static-int8", "bf16", "fp32-optimized", "onnx")
+# precisions served from a prebuilt artifact, and the flag that provides it
+ARTIFACT_FLAGS = {"int8-artifact": "--artifact", "static-int8": "--static-artifact"}
+BATCH_SIZES = (1, 2, 4, 8, 16, 32, 64)
+# load source each precision is served from when its engine does not fall back
+EXPECTED_SOURCES = {
+    "fp32": "fp32", "int8": "fp32", "int8-artifact": "artifact", "static-int8": "artifact", "bf16": "bf16",
+    "fp32-optimized": "optimized", "fp32-compiled": "compiled", "onnx": "onnx",
+}
+CPUS = os.cpu_count() or 1
+DEFAULT_THREADS = sorted({t for t in (1, 2, 4) if t <= CPUS} | {CPUS})
+# (column, width, format spec)
+TABLE_COLUMNS = (
+    ("arch", 11, "<"), ("precision", 14, "<"), ("threads", 7, ">"), ("batch", 5, ">"),
+    ("load_s", 7, ">.2f"), ("first_ms", 9, ">.1f"), ("p50_ms", 9, ">.1f"), ("p95_ms", 9, ">.1f"),
+    ("img_s", 8, ">.1f"), ("img_s_per_thread", 16, ">.1f"), ("model_mb", 8, ">.1f"),
+    ("peak_rss_mb", 11, ">.1f"), ("top1", 6, ">.3f"),
+)
+
+
+def _parse_paths(values):
+    """Accepts ["ARCH=PATH", ...]; returns {arch: path}"""
+    paths = {}
+    for value in values:
+        arch, _, path = value.partition("=")
+        if arch not in ARCHS or not path:
+            raise SystemExit(f"expected ARCH=PATH with ARCH one of {', '.join(ARCHS)}, got {value!r}")
+        paths[arch] = path
+    return paths
+
+
+def _reset_peak_rss():
+    """Resets the kernel's peak RSS counter for this process; returns False if unsupported"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss_bytes():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return psutil.Process().memory_info().rss
+
+
+def _make_engine(precision, threads):
+    from backend.model import OnnxRuntimeEngine, OptimizedPyTorchEngine, PyTorchEngine
+
+    if precision == "onnx":
+        return OnnxRuntimeEngine(threads=threads)
+    if precision in ("fp32-optimized", "fp32-compiled"):
+        return OptimizedPyTorchEngine(compile=precision == "fp32-compiled")
+    return PyTorchEngine("int8" if "int8" in precision else precision)
+
+
+def _top1_accuracy(served, csv_path, image_dir, num_images):
+    from torch.utils.data import Subset
+    from data import StanfordCarsDataset, get_dataloader, get_val_transforms
+
+    dataset = StanfordCarsDataset(csv_path, image_dir, transform=get_val_transforms())
+    dataset = Subset(dataset, range(min(num_images, len(dataset))))
+    correct = 0
+    for inputs, labels in get_dataloader(dataset, batch_size=32, shuffle=False, num_workers=0, pin_memory=False):
+        correct += (served.forward(inputs).argmax(dim=1) == labels).sum().item()
+    return round(correct / len(dataset), 4)
+
+
+def measure(config):
+    """
+    Runs in a fresh process. Accepts one configuration dictionary
+    Returns: {"load_s", "load_source", "model_mb", "batches": [...], "top1"}
+    """
+    torch.set_num_threads(config["threads"])
+    from backend.model import LazyPyTorchModel
+    from backend.residency import get_residency_manager
+
+    served = LazyPyTorchModel(
+        name=f"{config['arch']}-{config['precision']}", pinned=True,
+        model_path=config["weights"], artifact_path=config["artifact"],
+        arch=config["arch"], onnx_path=config["onnx"],
+        engine=_make_engine(config["precision"], config["threads"]),
+    )
+    start = time.perf_counter()
+    served.preload()
+    result = {
+        "load_s": round(time.perf_counter() - start, 3),
+        "load_source": served.load_source,
+        "model_mb": round(get_residency_manager().resident_bytes() / (1024 * 1024), 1),
+        "batches": [],
+        "top1": None,
+    }
+    if served.load_source != EXPECTED_SOURCES[config["precision"]]:
+        return result
+
+    for batch_size in config["batch_sizes"]:
+        batch = torch.randn(batch_size, 3, 224, 224)
+        _reset_peak_rss()
+        start = time.perf_counter()
+        served.forward(batch)
+        first_ms = (time.perf_counter() - start) * 1000
+
+        timings = []
+        deadline = time.perf_counter() + config["max_seconds"]
+        while len(timings) < config["runs"] and (len(timings) < 3 or time.perf_counter() < deadline):
+            start = time.perf_counter()
+            served.forward(batch)
+            timings.append((time.perf_counter() - start) * 1000)
+        timings.sort()
+        p50 = statistics.median(timings)
+        result["batches"].append({
+            "batch": batch_size,
+            "first_ms": round(first_ms, 2),
+            "p50_ms": round(p50, 2),
+            "p95_ms": round(timings[min(len(timings) - 1, int(0.95 * len(timings)))], 2),
+            "runs": len(timings),
+            "img_s": round(batch_size * 1000 / p50, 2),
+            "img_s_per_thread": round(batch_size * 1000 / p50 / config["threads"], 2),
+            "peak_rss_mb": round(_peak_rss_bytes() / (1024 * 1024), 1),
+        })
+
+    if config["eval_images"]:
+        result["top1"] = _top1_accuracy(served, config["eval_csv"], config["image_dir"], config["eval_images"])
+    return result
+
+
+def random_weights(arch, directory):
+    """Returns: path to a state dict of randomly initialized weights for arch"""
+    from backend.model import build_model
+
+    path = os.path.join(directory, f"random_{arch}.pth")
+    if not os.path.exists(path):
+        torch.save(build_model(arch).state_dict(), path)
+    return path
+
+
+def format_table(rows):
+    lines = ["  ".join(f"{name:{spec[0]}{width}}" for name, width, spec in TABLE_COLUMNS)]
+    for row in rows:
+        lines.append("  ".join(
+            f"{'-':>{width}}" if row.get(name) is None else f"{row[name]:{spec[0]}{width}{spec[1:]}}"
+            for name, width, spec in TABLE_COLUMNS
+        ))
+    return "\n".join(lines)
+
+
+def cheapest(rows, accuracy_target, max_p95_ms):
+    """Returns: rows meeting the accuracy target and latency bound, most images/sec per thread first"""
+    candidates = [
+        row for row in rows
+        if (accuracy_target is None or (row["top1"] is not None and row["top1"] >= accuracy_target))
+        and (max_p95_ms is None or row["p95_ms"] <= max_p95_ms)
+    ]
+    return sorted(candidates, key=lambda row: row["img_s_per_thread"], reverse=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Model layer benchmark matrix for the SpotR backend")
+    parser.add_argument("--archs", nargs="+", choices=ARCHS, default=list(ARCHS))
+    parser.add_argument("--precisions", nargs="+", choices=PRECISIONS, default=list(DEFAULT_PRECISIONS))
+    parser.add_argument("--threads", nargs="+", type=int, default=DEFAULT_THREADS)
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=list(BATCH_SIZES))
+    parser.add_argument("--runs", type=int, default=10, help="warm runs per batch size")
+    parser.add_argument("--max-seconds", type=float, default=10,
+                        help="stop warm runs of a batch size after this long (at least 3 runs)")
+    parser.add_argument("--weights", nargs="*", default=[], metavar="ARCH=PATH",
+                        help="trained fp32 state dicts; other architectures use random weights")
+    parser.add_argument("--artifact", nargs="*", default=[], metavar="ARCH=PATH",
+                        help="prebuilt dynamic int8 artifacts for int8-artifact")
+    parser.add_argument("--static-artifact", nargs="*", default=[], metavar="ARCH=PATH",
+                        help="static int8 artifacts written by quantize.py for static-int8")
+    parser.add_argument("--onnx", nargs="*", default=[], metavar="ARCH=PATH",
+                        help="exported ONNX models for onnx")
+    parser.add_argument("--eval-csv", default="dataset/train1/test1.csv")
+    parser.add_argument("--image-dir", default="dataset/")
+    parser.add_argument("--eval-images", type=int, default=512,
+                        help="test images for top-1 accuracy (trained weights only, 0 to skip)")
+    parser.add_argument("--accuracy-target", type=float, help="minimum top-1 accuracy to recommend a configuration")
+    parser.add_argument("--max-p95-ms", type=float, help="maximum warm p95 latency to recommend a configuration")
+    parser.add_argument("--output", help="also write the rows as JSON here")
+    args = parser.parse_args()
+
+    weights = _parse_paths(args.weights)
+    artifacts = {"int8-artifact": _parse_paths(args.artifact), "static-int8": _parse_paths(args.static_artifact)}
+    onnx_paths = _parse_paths(args.onnx)
+    can_eval = args.eval_images > 0 and os.path.exists(args.eval_csv)
+    scratch = tempfile.TemporaryDirectory(prefix="spotr-matrix-")
+
+    rows, skipped = [], []
+    context = multiprocessing.get_context("spawn")
+    for arch in args.archs:
+        if arch not in weights:
+            print(f"USING RANDOM WEIGHTS FOR {arch}", file=sys.stderr)
+        for precision in args.precisions:
+            if precision in ARTIFACT_FLAGS and arch not in artifacts[precision]:
+                skipped.append((arch, precision, f"no {ARTIFACT_FLAGS[precision]} given"))
+                continue
+            if precision == "onnx" and arch not in onnx_paths:
+                skipped.append((arch, precision, "no --onnx given"))
+                continue
+            for i, threads in enumerate(args.threads):
+                config = {
+                    "arch": arch, "precision": precision, "threads": threads,
+                    "weights": weights.get(arch) or random_weights(arch, scratch.name),
+                    # only artifact rows load one: the engine prefers an artifact over the weights
+                    "artifact": artifacts[precision].get(arch) if precision in ARTIFACT_FLAGS else None,
+                    "onnx": onnx_paths.get(arch),
+                    "batch_sizes": args.batch_sizes, "runs": args.runs, "max_seconds": args.max_seconds,
+                    "eval_csv": args.eval_csv, "image_dir": args.image_dir,
+                    # accuracy does not depend on the thread count: measure it once
+                    "eval_images": args.eval_images if can_eval and arch in weights and i == 0 else 0,
+                }
+                print(f"BENCHMARKING {arch} {precision} ON {threads} THREAD(S)...", file=sys.stderr)
+                with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                    result = executor.submit(measure, config).result()
+                if not result["batches"]:
+                    skipped.append((arch, precision, f"engine fell back to {result['load_source']}"))
+                    break
+                if i == 0:
+                    top1 = result["top1"]
+                for batch in result["batches"]:
+                    rows.append({
+                        "arch": arch, "precision": precision, "threads": threads,
+                        "load_s": result["load_s"], "model_mb": result["model_mb"],
+                        **batch, "top1": top1,
+                    })
+    scratch.cleanup()
+
+    print(format_table(rows))
+    for arch, precision, reason in skipped:
+        print(f"skipped {arch} {precision}: {reason}")
+    if args.accuracy_target is not None or args.max_p95_ms is not None:
+        ranked = cheapest(rows, args.accuracy_target, args.max_p95_ms)
+        if ranked:
+            print("\nCheapest configurations meeting the targets (images/sec per thread):")
+            print(format_table(ranked[:5]))
+        else:
+            print("\nNo configuration meets the targets")
+        if args.accuracy_target is not None and all(row["top1"] is None for row in rows):
+            print("No accuracy was measured: pass --weights and make sure --eval-csv exists")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "torch_version": torch.__version__,
+                "cpu_count": CPUS,
+                "config": {k: v for k, v in vars(args).items() if k != "output"},
+                "rows": rows,
+                "skipped": [{"arch": a, "precision": p, "reason": r} for a, p, r in skipped],
+            }, f, indent=2)
+            f.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -25,6 +25,10 @@ Usage:
         - MODEL_NAME: Model architecture
             (e.g. 'resnet101v1', 'resnet50v1', etc.)
         - WEIGHTS_PATH: Path to the trained model weights
+        - SMALL_WEIGHTS_PATH: (optional) Path to trained mobilenetv2
+            weights, to tune the backend's cascade thresholds
+        - EVAL_BF16: Also evaluate the model in bfloat16 (off by
+            default; or run with SPOTR_EVAL_BF16=1)
 
     Then run the script with:
         python train.py
@@ -33,21 +37,37 @@ The script will evaluate your trained model on the test set, print
 accuracy, and show a classification report. To additionally output
 a confusion matrix, uncomment the final two lines in this script.
 
+If EVAL_BF16 is set, the script re-runs the test set with bf16 weights
+and activations (the backend's SPOTR_PRECISION=bf16 mode) and reports
+the accuracy delta and top-1 agreement against fp32.
+
+If SMALL_WEIGHTS_PATH is set, the script also sweeps CASCADE_THRESHOLDS
+for the backend's cascade mode (SPOTR_CASCADE=1), printing the share of
+test images escalated to the evaluated model and the resulting accuracy
+at each threshold. Use it to pick SPOTR_CASCADE_THRESHOLD.
+
 To use different datasets, models, or weight files, edit the
 relevant variables and rerun the script.
 """
 
+import copy
+import os
 import torch
 import torch.nn as nn
 from torchvision import models
 from data import StanfordCarsDataset, get_val_transforms, get_dataloader
 from sklearn.metrics import classification_report
+from backend.precision import Bfloat16, cpu_supports_bf16
 
 TEST_CSV = "dataset/train1/test1.csv"
 IMAGE_DIR = "dataset/"
 NUM_CLASSES = 196
 MODEL_NAME = "resnet101v1"
 WEIGHTS_PATH = "models/spotr_weights.pth"
+SMALL_WEIGHTS_PATH = None  # e.g. "models/1_mobilenetv2.pth"
+CASCADE_METRIC = "margin"  # "margin" (thresholds 0-1) or "entropy" (thresholds 0-ln(NUM_CLASSES))
+CASCADE_THRESHOLDS = [0.05, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9]
+EVAL_BF16 = os.getenv("SPOTR_EVAL_BF16", "0") == "1"
 
 print("LOADING DEVICE, DATASET, and DATALOADER...")
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
@@ -92,3 +112,47 @@ print(f"Test Accuracy: {test_acc:.6f}")
 print(classification_report(all_labels, all_preds))
 #print("Confusion Matrix:")
 #print(confusion_matrix(all_labels, all_preds))
+
+if EVAL_BF16:
+    print("\nEVALUATING BF16...")
+    if device.type == "cpu" and not cpu_supports_bf16():
+        print("Note: no native bf16 on this CPU (emulated, slow); the backend serves int8 here")
+    bf16_model = Bfloat16(copy.deepcopy(model))
+    bf16_preds = []
+    with torch.no_grad():
+        for images, _ in test_loader:
+            bf16_preds.append(bf16_model(images.to(device)).argmax(dim=1).cpu())
+    bf16_preds = torch.cat(bf16_preds)
+    bf16_acc = (bf16_preds == torch.tensor(all_labels)).float().mean().item()
+    agreement = (bf16_preds == torch.tensor(all_preds)).float().mean().item()
+    print(f"BF16 Accuracy: {bf16_acc:.6f} (delta vs fp32: {bf16_acc - test_acc:+.6f})")
+    print(f"BF16 top-1 agreement with fp32: {agreement:.2%}")
+
+if SMALL_WEIGHTS_PATH:
+    # imported here: backend.model sets up serving state the plain evaluation does not need
+    from backend.model import should_escalate
+
+    print("\nTUNING CASCADE THRESHOLDS...")
+    small_model = models.mobilenet_v2(weights=None)
+    small_model.classifier[1] = nn.Linear(small_model.classifier[1].in_features, NUM_CLASSES)
+    small_model.load_state_dict(torch.load(SMALL_WEIGHTS_PATH, map_location=device))
+    small_model = small_model.to(device)
+    small_model.eval()
+
+    small_probs = []
+    with torch.no_grad():
+        for images, _ in test_loader:
+            small_probs.append(small_model(images.to(device)).softmax(dim=1).cpu())
+    small_probs = torch.cat(small_probs)
+    small_preds = small_probs.argmax(dim=1)
+    big_preds = torch.tensor(all_preds)
+    labels = torch.tensor(all_labels)
+
+    print(f"Small Model Accuracy: {(small_preds == labels).float().mean().item():.6f}")
+    print(f"Cascade metric: {CASCADE_METRIC}")
+    print(f"{'Threshold':>10} | {'Escalated':>9} | {'Accuracy':>8}")
+    for threshold in CASCADE_THRESHOLDS:
+        escalate = should_escalate(small_probs, CASCADE_METRIC, threshold)
+        cascade_preds = torch.where(escalate, big_preds, small_preds)
+        cascade_acc = (cascade_preds == labels).float().mean().item()
+        print(f"{threshold:>10} | {escalate.float().mean().item():>9.2%} | {cascade_acc:>8.6f}")
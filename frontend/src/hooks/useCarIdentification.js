@@ -4,6 +4,7 @@ import { identifyCar, getCarSpecs } from '../services/api';
 export const useCarIdentification = () => {
   const [predClass, setPredClass] = useState(null);
   const [specs, setSpecs] = useState(null);
+  const [prefetchedSpecs, setPrefetchedSpecs] = useState(null);
   const [loading, setLoading] = useState(false);
   const [specLoading, setSpecLoading] = useState(false);
   const [error, setError] = useState(null);
@@ -15,10 +16,16 @@ export const useCarIdentification = () => {
     setError(null);
     setPredClass(null);
     setSpecs(null);
+    setPrefetchedSpecs(null);
     
     try {
       const result = await identifyCar(imageFile);
       setPredClass(result.pred_class);
+      // specs of the top candidate usually come back with the prediction
+      const top = result.candidates && result.candidates[0];
+      if (top && top.specs_status === 'found') {
+        setPrefetchedSpecs(top.specs);
+      }
     } catch (err) {
       const details = err.response ? JSON.stringify(err.response.data) : err.message;
       setError('Error identifying car: ' + details);
@@ -29,6 +36,10 @@ export const useCarIdentification = () => {
 
   const handleShowSpecs = async () => {
     if (!predClass) return;
+    if (prefetchedSpecs) {
+      setSpecs(prefetchedSpecs);
+      return;
+    }
     
     setSpecLoading(true);
     setError(null);
@@ -50,6 +61,7 @@ export const useCarIdentification = () => {
   const reset = () => {
     setPredClass(null);
     setSpecs(null);
+    setPrefetchedSpecs(null);
     setError(null);
   };
 
@@ -6,7 +6,7 @@ export const identifyCar = async (imageFile) => {
   const formData = new FormData();
   formData.append('file', imageFile, 'car.jpg');
   
-  const response = await axios.post(`${BACKEND_URL}/predict`, formData, {
+  const response = await axios.post(`${BACKEND_URL}/identify`, formData, {
     headers: { 'Content-Type': 'multipart/form-data' },
     timeout: 20000,
   });
@@ -0,0 +1,152 @@
+# Copyright (C) 2025 Colin Damon
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+SpotR static int8 post-training quantization script
+
+Usage:
+    Edit the following variables at the top of this script to match
+    your setup:
+        - CALIBRATION_CSV: CSV whose images calibrate the observers
+        - EVAL_CSV: CSV used to compare accuracy after quantization
+        - IMAGE_DIR: Path to the image directory
+        - WEIGHTS_PATH: Path to the trained fp32 ResNet-101 weights
+        - ARTIFACT_PATH: Where to write the static int8 artifact
+        - CALIBRATION_SAMPLES / EVAL_SAMPLES: How many images to use
+
+    Then run the script with:
+        python quantize.py
+
+The script fuses Conv+BN+ReLU, calibrates activation observers on a
+sample of the validation split, and converts the whole network (not
+just the final fc layer) to int8. It then compares accuracy and
+per-image latency against the dynamically quantized model the backend
+serves today, and writes the report to REPORT_PATH.
+
+To serve the result, point SPOTR_MODEL_ARTIFACT at ARTIFACT_PATH.
+"""
+
+import json
+import random
+import time
+import torch
+from torch.ao.quantization import convert, get_default_qconfig, prepare
+from torch.utils.data import Subset
+from torchvision.models.quantization.resnet import QuantizableBottleneck, QuantizableResNet
+from backend.artifact import file_sha256, save_model_artifact
+from backend.model import MODEL_PATH, build_quantized_model
+from data import StanfordCarsDataset, get_val_transforms, get_dataloader
+
+CALIBRATION_CSV = "dataset/train1/val1.csv"
+EVAL_CSV = "dataset/train1/test1.csv"
+IMAGE_DIR = "dataset/"
+NUM_CLASSES = 196
+WEIGHTS_PATH = MODEL_PATH
+ARTIFACT_PATH = "models/spotr_resnet101.static_int8.pt"
+REPORT_PATH = "models/quantization_report.json"
+CALIBRATION_SAMPLES = 512
+EVAL_SAMPLES = 1000
+LATENCY_RUNS = 30
+SEED = 42
+
+ENGINE = "x86" if "x86" in torch.backends.quantized.supported_engines else "fbgemm"
+torch.backends.quantized.engine = ENGINE
+
+
+def sample_loader(csv_path, num_samples):
+    dataset = StanfordCarsDataset(csv_path, IMAGE_DIR, transform=get_val_transforms())
+    indices = random.Random(SEED).sample(range(len(dataset)), min(num_samples, len(dataset)))
+    return get_dataloader(Subset(dataset, indices), batch_size=32, shuffle=False, pin_memory=False)
+
+
+def accuracy(model, loader):
+    correct, total = 0, 0
+    with torch.inference_mode():
+        for images, labels in loader:
+            preds = model(images).argmax(dim=1)
+            correct += (preds == labels).sum().item()
+            total += labels.size(0)
+    return correct / total
+
+
+def latency_ms(model, runs=LATENCY_RUNS):
+    """Returns: median batch-of-one forward pass latency in milliseconds"""
+    sample = torch.randn(1, 3, 224, 224)
+    timings = []
+    with torch.inference_mode():
+        for _ in range(3):
+            model(sample)
+        for _ in range(runs):
+            start = time.perf_counter()
+            model(sample)
+            timings.append((time.perf_counter() - start) * 1000)
+    return sorted(timings)[len(timings) // 2]
+
+
+print(f"QUANTIZED ENGINE: {ENGINE}")
+print("LOADING CALIBRATION and EVALUATION DATA...")
+calibration_loader = sample_loader(CALIBRATION_CSV, CALIBRATION_SAMPLES)
+eval_loader = sample_loader(EVAL_CSV, EVAL_SAMPLES)
+
+print("LOADING MODEL and FUSING CONV+BN+RELU...")
+model = QuantizableResNet(QuantizableBottleneck, [3, 4, 23, 3], num_classes=NUM_CLASSES)
+model.load_state_dict(torch.load(WEIGHTS_PATH, map_location="cpu", mmap=True))
+model.eval()
+model.fuse_model(is_qat=False)
+model.qconfig = get_default_qconfig(ENGINE)
+prepare(model, inplace=True)
+
+print("CALIBRATING OBSERVERS...")
+with torch.inference_mode():
+    for images, _ in calibration_loader:
+        model(images)
+
+print("CONVERTING TO INT8...")
+convert(model, inplace=True)
+with torch.no_grad():
+    static_model = torch.jit.freeze(torch.jit.script(model))
+
+print("EVALUATING CURRENT (DYNAMIC INT8) and STATIC INT8 MODELS...")
+dynamic_model = build_quantized_model(WEIGHTS_PATH)
+report = {
+    "engine": ENGINE,
+    "calibration_samples": len(calibration_loader.dataset),
+    "eval_samples": len(eval_loader.dataset),
+    "dynamic_int8": {
+        "accuracy": accuracy(dynamic_model, eval_loader),
+        "latency_ms": latency_ms(dynamic_model),
+    },
+    "static_int8": {
+        "accuracy": accuracy(static_model, eval_loader),
+        "latency_ms": latency_ms(static_model),
+    },
+}
+
+print(f"SAVING ARTIFACT TO {ARTIFACT_PATH}...")
+save_model_artifact(
+    static_model,
+    ARTIFACT_PATH,
+    arch="resnet101",
+    precision="static_int8",
+    source_weights=WEIGHTS_PATH,
+    source_sha256=file_sha256(WEIGHTS_PATH),
+    report=report,
+)
+with open(REPORT_PATH, "w") as f:
+    json.dump(report, f, indent=2)
+
+print("QUANTIZATION FINISHED!\n")
+for name in ("dynamic_int8", "static_int8"):
+    print(f"{name:>13}: accuracy={report[name]['accuracy']:.6f} | latency={report[name]['latency_ms']:.1f} ms/image")
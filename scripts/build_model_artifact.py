@@ -0,0 +1,67 @@
+# Copyright (C) 2025 Colin Damon
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Script to build the pre-quantized model artifact served by the backend
+
+Usage (from the repo root):
+    python -m scripts.build_model_artifact
+
+Builds the dynamically quantized model from the fp32 weights at
+WEIGHTS_PATH, writes it to ARTIFACT_PATH with a checksum manifest, then
+reloads it and reports load times for both the fp32 and artifact paths.
+
+To build the cascade's small model instead, set ARCH = "mobilenetv2"
+and use CASCADE_MODEL_PATH / CASCADE_MODEL_ARTIFACT_PATH.
+"""
+
+import time
+import torch
+from backend.artifact import file_sha256, load_model_artifact, save_model_artifact
+from backend.model import MODEL_ARTIFACT_PATH, MODEL_PATH, build_quantized_model
+
+ARCH = "resnet101"
+WEIGHTS_PATH = MODEL_PATH
+ARTIFACT_PATH = MODEL_ARTIFACT_PATH
+
+
+print(f"BUILDING QUANTIZED MODEL FROM {WEIGHTS_PATH}...")
+start = time.perf_counter()
+model = build_quantized_model(WEIGHTS_PATH, ARCH)
+fp32_load_seconds = time.perf_counter() - start
+
+print(f"SAVING ARTIFACT TO {ARTIFACT_PATH}...")
+manifest = save_model_artifact(
+    model,
+    ARTIFACT_PATH,
+    arch=ARCH,
+    precision="dynamic_int8",
+    source_weights=WEIGHTS_PATH,
+    source_sha256=file_sha256(WEIGHTS_PATH),
+)
+
+print("RELOADING ARTIFACT...")
+start = time.perf_counter()
+loaded, _ = load_model_artifact(ARTIFACT_PATH)
+artifact_load_seconds = time.perf_counter() - start
+
+sample = torch.randn(2, 3, 224, 224)
+with torch.no_grad():
+    max_diff = (model(sample) - loaded(sample)).abs().max().item()
+
+print(f"Artifact sha256: {manifest['sha256']}")
+print(f"Load time (fp32 + quantize): {fp32_load_seconds:.3f}s")
+print(f"Load time (artifact):        {artifact_load_seconds:.3f}s")
+print(f"Max output difference:       {max_diff:.6f}")
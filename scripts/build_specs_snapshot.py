@@ -0,0 +1,105 @@
+# Copyright (C) 2025 Colin Damon
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Script to build the offline car specs snapshot served by the backend
+
+Usage (from the repo root, with API_NINJAS_KEY set):
+    python -m scripts.build_specs_snapshot
+
+Looks up specs for every class in CAR_DATASET_INFO["class_names"] and
+writes them to SNAPSHOT_PATH. Specs already in the backend's SQLite specs
+cache are imported without a request; the rest are fetched from the API
+at most REQUESTS_PER_SECOND at a time. Cars the API has no data for are
+stored as "no data"; classes whose request failed are left out, so the
+backend looks them up live.
+
+The snapshot is rewritten after every class. If the script is stopped,
+or some requests fail, run it again: with RESUME it keeps the classes
+already in the snapshot and only looks up the missing ones. Set
+RESUME = False to rebuild from scratch.
+"""
+
+import asyncio
+import os
+import time
+from backend.car_specs import _parse_api_output, _parse_class_name, get_api_key
+from backend.dataset import CAR_DATASET_INFO
+from backend.specs_cache import MISS, get_specs_cache
+from backend.specs_client import SPECS_API_URL, get_specs_client
+from backend.specs_snapshot import SPECS_SNAPSHOT_PATH, read_snapshot, write_snapshot
+
+SNAPSHOT_PATH = SPECS_SNAPSHOT_PATH
+REQUESTS_PER_SECOND = 1.0
+RESUME = True
+IMPORT_FROM_CACHE = True
+CLASS_NAMES = CAR_DATASET_INFO["class_names"]
+
+
+async def build_snapshot(classes, api_key):
+    """Looks up every class missing from classes, saving after each one; returns failed class names"""
+    cache = get_specs_cache() if IMPORT_FROM_CACHE else None
+    client = get_specs_client()
+    failed = []
+    next_request = 0
+    for i, pred_class in enumerate(CLASS_NAMES, start=1):
+        if pred_class in classes:
+            continue
+        key = _parse_class_name(pred_class)
+        specs = cache.get(key) if cache is not None else MISS
+        if specs is not MISS:
+            print(f"[{i}/{len(CLASS_NAMES)}] {pred_class}: imported from cache")
+        else:
+            if not api_key:
+                failed.append(pred_class)
+                continue
+            await asyncio.sleep(max(0, next_request - time.monotonic()))
+            next_request = time.monotonic() + 1 / REQUESTS_PER_SECOND
+            data, definite = await client.fetch(key, api_key)
+            if not definite:
+                print(f"[{i}/{len(CLASS_NAMES)}] {pred_class}: request failed")
+                failed.append(pred_class)
+                continue
+            specs = _parse_api_output(data) if data else None
+            if cache is not None:
+                cache.put(key, specs)
+            print(f"[{i}/{len(CLASS_NAMES)}] {pred_class}: "
+                  f"{'fetched' if specs is not None else 'no data'}")
+        classes[pred_class] = specs
+        write_snapshot(SNAPSHOT_PATH, classes, source=SPECS_API_URL, complete=False)
+    await client.close()
+    return failed
+
+
+os.makedirs(os.path.dirname(SNAPSHOT_PATH) or ".", exist_ok=True)
+classes = {}
+if RESUME and os.path.exists(SNAPSHOT_PATH):
+    print(f"RESUMING FROM {SNAPSHOT_PATH}...")
+    classes, _ = read_snapshot(SNAPSHOT_PATH)
+
+api_key = get_api_key()
+if not api_key:
+    print("API_NINJAS_KEY IS NOT SET, ONLY IMPORTING FROM THE SPECS CACHE...")
+
+print(f"LOOKING UP {len(CLASS_NAMES) - len(classes)} CLASSES...")
+failed = asyncio.run(build_snapshot(classes, api_key))
+
+header = write_snapshot(SNAPSHOT_PATH, classes, source=SPECS_API_URL, complete=not failed)
+
+print(f"Snapshot version: {header['version']}")
+print(f"Classes covered:  {len(classes)}/{len(CLASS_NAMES)}")
+print(f"With specs:       {sum(1 for specs in classes.values() if specs is not None)}")
+if failed:
+    print(f"Failed lookups:   {len(failed)} (run the script again to retry them)")
@@ -0,0 +1,152 @@
+# Copyright (C) 2025 Colin Damon
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Script to export a trained checkpoint to ONNX for the onnxruntime engine
+
+Usage (from the repo root, with onnx and onnxruntime installed):
+    python -m scripts.export_onnx
+
+Exports the fp32 weights at WEIGHTS_PATH to ONNX_PATH with a dynamic
+batch axis, optionally quantizes the fc weights to int8 (QUANTIZE_INT8),
+and writes a checksum manifest next to it. It then checks the ONNX
+Runtime output against PyTorch (max logit difference and top-1
+agreement), deleting the export and exiting non-zero if it is outside
+the PARITY_* tolerances, and compares per-batch latency of:
+    - the fp32 eager model
+    - the dynamically quantized model the torch engine serves
+    - the ONNX Runtime session the onnxruntime engine serves
+
+To export the cascade's small model instead, set ARCH = "mobilenetv2"
+and use CASCADE_MODEL_PATH / CASCADE_MODEL_ONNX_PATH.
+Serve the export with SPOTR_ENGINE=onnxruntime.
+"""
+
+import os
+import statistics
+import time
+import torch
+from backend.artifact import file_sha256, manifest_path, write_manifest
+from backend.model import (
+    MODEL_ONNX_PATH, MODEL_PATH, LazyPyTorchModel, OnnxRuntimeEngine, build_quantized_model,
+    load_fp32_model,
+)
+
+ARCH = "resnet101"
+WEIGHTS_PATH = MODEL_PATH
+ONNX_PATH = MODEL_ONNX_PATH
+QUANTIZE_INT8 = False
+OPSET = 17
+PARITY_BATCH_SIZE = 8
+LATENCY_BATCH_SIZES = (1, 8)
+LATENCY_RUNS = 20
+# Largest logit difference from torch fp32 the export may have, relative to the
+# largest fp32 logit: an fp32 export only differs by float rounding (0.039 on
+# logits up to 5.2e4 with the test weights, under 1e-6), an int8 one also by
+# the fc layer's quantization error (377, about 0.007)
+PARITY_MAX_DIFF = 1e-4
+PARITY_MAX_DIFF_INT8 = 0.02
+# on the PARITY_BATCH_SIZE random inputs; one may flip on a near tie
+PARITY_MIN_TOP1_AGREEMENT = 0.875
+
+
+def median_latency_ms(runner, batch):
+    with torch.inference_mode():
+        runner(batch)
+        timings = []
+        for _ in range(LATENCY_RUNS):
+            start = time.perf_counter()
+            runner(batch)
+            timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+print(f"LOADING FP32 WEIGHTS FROM {WEIGHTS_PATH}...")
+model = load_fp32_model(WEIGHTS_PATH, ARCH)
+
+print(f"EXPORTING TO {ONNX_PATH}...")
+export_path = f"{ONNX_PATH}.fp32.tmp" if QUANTIZE_INT8 else ONNX_PATH
+torch.onnx.export(
+    model,
+    (torch.randn(1, 3, 224, 224),),
+    export_path,
+    input_names=["input"],
+    output_names=["logits"],
+    dynamic_axes={"input": {0: "batch"}, "logits": {0: "batch"}},
+    opset_version=OPSET,
+    dynamo=False,
+)
+if QUANTIZE_INT8:
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    print("QUANTIZING WEIGHTS TO INT8...")
+    # like torch's quantize_dynamic, only the fully connected layers: ORT's
+    # dynamically quantized convolutions (ConvInteger) are slower than fp32
+    quantize_dynamic(export_path, ONNX_PATH, op_types_to_quantize=["MatMul", "Gemm"],
+                     weight_type=QuantType.QInt8)
+    os.remove(export_path)
+
+manifest = write_manifest(
+    ONNX_PATH,
+    "onnx",
+    arch=ARCH,
+    precision="dynamic_int8" if QUANTIZE_INT8 else "fp32",
+    opset=OPSET,
+    source_weights=WEIGHTS_PATH,
+    source_sha256=file_sha256(WEIGHTS_PATH),
+)
+
+print("CHECKING PARITY WITH PYTORCH...")
+served = LazyPyTorchModel(
+    name=f"{ARCH}-onnx", pinned=False, model_path=WEIGHTS_PATH, artifact_path=None,
+    arch=ARCH, onnx_path=ONNX_PATH, engine=OnnxRuntimeEngine(),
+)
+served.preload()
+if served.load_source != "onnx":
+    raise SystemExit("onnxruntime could not load the export, see the warning above")
+sample = torch.randn(PARITY_BATCH_SIZE, 3, 224, 224)
+with torch.inference_mode():
+    expected = model(sample)
+actual = served.forward(sample)
+max_diff = (expected - actual).abs().max().item()
+top1_agreement = (expected.argmax(dim=1) == actual.argmax(dim=1)).float().mean().item()
+scale = expected.abs().max().item()
+max_allowed_diff = (PARITY_MAX_DIFF_INT8 if QUANTIZE_INT8 else PARITY_MAX_DIFF) * scale
+print(f"Max output difference vs torch fp32: {max_diff:.6f} (at most {max_allowed_diff:.6f})")
+print(f"Top-1 agreement vs torch fp32:       {top1_agreement:.2%} (at least {PARITY_MIN_TOP1_AGREEMENT:.2%})")
+if max_diff > max_allowed_diff or top1_agreement < PARITY_MIN_TOP1_AGREEMENT:
+    # do not leave an export that does not match the model where the server would load it
+    del served
+    os.remove(ONNX_PATH)
+    os.remove(manifest_path(ONNX_PATH))
+    raise SystemExit(f"PARITY CHECK FAILED, REMOVED {ONNX_PATH}")
+
+print("COMPARING LATENCY...")
+quantized = build_quantized_model(WEIGHTS_PATH, ARCH)
+latency = {}
+for batch_size in LATENCY_BATCH_SIZES:
+    batch = torch.randn(batch_size, 3, 224, 224)
+    latency[batch_size] = {
+        "torch fp32": median_latency_ms(model, batch),
+        "torch dynamic int8": median_latency_ms(quantized, batch),
+        "onnxruntime": median_latency_ms(served.forward, batch),
+    }
+
+print(f"ONNX sha256: {manifest['sha256']}")
+print(f"ONNX size:   {manifest['size_bytes'] / (1024 * 1024):.1f} MB ({manifest['precision']})")
+for batch_size, timings in latency.items():
+    print(f"Median latency, batch {batch_size}:")
+    for name, ms in timings.items():
+        print(f"  {name:<20} {ms:8.2f} ms")
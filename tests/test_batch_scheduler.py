@@ -0,0 +1,74 @@
+# Copyright (C) 2025 Colin Damon
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Tests for the micro-batching scheduler (backend.model.BatchScheduler)
+
+Run from the repo root with: python -m pytest tests
+"""
+
+from concurrent.futures import Future
+import pytest
+import torch
+from backend.model import BatchScheduler
+
+
+class StandInModel:
+    """Answers each input with its batch size, or raises while failing is set"""
+    def __init__(self):
+        self.failing = False
+
+    def predict_batch(self, input_batch, on_candidates=None):
+        if self.failing:
+            raise RuntimeError("inference failed")
+        return [{"batch_size": len(input_batch)} for _ in range(len(input_batch))]
+
+
+class StandInPool:
+    """Inference pool whose batches all fail"""
+    def submit(self, input_batch):
+        future = Future()
+        future.set_exception(RuntimeError("worker died"))
+        return future
+
+
+def test_failed_batch_fails_its_callers_and_later_batches_still_run():
+    model = StandInModel()
+    scheduler = BatchScheduler(model, max_batch_size=4, max_wait_ms=20)
+    model.failing = True
+    failed = [scheduler.submit(torch.zeros(1, 3, 224, 224)) for _ in range(3)]
+    for future in failed:
+        with pytest.raises(RuntimeError, match="inference failed"):
+            future.result(timeout=5)
+
+    model.failing = False
+    assert scheduler.submit(torch.zeros(1, 3, 224, 224)).result(timeout=5) == {"batch_size": 1}
+
+
+def test_inputs_that_cannot_be_batched_fail_instead_of_hanging():
+    scheduler = BatchScheduler(StandInModel(), max_batch_size=2, max_wait_ms=50)
+    # torch.cat cannot join these two
+    futures = [scheduler.submit(torch.zeros(1, 3, 224, 224)), scheduler.submit(torch.zeros(1, 3, 100, 100))]
+    for future in futures:
+        with pytest.raises(RuntimeError):
+            future.result(timeout=5)
+    assert scheduler._worker.is_alive()
+    assert scheduler.submit(torch.zeros(1, 3, 224, 224)).result(timeout=5) == {"batch_size": 1}
+
+
+def test_failed_pooled_batch_fails_its_callers():
+    scheduler = BatchScheduler(StandInModel(), max_batch_size=2, max_wait_ms=20, pool=StandInPool())
+    with pytest.raises(RuntimeError, match="worker died"):
+        scheduler.submit(torch.zeros(1, 3, 224, 224)).result(timeout=5)
@@ -0,0 +1,180 @@
+# Copyright (C) 2025 Colin Damon
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Tests for reading /predict/batch uploads (backend.uploads)
+
+Run from the repo root with: python -m pytest tests
+"""
+
+import asyncio
+import io
+import json
+import tarfile
+import threading
+import zipfile
+import pytest
+from backend.main import _stream_batch
+from backend.uploads import ArchiveLimits, SpooledBody, UploadRejected, iter_batch_items
+
+
+def tar_member(name, data):
+    """Returns: one tar entry (header and padded data), without the end-of-archive blocks"""
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    return info.tobuf() + data + b"\0" * (-len(data) % 512)
+
+
+def test_tar_members_are_read_while_the_body_is_still_arriving():
+    body = SpooledBody()
+    items = iter_batch_items(body, "application/x-tar")
+    first = []
+    reader = threading.Thread(target=lambda: first.append(next(items)))
+    reader.start()
+    body.write(tar_member("a.jpg", b"a" * 3000))
+    reader.join(5)
+    assert first == [("a.jpg", b"a" * 3000)]
+
+    body.write(tar_member("b.jpg", b"b" * 10) + b"\0" * 1024)
+    body.finish()
+    assert list(items) == [("b.jpg", b"b" * 10)]
+    body.close()
+
+
+def test_multipart_parts_are_read_while_the_body_is_still_arriving():
+    body = SpooledBody()
+    items = iter_batch_items(body, "multipart/form-data; boundary=XX")
+    first = []
+    reader = threading.Thread(target=lambda: first.append(next(items)))
+    reader.start()
+    body.write(b'--XX\r\nContent-Disposition: form-data; name="files"; filename="a.jpg"\r\n\r\n'
+               b"aaa\r\n--XX\r\n")
+    reader.join(5)
+    assert first == [("a.jpg", b"aaa")]
+
+    body.write(b'Content-Disposition: form-data; name="files"; filename="b.jpg"\r\n\r\nbbb\r\n--XX--\r\n')
+    body.finish()
+    assert list(items) == [("b.jpg", b"bbb")]
+    body.close()
+
+
+def test_body_error_ends_the_items():
+    body = SpooledBody()
+    body.write(tar_member("a.jpg", b"a"))
+    body.finish(UploadRejected(400, "Upload ended before the end of the body"))
+    items = iter_batch_items(body, "application/x-tar")
+    assert next(items) == ("a.jpg", b"a")
+    with pytest.raises(UploadRejected, match="ended before"):
+        next(items)
+    body.close()
+
+
+def test_archive_member_count_is_capped():
+    archive = io.BytesIO()
+    with tarfile.open(fileobj=archive, mode="w") as tar:
+        for i in range(10):
+            info = tarfile.TarInfo(f"dir{i}/")
+            info.type = tarfile.DIRTYPE
+            tar.addfile(info)
+    archive.seek(0)
+    items = iter_batch_items(archive, "application/x-tar", limits=ArchiveLimits(max_members=5))
+    with pytest.raises(UploadRejected, match="exceed 5 entries") as rejected:
+        list(items)
+    assert rejected.value.status_code == 413
+
+
+def test_zip_bomb_is_stopped_at_the_decompressed_size_limit():
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as zip_file:
+        for i in range(100):
+            zip_file.writestr(f"bomb{i}.jpg", b"\0" * 100_000)
+    # 10 MB of zeros compress to a few KB
+    assert archive.tell() < 100_000
+    archive.seek(0)
+    limits = ArchiveLimits(max_bytes=1_000_000)
+    items = iter_batch_items(archive, "application/zip", max_item_bytes=200_000, limits=limits)
+    read = []
+    with pytest.raises(UploadRejected, match="decompressed"):
+        for item in items:
+            read.append(item)
+    assert len(read) == 10
+    assert limits.bytes <= 1_000_000 + 100_000
+
+
+def patched_zip(entries, patch):
+    """
+    Returns: a stored (uncompressed) zip of entries, a {name: bytes} dictionary,
+        with patch(local header, central directory header) applied to each
+        entry's headers as bytearrays
+    """
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w", zipfile.ZIP_STORED) as zip_file:
+        for name, data in entries.items():
+            zip_file.writestr(name, data)
+    data = bytearray(archive.getvalue())
+    with zipfile.ZipFile(io.BytesIO(bytes(data))) as zip_file:
+        infos = zip_file.infolist()
+        central = zip_file.start_dir
+    for info in infos:
+        offset = data.index(b"PK\x01\x02", central)
+        central = offset + 46 + len(info.filename) + len(info.extra) + len(info.comment)
+        if info.filename in patch:
+            local = memoryview(data)[info.header_offset:info.header_offset + 30]
+            patch[info.filename](local, memoryview(data)[offset:offset + 46])
+    return io.BytesIO(bytes(data))
+
+
+def mark_encrypted(local, central):
+    local[6] |= 0x1
+    central[8] |= 0x1
+
+
+def set_unknown_compression(local, central):
+    local[8:10] = (99).to_bytes(2, "little")
+    central[10:12] = (99).to_bytes(2, "little")
+
+
+def test_encrypted_zip_entry_is_rejected_and_the_rest_still_read():
+    archive = patched_zip({"locked.jpg": b"x" * 10, "fine.jpg": b"z" * 10}, {"locked.jpg": mark_encrypted})
+    items = dict(iter_batch_items(archive, "application/zip"))
+    assert isinstance(items["locked.jpg"], UploadRejected)
+    assert items["locked.jpg"].status_code == 415
+    assert "encrypted" in items["locked.jpg"].detail
+    assert items["fine.jpg"] == b"z" * 10
+
+
+def test_zip_entry_with_unknown_compression_is_rejected_and_the_rest_still_read():
+    archive = patched_zip({"squashed.jpg": b"y" * 10, "fine.jpg": b"z" * 10},
+                          {"squashed.jpg": set_unknown_compression})
+    items = dict(iter_batch_items(archive, "application/zip"))
+    assert isinstance(items["squashed.jpg"], UploadRejected)
+    assert items["squashed.jpg"].status_code == 415
+    assert "compression" in items["squashed.jpg"].detail
+    assert items["fine.jpg"] == b"z" * 10
+
+
+def test_batch_stream_ends_with_an_error_and_a_summary_when_reading_fails():
+    def items():
+        raise ValueError("reader bug")
+        yield
+
+    async def run():
+        body_task = asyncio.ensure_future(asyncio.sleep(0))
+        return [json.loads(line) async for line in _stream_batch(items(), SpooledBody(), body_task)]
+
+    lines = asyncio.run(run())
+    assert lines[0]["status"] == 500
+    assert "reader bug" in lines[0]["error"]
+    assert lines[-1] == {"summary": {"images": 0, "errors": 0, "complete": False}}
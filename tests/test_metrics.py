@@ -0,0 +1,57 @@
+# Copyright (C) 2025 Colin Damon
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Tests for the backend's metrics (backend.metrics)
+
+Run from the repo root with: python -m pytest tests
+"""
+
+import asyncio
+import pytest
+from backend.metrics import REQUESTS_IN_FLIGHT, RequestsInFlightMiddleware
+
+
+def test_streamed_request_is_in_flight_until_its_last_body_message():
+    seen = []
+
+    async def streaming_app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        for line in (b"one\n", b"two\n"):
+            await asyncio.sleep(0.01)
+            await send({"type": "http.response.body", "body": line, "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+
+    async def send(message):
+        seen.append((message["type"], REQUESTS_IN_FLIGHT.value))
+
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    before = REQUESTS_IN_FLIGHT.value
+    asyncio.run(RequestsInFlightMiddleware(streaming_app)({"type": "http"}, receive, send))
+    # counted while every message, the final body one included, was sent
+    assert [in_flight for _, in_flight in seen] == [before + 1] * 4
+    assert REQUESTS_IN_FLIGHT.value == before
+
+
+def test_failed_request_leaves_flight():
+    async def failing_app(scope, receive, send):
+        raise RuntimeError("boom")
+
+    before = REQUESTS_IN_FLIGHT.value
+    with pytest.raises(RuntimeError):
+        asyncio.run(RequestsInFlightMiddleware(failing_app)({"type": "http"}, None, None))
+    assert REQUESTS_IN_FLIGHT.value == before
@@ -0,0 +1,58 @@
+# Copyright (C) 2025 Colin Damon
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Tests for the serving version the prediction cache is keyed on
+(backend.model.CascadeModel.version)
+
+Run from the repo root with: python -m pytest tests
+"""
+
+from backend.artifact import read_manifest, write_manifest
+from backend.model import CascadeModel, LazyPyTorchModel, PyTorchEngine
+
+
+def stage(tmp_path, name):
+    """Returns: a LazyPyTorchModel over (never loaded) stand-in files, with an artifact manifest"""
+    weights = tmp_path / f"{name}.pth"
+    artifact = tmp_path / f"{name}.int8.pt"
+    weights.write_bytes(b"weights")
+    artifact.write_bytes(b"artifact v1")
+    write_manifest(str(artifact), "torchscript")
+    return LazyPyTorchModel(name=f"test-{name}", pinned=False, model_path=str(weights),
+                            artifact_path=str(artifact), onnx_path=None, engine=PyTorchEngine("int8"))
+
+
+def test_cascade_version_is_known_before_either_stage_loads(tmp_path):
+    small, primary = stage(tmp_path, "small"), stage(tmp_path, "primary")
+    cascade = CascadeModel(small, primary)
+    assert small.model is None and primary.model is None
+    for name in ("small", "primary"):
+        assert read_manifest(str(tmp_path / f"{name}.int8.pt"))["sha256"][:16] in cascade.version
+
+
+def test_cascade_version_changes_when_a_stage_reloads_from_a_replaced_artifact(tmp_path):
+    small = stage(tmp_path, "small")
+    cascade = CascadeModel(small, stage(tmp_path, "primary"))
+    before = cascade.version
+
+    # replaced on disk while the stage is loaded: what it serves has not changed yet
+    (tmp_path / "small.int8.pt").write_bytes(b"artifact v2")
+    write_manifest(str(tmp_path / "small.int8.pt"), "torchscript")
+    assert cascade.version == before
+
+    # evicted: the next load reads the new artifact
+    small.clear_model()
+    assert cascade.version != before
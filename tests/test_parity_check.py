@@ -0,0 +1,53 @@
+# Copyright (C) 2025 Colin Damon
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Tests for the torch-optimized engine's parity check inputs
+(backend.model.parity_check_batch)
+
+Run from the repo root with: python -m pytest tests
+"""
+
+import logging
+from PIL import Image
+import backend.model as model
+from backend.preprocess import Preprocessor
+
+
+def test_validation_csv_images_are_used_when_no_directory_is_set(tmp_path, monkeypatch):
+    (tmp_path / "cars_train").mkdir()
+    for name in ("00001.jpg", "00003.jpg"):
+        Image.new("RGB", (300, 260), "red").save(tmp_path / "cars_train" / name)
+    csv_path = tmp_path / "val.csv"
+    csv_path.write_text("class_id,class_name,bbox,filename\n"
+                        '1,AM General Hummer SUV 2000,"[0, 0, 10, 10]",cars_train/00001.jpg\n'
+                        '2,Acura RL Sedan 2012,"[0, 0, 10, 10]",cars_train/00002.jpg\n'
+                        '3,Acura TL Sedan 2012,"[0, 0, 10, 10]",cars_train/00003.jpg\n')
+    monkeypatch.setattr(model, "DATASET_DIR", str(tmp_path))
+
+    batch, real_images = model.parity_check_batch(Preprocessor(), image_dir="", num_samples=16,
+                                                  csv_path=str(csv_path))
+    assert real_images
+    # the missing 00002.jpg is skipped
+    assert batch.shape == (2, 3, 224, 224)
+
+
+def test_warns_that_top1_is_not_checked_without_validation_images(tmp_path, caplog):
+    with caplog.at_level(logging.WARNING, logger="backend.model"):
+        batch, real_images = model.parity_check_batch(Preprocessor(), image_dir="", num_samples=4,
+                                                      csv_path=str(tmp_path / "missing.csv"))
+    assert not real_images
+    assert batch.shape == (4, 3, 224, 224)
+    assert "top-1 agreement" in caplog.text
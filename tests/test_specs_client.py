@@ -0,0 +1,130 @@
+# Copyright (C) 2025 Colin Damon
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Tests for the pooled async car specs client (backend.specs_client)
+
+Run from the repo root with: python -m pytest tests
+"""
+
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import httpx
+from backend.specs_client import SpecsClient
+
+SPECS = [{"class": "midsize car", "displacement": 4.4, "cylinders": 8,
+          "fuel_type": "gas", "transmission": "a", "drive": "rwd"}]
+
+
+def mock_transport(delay=0.05):
+    """Returns: (httpx.MockTransport answering SPECS after delay seconds, list of requests it got)"""
+    requests = []
+
+    async def handler(request):
+        requests.append(request)
+        await asyncio.sleep(delay)
+        return httpx.Response(200, json=SPECS)
+
+    return httpx.MockTransport(handler), requests
+
+
+def test_concurrent_lookups_of_one_car_send_one_request():
+    transport, requests = mock_transport()
+    client = SpecsClient(url="http://specs.test/v1/cars", transport=transport)
+
+    async def run():
+        results = await asyncio.gather(*(client.fetch((2012, "BMW", "M5"), "key") for _ in range(20)))
+        await client.close()
+        return results
+
+    results = asyncio.run(run())
+    assert len(requests) == 1
+    assert all(result == (SPECS, True) for result in results)
+    assert client.coalesced == 19
+
+
+def test_lookups_of_different_cars_are_not_coalesced():
+    transport, requests = mock_transport()
+    client = SpecsClient(url="http://specs.test/v1/cars", transport=transport)
+    keys = [(2012, "BMW", "M5"), (2010, "Audi", "S4"), (2007, "Ford", "Focus")]
+
+    async def run():
+        await asyncio.gather(*(client.fetch(key, "key") for key in keys * 4))
+        await client.close()
+
+    asyncio.run(run())
+    assert sorted(request.url.params["make"] for request in requests) == ["Audi", "BMW", "Ford"]
+
+
+def test_concurrency_cap():
+    in_flight = peak = 0
+
+    async def handler(request):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.02)
+        in_flight -= 1
+        return httpx.Response(200, json=SPECS)
+
+    client = SpecsClient(url="http://specs.test/v1/cars", max_concurrency=2,
+                         transport=httpx.MockTransport(handler))
+
+    async def run():
+        await asyncio.gather(*(client.fetch((2000 + i, "BMW", "M5"), "key") for i in range(8)))
+        await client.close()
+
+    asyncio.run(run())
+    assert peak == 2
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Keep-alive stand-in for the specs API that records each client port"""
+    protocol_version = "HTTP/1.1"
+    ports = []
+
+    def do_GET(self):
+        self.ports.append(self.client_address[1])
+        body = json.dumps(SPECS).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_sequential_lookups_reuse_one_pooled_connection():
+    StandInHandler.ports = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = SpecsClient(url=f"http://127.0.0.1:{server.server_address[1]}/v1/cars")
+
+    async def run():
+        for year in range(2000, 2010):
+            assert await client.fetch((year, "BMW", "M5"), "key") == (SPECS, True)
+        await client.close()
+
+    try:
+        asyncio.run(run())
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert len(StandInHandler.ports) == 10
+    assert len(set(StandInHandler.ports)) == 1
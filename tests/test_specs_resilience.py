@@ -0,0 +1,243 @@
+# Copyright (C) 2025 Colin Damon
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Tests for the specs lookup's resilience: circuit breaker, retries,
+deadlines and serving stale cache entries, against a fault-injecting
+local mock of the specs API
+
+Run from the repo root with: python -m pytest tests
+"""
+
+import asyncio
+import time
+import httpx
+import backend.car_specs as car_specs
+from backend.specs_cache import SpecsCache
+from backend.specs_client import CircuitBreaker, SpecsClient
+from backend.specs_snapshot import SpecsSnapshot
+
+SPECS = [{"class": "midsize car", "displacement": 4.4, "cylinders": 8,
+          "fuel_type": "gas", "transmission": "a", "drive": "rwd"}]
+URL = "http://specs.test/v1/cars"
+
+
+class FaultyAPI:
+    """
+    Mock specs API whose answers can be switched between test steps:
+    "ok" (200), "error" (503) or "hang" (no answer for an hour).
+    Answers take delay seconds.
+    """
+    def __init__(self, mode="ok", delay=0.0, data=SPECS):
+        self.mode = mode
+        self.delay = delay
+        self.data = data
+        self.requests = 0
+        self.transport = httpx.MockTransport(self.handle)
+
+    async def handle(self, request):
+        self.requests += 1
+        await asyncio.sleep(3600 if self.mode == "hang" else self.delay)
+        if self.mode == "error":
+            return httpx.Response(503)
+        return httpx.Response(200, json=self.data)
+
+
+def test_breaker_opens_rejects_and_closes_after_a_good_probe():
+    api = FaultyAPI("error")
+    breaker = CircuitBreaker(window=3, min_calls=3, failure_rate=0.5, open_seconds=0.1)
+    client = SpecsClient(url=URL, transport=api.transport, retries=0, breaker=breaker)
+
+    async def run():
+        for year in (2010, 2011, 2012):
+            assert await client.fetch((year, "BMW", "M5"), "key") == (None, False)
+        assert breaker.state == "open"
+
+        # open: rejected without calling the API
+        assert await client.fetch((2013, "BMW", "M5"), "key") == (None, False)
+        assert api.requests == 3
+
+        # half open: a failed probe opens it again
+        await asyncio.sleep(0.15)
+        assert await client.fetch((2013, "BMW", "M5"), "key") == (None, False)
+        assert api.requests == 4
+        assert breaker.state == "open"
+
+        # half open: a good probe closes it
+        api.mode = "ok"
+        await asyncio.sleep(0.15)
+        assert await client.fetch((2013, "BMW", "M5"), "key") == (SPECS, True)
+        assert breaker.state == "closed"
+        await client.close()
+
+    asyncio.run(run())
+    # closed -> open -> half_open -> open -> half_open -> closed
+    assert breaker.transitions == 5
+
+
+def test_slow_calls_open_the_breaker():
+    api = FaultyAPI("ok", delay=0.05)
+    breaker = CircuitBreaker(window=2, min_calls=2, slow_call_seconds=0.03, slow_call_rate=1.0)
+    client = SpecsClient(url=URL, transport=api.transport, retries=0, breaker=breaker)
+
+    async def run():
+        for year in (2010, 2011):
+            assert await client.fetch((year, "BMW", "M5"), "key") == (SPECS, True)
+        await client.close()
+
+    asyncio.run(run())
+    assert breaker.state == "open"
+
+
+def test_queueing_behind_the_concurrency_cap_does_not_open_the_breaker():
+    # 40 lookups of different cars, 4 at a time, 300 ms each: the last ones
+    # run out of time waiting for a slot, which is not the API's doing
+    api = FaultyAPI("ok", delay=0.3)
+    breaker = CircuitBreaker()
+    client = SpecsClient(url=URL, transport=api.transport, max_concurrency=4, deadline_seconds=3, breaker=breaker)
+
+    async def run():
+        results = await asyncio.gather(*(client.fetch((1990 + i, "BMW", "M5"), "key") for i in range(40)))
+        await client.close()
+        return results
+
+    results = asyncio.run(run())
+    assert breaker.state == "closed"
+    assert breaker.stats()["recent_failures"] == 0
+    answered = sum(1 for result in results if result == (SPECS, True))
+    assert 0 < answered < 40
+
+
+def test_retry_backoff_stays_within_full_jitter_bounds():
+    api = FaultyAPI("error")
+    client = SpecsClient(url=URL, transport=api.transport, retries=3, backoff_seconds=0.01,
+                         deadline_seconds=5, breaker=CircuitBreaker(min_calls=100))
+    backoffs = []
+    backoff = client._backoff
+
+    def recording_backoff(attempt):
+        backoffs.append((attempt, backoff(attempt)))
+        return backoffs[-1][1]
+
+    client._backoff = recording_backoff
+
+    async def run():
+        result = await client.fetch((2012, "BMW", "M5"), "key")
+        await client.close()
+        return result
+
+    assert asyncio.run(run()) == (None, False)
+    assert api.requests == 4
+    assert [attempt for attempt, _ in backoffs] == [1, 2, 3]
+    for attempt, seconds in backoffs:
+        assert 0 <= seconds <= 0.01 * 2 ** (attempt - 1)
+
+
+def test_client_errors_are_not_retried():
+    client = SpecsClient(url=URL, transport=httpx.MockTransport(lambda request: httpx.Response(401)),
+                         retries=3, backoff_seconds=0.01)
+
+    async def run():
+        result = await client.fetch((2012, "BMW", "M5"), "bad key")
+        await client.close()
+        return result
+
+    assert asyncio.run(run()) == (None, False)
+    assert client.requests_sent == 1
+
+
+def test_lookup_gives_up_at_its_deadline():
+    api = FaultyAPI("hang")
+    client = SpecsClient(url=URL, transport=api.transport, deadline_seconds=0.2)
+
+    async def run():
+        start = time.monotonic()
+        result = await client.fetch((2012, "BMW", "M5"), "key")
+        elapsed = time.monotonic() - start
+        await client.close()
+        return result, elapsed
+
+    result, elapsed = asyncio.run(run())
+    assert result == (None, False)
+    assert elapsed < 1
+
+
+def test_coalesced_callers_each_wait_until_their_own_deadline():
+    api = FaultyAPI("ok", delay=0.3)
+    client = SpecsClient(url=URL, transport=api.transport)
+
+    async def run():
+        results = await asyncio.gather(
+            client.fetch((2012, "BMW", "M5"), "key", deadline_seconds=0.1),
+            client.fetch((2012, "BMW", "M5"), "key", deadline_seconds=2),
+        )
+        await client.close()
+        return results
+
+    impatient, patient = asyncio.run(run())
+    assert impatient == (None, False)
+    assert patient == (SPECS, True)
+    assert api.requests == 1
+
+
+def test_stale_entry_is_served_while_it_is_refreshed(tmp_path, monkeypatch):
+    # entries expire as soon as they are written, and stay servable stale for an hour
+    cache = SpecsCache(str(tmp_path / "specs.sqlite3"), ttl_seconds=-1, stale_seconds=3600)
+    key = (2012, "BMW", "M5")
+    stale = {"Class": "Old", "Engine": "", "Fuel Type": "", "Transmission": "", "Drivetrain": ""}
+    cache.put(key, stale)
+    api = FaultyAPI("ok", delay=0.1)
+    client = SpecsClient(url=URL, transport=api.transport)
+    monkeypatch.setattr(car_specs, "get_specs_snapshot", lambda: SpecsSnapshot(path=""))
+    monkeypatch.setattr(car_specs, "get_specs_cache", lambda: cache)
+    monkeypatch.setattr(car_specs, "get_specs_client", lambda: client)
+    monkeypatch.setattr(car_specs, "get_api_key", lambda: "key")
+
+    async def run():
+        start = time.monotonic()
+        specs = await car_specs.fetch_car_specs("BMW M5 Sedan 2012")
+        elapsed = time.monotonic() - start
+        await asyncio.gather(*car_specs._refresh_tasks)
+        await client.close()
+        return specs, elapsed
+
+    specs, elapsed = asyncio.run(run())
+    assert specs == stale
+    # answered without waiting for the API
+    assert elapsed < 0.1
+    assert api.requests == 1
+    assert cache.lookup(key)[0]["Class"] == "Midsize Car"
+
+
+def test_stale_entry_is_served_while_the_api_is_down(tmp_path, monkeypatch):
+    cache = SpecsCache(str(tmp_path / "specs.sqlite3"), ttl_seconds=-1, stale_seconds=3600)
+    key = (2012, "BMW", "M5")
+    cache.put(key, {"Class": "Old"})
+    api = FaultyAPI("error")
+    client = SpecsClient(url=URL, transport=api.transport, retries=0)
+    monkeypatch.setattr(car_specs, "get_specs_snapshot", lambda: SpecsSnapshot(path=""))
+    monkeypatch.setattr(car_specs, "get_specs_cache", lambda: cache)
+    monkeypatch.setattr(car_specs, "get_specs_client", lambda: client)
+    monkeypatch.setattr(car_specs, "get_api_key", lambda: "key")
+
+    async def run():
+        specs = await car_specs.fetch_car_specs("BMW M5 Sedan 2012")
+        await asyncio.gather(*car_specs._refresh_tasks)
+        await client.close()
+        return specs
+
+    assert asyncio.run(run()) == {"Class": "Old"}
+    # the failed refresh left the stale entry in place
+    assert cache.lookup(key) == ({"Class": "Old"}, False)
@@ -0,0 +1,38 @@
+# Copyright (C) 2025 Colin Damon
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Tests for the inference pool's shared memory (backend.workers)
+
+Run from the repo root with: python -m pytest tests
+"""
+
+from multiprocessing import resource_tracker, shared_memory
+from backend.workers import _attach_shared_memory
+
+
+def test_workers_attach_to_a_slot_without_registering_it(monkeypatch):
+    slot = shared_memory.SharedMemory(create=True, size=1024)
+    registered = []
+    monkeypatch.setattr(resource_tracker, "register", lambda name, rtype: registered.append(name))
+    try:
+        attached = _attach_shared_memory(slot.name)
+        attached.buf[0] = 7
+        attached.close()
+        assert slot.buf[0] == 7
+        assert registered == []
+    finally:
+        slot.close()
+        slot.unlink()